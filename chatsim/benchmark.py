@@ -0,0 +1,182 @@
+"""
+Benchmark of the simulation loop (Moderator / AgendaUser / TemplateNLG) which needs neither a Rasa NLU server nor a
+trained chatbot: the rule based ChatBot answers the user and the chatbot responses are annotated by the in-memory
+KeywordNLUBackend.
+
+    python -m chatsim.benchmark --episodes 100 1000 --output benchmark.json
+
+Every episode count is run in a new process. Its throughput (episodes/sec, turns/sec) is measured without
+instrumentation, the p50/p95/p99 latency of every stage of the loop (see chatsim.utils.instrumentation) by a second,
+instrumented run of the same episodes, and the peak RSS is the one of the process after both runs. The results are
+reported and written to a json file, so they can be compared between versions.
+"""
+import argparse
+import json
+import logging
+import multiprocessing
+import platform
+import sys
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from chatsim.moderator import Moderator, CURRENT_DIR
+from chatsim.user import User, CorpusGoalSampler
+from chatsim.utils import read_user_profile
+from chatsim.utils.instrumentation import Instrumentation, PERCENTILES
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+BENCHMARK_NLU_CONFIG = {
+    'backend': 'keyword'
+}
+BENCHMARK_EPISODES = [100, 1000]
+BENCHMARK_SEED = 0
+BENCHMARK_OUTPUT = 'benchmark.json'
+
+
+def peak_rss_mb():
+    """
+    Peak resident set size of the process in MB (None if it is not available on this platform).
+    """
+    if resource is None:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes on Linux
+    return max_rss / (1 << 20) if sys.platform == 'darwin' else max_rss / (1 << 10)
+
+
+def latency_summary(histogram):
+    """
+    Count, mean and percentiles (see PERCENTILES) of the durations of a stage, in milliseconds.
+    """
+    summary = OrderedDict(count=histogram.count)
+    if not histogram.count:
+        return summary
+    summary['mean_ms'] = histogram.sum / histogram.count * 1000
+    for percentile in PERCENTILES:
+        summary['p{}_ms'.format(percentile)] = histogram.percentile(percentile) * 1000
+    return summary
+
+
+def create_moderator(user, instrumentation=None):
+    moderator = Moderator(user=user, nlu_config=BENCHMARK_NLU_CONFIG, instrumentation=instrumentation)
+    moderator.usersimulator = moderator.create_usersimulator()
+    moderator.initialize(user)
+    return moderator
+
+
+def simulate(user, user_goals, seed, instrumentation):
+    """
+    Run the episodes of user_goals with a new moderator and return (seconds, number of turns, number of successes).
+    """
+    moderator = create_moderator(user, instrumentation)
+    num_of_turns, num_of_successes = 0, 0
+    start = time.perf_counter()
+    for i, user_goal in enumerate(user_goals):
+        result = moderator.run_episode(user_goal, seed=[seed, i])
+        num_of_turns += result.num_of_turns
+        num_of_successes += result.success
+    return time.perf_counter() - start, num_of_turns, num_of_successes
+
+
+def run_benchmark(num_of_episodes, seed=BENCHMARK_SEED, instrumentation=None):
+    """
+    Simulate num_of_episodes conversations twice: without instrumentation to measure the throughput and with it to
+    measure the latency of every stage.
+
+    Args:
+        - num_of_episodes (int): number of conversations
+        - seed (int): seed of the user goals and of the user simulator
+        - instrumentation (Instrumentation): records the stage timings of the instrumented run (a new one by default)
+    Returns:
+        - result (OrderedDict): throughput, per-stage latency and peak RSS of the run. The peak RSS is the one of the
+          process so far, see run_benchmark_process.
+    """
+    user = User(user_profile=read_user_profile(CURRENT_DIR / 'user/sample_user_profile.yml'))
+    user_goals = list(CorpusGoalSampler(seed=seed).generate(num_of_episodes))
+    if instrumentation is None:
+        instrumentation = Instrumentation()
+
+    elapsed, num_of_turns, num_of_successes = simulate(user, user_goals, seed, Instrumentation(enabled=False))
+    instrumented_elapsed, _, _ = simulate(user, user_goals, seed, instrumentation)
+
+    return OrderedDict([
+        ('episodes', num_of_episodes),
+        ('turns', num_of_turns),
+        ('success_rate', num_of_successes / num_of_episodes if num_of_episodes else None),
+        ('seconds', elapsed),
+        ('episodes_per_sec', num_of_episodes / elapsed if elapsed else None),
+        ('turns_per_sec', num_of_turns / elapsed if elapsed else None),
+        ('instrumented_seconds', instrumented_elapsed),
+        ('stages', OrderedDict((stage, latency_summary(histogram))
+                               for stage, histogram in instrumentation.calls.items())),
+        ('peak_rss_mb', peak_rss_mb()),
+    ])
+
+
+def run_benchmark_process(num_of_episodes, seed=BENCHMARK_SEED):
+    """
+    run_benchmark in a new process, so its peak RSS is not the one of the previous (larger) runs.
+
+    Returns:
+        - (result (OrderedDict), instrumentation (Instrumentation) of the instrumented run)
+    """
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as executor:
+        return executor.submit(_run_benchmark, num_of_episodes, seed).result()
+
+
+def _run_benchmark(num_of_episodes, seed):
+    instrumentation = Instrumentation()
+    return run_benchmark(num_of_episodes, seed=seed, instrumentation=instrumentation), instrumentation
+
+
+def format_result(result):
+    lines = ['{episodes} episodes, {turns} turns in {seconds:.3f}s ({instrumented_seconds:.3f}s instrumented): '
+             '{episodes_per_sec:.1f} episodes/sec, {turns_per_sec:.1f} turns/sec, peak RSS {peak_rss_mb} MB'.format(
+                 **result)]
+    for stage, summary in result['stages'].items():
+        lines.append('  {:<10} {}'.format(stage, ', '.join(
+            '{}={:.4f}'.format(key, value) if isinstance(value, float) else '{}={}'.format(key, value)
+            for key, value in summary.items())))
+    return '\n'.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the simulation loop with a fake NLU and chatbot")
+    parser.add_argument('--episodes', type=int, nargs='+', default=BENCHMARK_EPISODES,
+                        help="number of episodes of every run")
+    parser.add_argument('--seed', type=int, default=BENCHMARK_SEED)
+    parser.add_argument('--output', type=Path, default=Path(BENCHMARK_OUTPUT),
+                        help="json file the results are written to")
+    parser.add_argument('--prometheus', type=Path, default=None,
+                        help="Prometheus text file the stage histograms of the last run are written to")
+    args = parser.parse_args()
+
+    runs = []
+    for num_of_episodes in args.episodes:
+        result, instrumentation = run_benchmark_process(num_of_episodes, seed=args.seed)
+        print(format_result(result))
+        runs.append(result)
+    if args.prometheus is not None:
+        instrumentation.write_prometheus(args.prometheus)
+
+    report = OrderedDict([
+        ('timestamp', time.strftime('%Y-%m-%dT%H:%M:%S%z')),
+        ('python', platform.python_version()),
+        ('platform', platform.platform()),
+        ('seed', args.seed),
+        ('runs', runs),
+    ])
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
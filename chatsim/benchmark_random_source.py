@@ -0,0 +1,76 @@
+"""
+Benchmark of the random source of the user simulator (see chatsim.utils.RandomSource): the cost per episode of
+drawing the random numbers of an episode, with and without re-seeding the source at every episode, compared with
+numpy's global random functions.
+
+    python -m chatsim.benchmark_random_source --episodes 10000 --draws 10
+"""
+import argparse
+import timeit
+from collections import OrderedDict
+
+import numpy as np
+
+from chatsim.utils import RandomSource
+
+BENCHMARK_EPISODES = 10000
+BENCHMARK_SEED = 0
+# random numbers drawn by the user simulator in an episode (about 10 with the sample user profile)
+BENCHMARK_DRAWS_PER_EPISODE = 10
+
+
+def run_random_source_benchmark(num_of_episodes=BENCHMARK_EPISODES, draws_per_episode=BENCHMARK_DRAWS_PER_EPISODE,
+                                repeat=5):
+    """
+    Microseconds per episode of drawing draws_per_episode uniform numbers (best of repeat runs):
+        - random_source_seeded: RandomSource re-seeded at every episode (seeded simulation)
+        - random_source: RandomSource which is never re-seeded (unseeded simulation)
+        - np_random_seeded: np.random.seed at every episode, then np.random.rand
+        - np_random: np.random.rand
+    """
+    random_source = RandomSource()
+    draws = range(draws_per_episode)
+
+    def random_source_seeded():
+        for i in range(num_of_episodes):
+            random_source.seed([BENCHMARK_SEED, i])
+            for _ in draws:
+                random_source()
+
+    def random_source_unseeded():
+        for i in range(num_of_episodes):
+            for _ in draws:
+                random_source()
+
+    def np_random_seeded():
+        for i in range(num_of_episodes):
+            np.random.seed(i)
+            for _ in draws:
+                np.random.rand()
+
+    def np_random():
+        for i in range(num_of_episodes):
+            for _ in draws:
+                np.random.rand()
+
+    return OrderedDict((name, min(timeit.repeat(function, number=1, repeat=repeat)) / num_of_episodes * 1e6)
+                       for name, function in [('random_source_seeded', random_source_seeded),
+                                              ('random_source', random_source_unseeded),
+                                              ('np_random_seeded', np_random_seeded),
+                                              ('np_random', np_random)])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the random source of the user simulator")
+    parser.add_argument('--episodes', type=int, default=BENCHMARK_EPISODES)
+    parser.add_argument('--draws', type=int, default=BENCHMARK_DRAWS_PER_EPISODE,
+                        help="random numbers drawn per episode")
+    args = parser.parse_args()
+
+    results = run_random_source_benchmark(args.episodes, args.draws)
+    print('Microseconds per episode of {} draws: {}'.format(
+        args.draws, ', '.join('{}={:.2f}'.format(name, us) for name, us in results.items())))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,144 +1,791 @@
-from chatsim.nlu.rasa.rasanlu import RasaNLU
-from chatsim.chatbot.transformer_movie.chatbot import ChatBot
-# from chatsim.chatbot.rule_based.chatbot import ChatBot
+from chatsim.nlu.augmenter import SELECT_ENTITY_AUGMENTER
+from chatsim.nlu.backends import create_nlu_backend
+from chatsim.nlu.rasa.cache import NLUCache
+from chatsim.nlu.rasa.rasanlu import MODELS_DIR
 
 from chatsim.usersimulator.agenda_user import AgendaUser
 from chatsim.user import User
 from chatsim.nlg import TemplateNLG
-from chatsim.utils import Annotation, DiagAct, Goal, UserGoal, read_user_profile
-from chatsim.utils.diagact import *
-
+from chatsim.utils import Annotation, Goal, UserGoal, ConversationHistory, RandomSource
+from chatsim.utils.diagact import get_diagact
+from chatsim.utils.instrumentation import Instrumentation, NULL_EPISODE_TIMINGS
+from chatsim.utils.transcripts import TranscriptSink, create_transcript_sink
+from chatsim.utils.results import ResultsStore
+from chatsim.utils.checkpoint import Checkpoint, goals_digest
+from chatsim.utils.recording import EpisodeRecording, RecordingRandomSource, ReplayRandomSource, ReplayChatBot, \
+    ReplayDivergence, replay_matches, write_recordings
+
+from collections import namedtuple, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+import asyncio
+import importlib
+import json
+import multiprocessing
 import os
 import logging
+import sys
+import time
 
 CURRENT_DIR = Path(os.path.dirname(__file__))
 
+# chatbot name -> 'module:class' of the chatbots the user can talk to, a chatbot is imported only when it is used
+CHATBOTS = {
+    'rule_based': 'chatsim.chatbot.rule_based.chatbot:ChatBot',
+    'transformer_movie': 'chatsim.chatbot.transformer_movie.chatbot:ChatBot',
+}
+CHATBOT = 'rule_based'
+
 MAX_TURNS = 15
-NLU_MODEL_PATH = '/home/mansour/usersimulator/chatsim/nlu/rasa/trained_models/spacy_web_lg-tk_spacy-intent_sklearn-ner_spacy'
+NLU_MODEL_PATH = str(MODELS_DIR / 'spacy_web_lg-tk_spacy-intent_sklearn-ner_spacy')
 NLU_PROJECT = 'm2m-m'
 NLU_MODEL = 'default_intent_classifier.yml'
-NUMBER_OF_RUNS = 100
-
-AGENDA_USER_PARAMS = {
-    'max_turn': MAX_TURNS
+NLU_PORT = 5000
+# NLU backend used to annotate chatbot responses, see chatsim.nlu.backends.NLU_BACKENDS
+# ('http' for the Rasa NLU server, 'interpreter' for an in-process Interpreter, 'keyword' for a fake NLU)
+NLU_CONFIG = {
+    'backend': 'http',
+    'project_name': NLU_PROJECT,
+    'model_name': NLU_MODEL,
+    'port': NLU_PORT
 }
+# NLU_CONFIG = {
+#     'backend': 'interpreter',
+#     'model_dir': NLU_MODEL_PATH
+# }
+NUMBER_OF_RUNS = 100
+# seed of the simulation (see episode_seed), None for a non-reproducible simulation
+SIMULATION_SEED = None
+# number of worker processes used to run the simulation (1 runs every conversation in the current process)
+NUMBER_OF_WORKERS = 1
+# number of episodes a worker of Moderator.simulate_parallel runs before sending their results back
+PARALLEL_CHUNK_SIZE = 32
+# number of conversations in flight and size of the NLU connection pool for Moderator.simulate_async, the NLU runs
+# at most NLU_POOL_SIZE requests at the same time so there are never more conversations in flight than that
+NLU_POOL_SIZE = 20
+MAX_CONCURRENT_EPISODES = NLU_POOL_SIZE
+# number of conversations whose chatbot responses are parsed together by Moderator.simulate_batch
+NLU_BATCH_SIZE = 64
+# NLU responses are cached in memory (and persisted to NLU_CACHE_PATH if it is set), 0 disables the cache
+NLU_CACHE_SIZE = 10000
+NLU_CACHE_PATH = None
+# deterministic user utterances are cached by the NLG (0 disables the cache)
+NLG_CACHE_SIZE = 10000
+
+# per-stage timing of the simulation loop (see chatsim.utils.instrumentation), reported at the end of the simulation
+# and written to the json / Prometheus text files if their path is set
+INSTRUMENTATION = False
+INSTRUMENTATION_JSON_PATH = None
+INSTRUMENTATION_PROMETHEUS_PATH = None
+
+# transcripts of the episodes are written to TRANSCRIPT_PATH as JSON Lines (gzip compressed if it ends with .gz),
+# None drops them
+TRANSCRIPT_PATH = None
+# per-episode and per-turn results of the last simulation are kept in Moderator.results and saved to RESULTS_PATH
+# (.npz) if it is set. KEEP_RESULTS = False only keeps the running metrics, so the memory of a simulation does not
+# grow with its number of episodes (the transcript sink still gets every episode)
+RESULTS_PATH = None
+KEEP_RESULTS = True
+# progress of Moderator.simulate is saved to CHECKPOINT_PATH every CHECKPOINT_INTERVAL episodes (None disables it)
+CHECKPOINT_PATH = None
+CHECKPOINT_INTERVAL = 1000
+# an episode which raises a transient error (see transient_errors, e.g. the NLU server does not answer) is retried
+# EPISODE_RETRIES times, waiting EPISODE_RETRY_DELAY seconds (doubled after every attempt), and then quarantined
+EPISODE_RETRIES = 2
+EPISODE_RETRY_DELAY = 1.0
+# profile of the simulated user (key of the user profile file), None for the first profile of the file
+USER_PROFILE = None
+
+# sliding window of the history given to the chatbot (last HISTORY_MAX_TURNS utterances and/or
+# HISTORY_MAX_TOKENS tokens), None keeps the whole conversation
+HISTORY_MAX_TURNS = None
+HISTORY_MAX_TOKENS = None
 
 logging.basicConfig()
 logging.getLogger().setLevel(logging.ERROR)
 
+# annotations: user acts (user turns) or NLU annotation (chatbot turns) of every utterance of conversation_log
+# user_goal: goal of the episode
+# timings: {stage: [count, seconds]} of the episode if the instrumentation is enabled
+# nlu_confidences: NLU intent confidence of every chatbot utterance
+# failure_reason: chatbot act which made the user fail (None if the user did not fail)
+EpisodeResult = namedtuple('EpisodeResult', ['num_of_turns', 'failed', 'success', 'conversation_log', 'annotations',
+                                             'user_goal', 'timings', 'nlu_confidences', 'failure_reason'],
+                           defaults=(None, None, None, None, None))
+
+
+def default_config():
+    """
+    Configuration of a Moderator made of the module constants: every key is the lower case name of its constant,
+    except 'nlu' (NLU_CONFIG), 'seed' (SIMULATION_SEED), 'num_of_runs' (NUMBER_OF_RUNS) and 'workers'
+    (NUMBER_OF_WORKERS). The constants are read when the configuration is made, so they can be changed at runtime.
+    """
+    return {
+        'chatbot': CHATBOT,
+        'nlu': dict(NLU_CONFIG),
+        'user_profile': USER_PROFILE,
+        'max_turns': MAX_TURNS,
+        'num_of_runs': NUMBER_OF_RUNS,
+        'seed': SIMULATION_SEED,
+        'workers': NUMBER_OF_WORKERS,
+        'parallel_chunk_size': PARALLEL_CHUNK_SIZE,
+        'max_concurrent_episodes': MAX_CONCURRENT_EPISODES,
+        'nlu_pool_size': NLU_POOL_SIZE,
+        'nlu_batch_size': NLU_BATCH_SIZE,
+        'nlu_cache_size': NLU_CACHE_SIZE,
+        'nlu_cache_path': NLU_CACHE_PATH,
+        'nlg_cache_size': NLG_CACHE_SIZE,
+        'history_max_turns': HISTORY_MAX_TURNS,
+        'history_max_tokens': HISTORY_MAX_TOKENS,
+        'instrumentation': INSTRUMENTATION,
+        'instrumentation_json_path': INSTRUMENTATION_JSON_PATH,
+        'instrumentation_prometheus_path': INSTRUMENTATION_PROMETHEUS_PATH,
+        'transcript_path': TRANSCRIPT_PATH,
+        'results_path': RESULTS_PATH,
+        'keep_results': KEEP_RESULTS,
+        'checkpoint_path': CHECKPOINT_PATH,
+        'checkpoint_interval': CHECKPOINT_INTERVAL,
+        'episode_retries': EPISODE_RETRIES,
+        'episode_retry_delay': EPISODE_RETRY_DELAY,
+    }
+
+
+def chatbot_class(name):
+    """
+    Import the class of the chatbot registered as name in CHATBOTS.
+    """
+    if name not in CHATBOTS:
+        raise ValueError("Unknown chatbot {}! Choose one of {}".format(name, list(CHATBOTS)))
+    module_name, class_name = CHATBOTS[name].split(':')
+    return getattr(importlib.import_module(module_name), class_name)
 
-class Moderator(object):
 
-    def __init__(self, user=None):
-        self.chatbot = ChatBot()
+class Moderator(object):
+    """
+    Runs conversations between the user simulator and a chatbot whose responses are annotated by an NLU backend.
+
+    Attributes:
+        - config (dict): configuration of the moderator, see default_config
+    """
+    def __init__(self, user=None, nlu_config=None, instrumentation=None, transcript_sink=None, config=None):
+        self.config = default_config()
+        for key, value in (config or {}).items():
+            if key not in self.config:
+                raise ValueError("Unknown moderator configuration {}! Choose one of {}".format(key, list(self.config)))
+            self.config[key] = value
+        if nlu_config is not None:
+            self.config['nlu'] = nlu_config
+        config = self.config
+        if config['checkpoint_interval'] < 1:
+            raise ValueError("checkpoint_interval should be at least 1!")
+        if not config['keep_results'] and config['results_path'] is not None:
+            raise ValueError("The results are not kept, so they cannot be saved to {}".format(config['results_path']))
+
+        self._chatbot_class = chatbot_class(config['chatbot'])
+        self.chatbot = self._chatbot_class()
         self.usersimulator = None
-        self.nlu = RasaNLU()
-        self.nlg = TemplateNLG()
+        self.nlu_config = config['nlu']
+        nlu_cache = None
+        if config['nlu_cache_size']:
+            nlu_cache = NLUCache(max_size=config['nlu_cache_size'], path=config['nlu_cache_path'])
+        self.nlu = create_nlu_backend(self.nlu_config, cache=nlu_cache)
+        self.nlg = TemplateNLG(cache_size=config['nlg_cache_size'])
+        if instrumentation is None:
+            instrumentation = Instrumentation(enabled=config['instrumentation'])
+        self.instrumentation = instrumentation
+        if transcript_sink is None:
+            transcript_sink = create_transcript_sink(config['transcript_path'])
+        self.transcript_sink = transcript_sink
+        self.results = ResultsStore() if config['keep_results'] else None
+        self.quarantined = {}
+        self.replay_mismatches = []
         self.user = user
         self.default_metrics = {
             'success_rate': None,
             'mean_num_of_turns_per_conversation': None
         }
         self.logger = []
+        self._last_result = None
         self.current_user_goal = None
+        self._profile_name = None
+
+    @property
+    def user_profile_name(self):
+        """
+        Name of the profile of the simulated user (the configured one or the first profile of the user).
+        """
+        return self.config['user_profile'] or next(iter(self.user.user_profile))
+
+    def create_usersimulator(self, random_source=None):
+        return AgendaUser(params={'max_turn': self.config['max_turns']}, current_intent='booking',
+                          random_source=random_source)
+
+    def episode_seed(self, episode_index):
+        return episode_seed(episode_index, self.config['seed'])
 
     def initialize(self, user):
         # initialize nlu
-        self.nlu.get_server_response('', NLU_PROJECT, NLU_MODEL, port=5000)
+        self.nlu.get_response('')
 
         # initialize nlg
 
         # initialize usersimulator
-        # self.usersimulator.initialize(user_goals=user.user_goals[0], user_profile=user.user_profile['Mansour'])
+        # self.usersimulator.initialize(user_goals=user.user_goals[0], user_profile=user.user_profile[profile])
 
         # initialize chatbot
         # self.chatbot.get_response('')
 
-    def simulate(self):
-        # num of user goals is equal to num of runs
-        num_of_successful_conversations = 0
-        total_turns = 0
-        for i in range(NUMBER_OF_RUNS):
-            # print(self.user.user_goals[i])
-            self.current_user_goal = self.user.user_goals[i]
-            self.usersimulator.initialize(user_goals=self.current_user_goal,
-                                          user_profile=self.user.user_profile['Mansour'])
-            user_response = self.usersimulator.start_conversation()
-            # print(user_response)
-            user_utterance = self.nlg.get_utterance(user_response)
-            # print(user_utterance)
-            conversation_log = []
-            conversation_log.append(('user',user_utterance))
-
-            num_of_turns = 1
-            episode_over = False
-            failed = False
-            while not episode_over:
-                # get chatbot response
-                # print('Getting CHATBOT RESPONSE')
-
-                # give  the whole history to chatbot
-                user_utterance = ' '.join([t[1] for t in conversation_log])
-                # print(user_utterance)
-                chatbot_response = self.chatbot.get_response(user_utterance.strip())
-                conversation_log.append(('chatbot', chatbot_response))
-                num_of_turns += 1
-
-                # pass chatbot response to NLU to get annotation
-                # print('Getting NLU RESPONSE')
-                chatbot_nlu_output = self.nlu.get_server_response(chatbot_response, NLU_PROJECT, NLU_MODEL, port=5000)
+    def run_episode(self, user_goal, seed=None):
+        """
+        Run a single conversation between the user simulator and the chatbot.
+
+        Args:
+            - user_goal (UserGoal): goal of the simulated user for this conversation
+            - seed: seed of the user simulator random source for this conversation (see episode_seed)
+        Returns:
+            - EpisodeResult
+        """
+        self.current_user_goal = user_goal
+        timings = self.instrumentation.episode()
+        steps = self._episode_steps(user_goal, self.usersimulator, self.chatbot, seed=seed, timings=timings)
+        try:
+            chatbot_response = next(steps)
+            while True:
+                with timings.stage('nlu'):
+                    chatbot_nlu_output = self.nlu.get_response(chatbot_response)
+                chatbot_response = steps.send(chatbot_nlu_output)
+        except StopIteration as stop:
+            return stop.value
+        except Exception:
+            # the chatbot of an interrupted episode (e.g. NLU error) is reset for the next one
+            self.chatbot.asked_entities = set()
+            raise
+
+    def _episode_steps(self, user_goal, usersimulator, chatbot, seed=None, timings=NULL_EPISODE_TIMINGS,
+                       user_profile=None):
+        """
+        Conversation loop of a single episode written as a generator so that different drivers (blocking,
+        asyncio, ...) can share it. The generator yields every chatbot response that has to be passed to
+        the NLU and expects the NLU output to be sent back. The EpisodeResult is returned when the
+        conversation is over.
+
+        Args:
+            - user_goal (UserGoal): goal of the simulated user for this conversation
+            - usersimulator (AgendaUser): user simulator owned by this episode
+            - chatbot (ChatBot): chatbot owned by this episode
+            - seed: seed of the user simulator random source for this episode
+            - timings (EpisodeTimings): stage timings of this episode (see Instrumentation.episode), the NLU stage
+                is timed by the driver
+            - user_profile (dict): profile of the user, defaults to the configured profile of the moderator user
+        """
+        if user_profile is None:
+            user_profile = self.user.user_profile[self.user_profile_name]
+        usersimulator.initialize(user_goals=user_goal, user_profile=user_profile, seed=seed)
+        with timings.stage('simulator'):
+            user_response = usersimulator.start_conversation()
+        with timings.stage('nlg'):
+            user_utterance = self.nlg.get_utterance(user_response, random_source=usersimulator.random_source)
+        history = ConversationHistory(max_turns=self.config['history_max_turns'],
+                                      max_tokens=self.config['history_max_tokens'])
+        history.append('user', user_utterance)
+        annotations = [user_response]
+        nlu_confidences = []
+
+        num_of_turns = 1
+        episode_over = False
+        failed = False
+        while not episode_over:
+            # give  the whole history to chatbot
+            with timings.stage('chatbot'):
+                chatbot_response = chatbot.get_response(history.text.strip())
+            history.append('chatbot', chatbot_response)
+            num_of_turns += 1
+
+            # pass chatbot response to NLU to get annotation
+            chatbot_nlu_output = yield chatbot_response
+            with timings.stage('annotation'):
                 chatbot_annotations = self._create_annotation(chatbot_nlu_output)
-                # print(chatbot_nlu_output)
-                # print(chatbot_annotations)
-
-                # get usersimulator next response
-                # print('Getting USER RESPONSE')
-                user_response, episode_over, failed = self.usersimulator.next([chatbot_annotations], num_of_turns)
-                user_utterance = self.nlg.get_utterance(user_response)
-                conversation_log.append(('user', user_utterance))
-                num_of_turns += 1
-                if failed:
+            annotations.append([chatbot_annotations])
+            nlu_confidences.append((chatbot_nlu_output.get('intent') or {}).get('confidence'))
+
+            # get usersimulator next response
+            with timings.stage('simulator'):
+                user_response, episode_over, failed = usersimulator.next([chatbot_annotations], num_of_turns)
+            with timings.stage('nlg'):
+                user_utterance = self.nlg.get_utterance(user_response, random_source=usersimulator.random_source)
+            history.append('user', user_utterance)
+            annotations.append(user_response)
+            num_of_turns += 1
+            if failed:
+                break
+
+        chatbot.asked_entities = set()
+        success = (num_of_turns < self.config['max_turns']-1) and (not failed)
+        self.instrumentation.end(timings)
+
+        return EpisodeResult(num_of_turns=num_of_turns, failed=failed, success=success,
+                             conversation_log=history.log, annotations=annotations, user_goal=user_goal,
+                             timings=timings.stages or None, nlu_confidences=nlu_confidences,
+                             failure_reason=chatbot_annotations.diagact.name if failed else None)
+
+    def simulate(self, checkpoint_path=None, resume=False):
+        """
+        Run the conversations of the first num_of_runs (see config) user goals one after the other.
+
+        An episode which raises a transient error (see transient_errors, e.g. the NLU server does not answer) is
+        retried episode_retries times and then quarantined (see Moderator.quarantined): it is left out of the metrics
+        and the simulation goes on. Any other error stops the simulation.
+        With a checkpoint path, the progress is saved every checkpoint_interval episodes and when the simulation
+        stops, even on an error or KeyboardInterrupt (see chatsim.utils.checkpoint). A resumed simulation skips the
+        finished episodes of the checkpoint and tries the quarantined ones again. Its transcripts should be appended
+        (create_transcript_sink(path, append=True)); the episodes run after the last checkpoint appear twice in them.
+
+        Args:
+            - checkpoint_path (str): path of the checkpoint file, defaults to the configured checkpoint_path
+            - resume (bool): resume from the checkpoint file if it exists
+        Returns:
+            - metrics (dict)
+        Raises:
+            - ValueError: if the configured user profile is not a profile of the user
+            - TypeError: if a user goal is not a UserGoal
+        """
+        if checkpoint_path is None:
+            checkpoint_path = self.config['checkpoint_path']
+        # num of user goals is equal to num of runs
+        user_goals = self.user.user_goals[:self.config['num_of_runs']]
+        # a configuration error would otherwise fail (and be retried) in every episode
+        self._check_user(user_goals)
+        metrics = self._start_simulation()
+        checkpoint = None
+        if checkpoint_path is not None:
+            checkpoint = Checkpoint(checkpoint_path, seed=self.config['seed'], goals_digest=goals_digest(user_goals))
+            if resume and checkpoint.exists():
+                metrics = self._resume(checkpoint)
+
+        # the random stream of an unseeded simulation goes on from episode to episode, its state between two
+        # episodes is saved with the checkpoint
+        save_random_state = checkpoint is not None and self.config['seed'] is None and self.usersimulator is not None
+        try:
+            if save_random_state:
+                checkpoint.random_state = self.usersimulator.random_source.get_state()
+            for i, user_goal in enumerate(user_goals):
+                if checkpoint is not None and i in checkpoint.completed:
+                    continue
+                result = self._run_episode_with_retries(i, user_goal)
+                if save_random_state:
+                    checkpoint.random_state = self.usersimulator.random_source.get_state()
+                if result is None:
+                    continue
+                self._finish_episode(i, result, metrics)
+                if checkpoint is not None:
+                    checkpoint.completed.add(i)
+                    if len(checkpoint.completed) % self.config['checkpoint_interval'] == 0:
+                        self._save_checkpoint(checkpoint, metrics)
+        finally:
+            if checkpoint is not None:
+                self._save_checkpoint(checkpoint, metrics)
+
+        self._report_quarantined()
+        return self._end_simulation(metrics)
+
+    def _check_user(self, user_goals):
+        if self.user_profile_name not in self.user.user_profile:
+            raise ValueError("Unknown user profile {}! Choose one of {}".format(self.user_profile_name,
+                                                                                list(self.user.user_profile)))
+        for user_goal in user_goals:
+            if not isinstance(user_goal, UserGoal):
+                raise TypeError("Expected a UserGoal, got {!r}".format(user_goal))
+
+    def _run_episode_with_retries(self, episode_index, user_goal):
+        """
+        Run an episode, retrying it if it raises a transient error. Returns None and quarantines the episode if every
+        attempt failed.
+        """
+        attempt = 1
+        while True:
+            try:
+                result = self.run_episode(user_goal, seed=self.episode_seed(episode_index))
+            except Exception as e:
+                delay = self._retry_delay(episode_index, attempt, e)
+                if delay is None:
+                    return None
+                time.sleep(delay)
+                attempt += 1
+                continue
+            self.quarantined.pop(episode_index, None)
+            return result
+
+    def _retry_delay(self, episode_index, attempt, error):
+        """
+        Handle the error of an attempt of an episode: raise it if it is not transient (see transient_errors), return
+        the seconds to wait before the next attempt, or quarantine the episode and return None after the last attempt.
+        """
+        if not isinstance(error, transient_errors()):
+            raise error
+        retries = self.config['episode_retries']
+        logging.warning('Episode {} failed (attempt {}/{}): {!r}'.format(episode_index, attempt, retries + 1, error))
+        if attempt > retries:
+            self.quarantined[episode_index] = {'error': repr(error), 'attempts': attempt}
+            return None
+        return self.config['episode_retry_delay'] * 2 ** (attempt - 1)
+
+    def _report_quarantined(self):
+        if self.quarantined:
+            logging.error('{} episodes were quarantined: {}'.format(len(self.quarantined), sorted(self.quarantined)))
+
+    def _resume(self, checkpoint):
+        """
+        Restore the metrics, results, quarantined episodes and user simulator random state of a checkpoint.
+        """
+        checkpoint.load()
+        if self.results is not None:
+            self.results = ResultsStore.load_segments(checkpoint.results_segments)
+        self.quarantined = dict(checkpoint.quarantined)
+        if checkpoint.random_state is not None and self.usersimulator is not None:
+            self.usersimulator.random_source.set_state(checkpoint.random_state)
+        logging.info('Resuming from {}: {} episodes done, {} quarantined'.format(
+            checkpoint.path, len(checkpoint.completed), len(self.quarantined)))
+        return SimulationMetrics.from_state(checkpoint.metrics)
+
+    def _save_checkpoint(self, checkpoint, metrics):
+        checkpoint.metrics = metrics.state()
+        checkpoint.quarantined = self.quarantined
+        checkpoint.save(self.results)
+
+    def _start_simulation(self):
+        self._profile_name = self.user_profile_name if self.user is not None else None
+        self.results = ResultsStore() if self.config['keep_results'] else None
+        self.quarantined = {}
+        self.replay_mismatches = []
+        return SimulationMetrics()
+
+    def _finish_episode(self, episode_index, result, metrics):
+        """
+        Hand a finished episode to the transcript sink and add it to the metrics. The result is not kept, so the
+        memory of a simulation does not grow with its number of episodes.
+        """
+        self.transcript_sink.write(episode_index, result)
+        if self.results is not None:
+            self.results.add(episode_index, result, profile=self._profile_name)
+        metrics.add(result)
+        self._last_result = result
+
+    def _end_simulation(self, metrics):
+        if self._last_result is not None:
+            self.logger.append(self._last_result.conversation_log)
+            self._last_result = None
+        metrics = metrics.as_dict()
+        self._report(metrics)
+        if self.config['results_path'] is not None:
+            self.results.save(self.config['results_path'])
+
+        return metrics
+
+    def close(self):
+        """
+        Flush and close the transcript sink.
+        """
+        self.transcript_sink.close()
+
+    def simulate_parallel(self, num_workers=None, num_of_runs=None):
+        """
+        Run the simulation on a pool of worker processes.
+
+        User goals are split into chunks of parallel_chunk_size (see config) and every worker builds its own
+        AgendaUser, ChatBot, TemplateNLG and NLU client (see _init_worker), so no state is shared between processes.
+        The results of a chunk are written to the transcript sink and added to the same metrics as simulate() as soon
+        as the chunk is done, so they are not all kept in memory. Chunks finish in any order. Workers start from the
+        persisted NLU cache (see nlu_cache_path), but the responses they cache are discarded with the worker: only the
+        NLU cache of this process is saved at the end of a run.
+
+        Args:
+            - num_workers (int): number of worker processes, defaults to the configured workers
+            - num_of_runs (int): number of user goals (conversations) to simulate, defaults to the configured one
+        Returns:
+            - metrics (dict)
+        """
+        num_workers = num_workers or self.config['workers']
+        if num_of_runs is None:
+            num_of_runs = self.config['num_of_runs']
+        chunks = split_into_chunks(list(enumerate(self.user.user_goals[:num_of_runs])),
+                                   self.config['parallel_chunk_size'])
+
+        metrics = self._start_simulation()
+        worker_config = dict(self.config, instrumentation=self.instrumentation.enabled)
+        with multiprocessing.Pool(processes=max(1, min(num_workers, len(chunks))), initializer=_init_worker,
+                                  initargs=(self.user.name, self.user.user_profile, worker_config)) as pool:
+            for chunk_results, chunk_instrumentation in pool.imap_unordered(_simulate_chunk, chunks):
+                for i, result in chunk_results:
+                    self._finish_episode(i, result, metrics)
+                self.instrumentation.merge(chunk_instrumentation)
+
+        return self._end_simulation(metrics)
+
+    def simulate_async(self, num_of_runs=None, max_concurrency=None, pool_size=None):
+        """
+        Run the simulation with many in-flight conversations interleaved on one asyncio event loop.
+
+        Every episode owns its AgendaUser and ChatBot while the NLU is shared through a bounded keep-alive
+        connection pool, so the NLU latency of different episodes overlaps instead of adding up. An episode waits
+        for at most one NLU response at a time and the NLU runs at most pool_size requests at the same time, so at
+        most min(max_concurrency, pool_size) conversations are in flight. Like in simulate(), an episode which
+        raises a transient error is retried and then quarantined. Finished episodes are written to the transcript
+        sink and the results store by a worker thread, so the event loop does not wait for them.
+
+        Args (default to the configured num_of_runs, max_concurrent_episodes and nlu_pool_size):
+            - num_of_runs (int): number of user goals (conversations) to simulate
+            - max_concurrency (int): maximum number of conversations in flight at the same time
+            - pool_size (int): maximum number of open connections to the NLU server
+        Returns:
+            - metrics (dict)
+        """
+        num_of_runs = num_of_runs or self.config['num_of_runs']
+        max_concurrency = max_concurrency or self.config['max_concurrent_episodes']
+        pool_size = pool_size or self.config['nlu_pool_size']
+        if max_concurrency > pool_size:
+            logging.info('{} conversations in flight at most, the size of the NLU pool'.format(pool_size))
+            max_concurrency = pool_size
+        metrics = self._start_simulation()
+        self.nlu.create_session(pool_size=pool_size)
+        # a single thread, so episodes are finished one at a time
+        finish_executor = ThreadPoolExecutor(max_workers=1)
+        try:
+            asyncio.run(self._simulate_async(self.user.user_goals[:num_of_runs], max_concurrency, metrics,
+                                             finish_executor))
+        finally:
+            finish_executor.shutdown()
+            self.nlu.close_session()
+
+        self._report_quarantined()
+        return self._end_simulation(metrics)
+
+    async def _simulate_async(self, user_goals, max_concurrency, metrics, finish_executor):
+        semaphore = asyncio.Semaphore(max_concurrency)
+        episodes = [self._run_episode_async(i, user_goal, semaphore, metrics, finish_executor)
+                    for i, user_goal in enumerate(user_goals)]
+
+        await asyncio.gather(*episodes)
+
+    async def _run_episode_async(self, episode_index, user_goal, semaphore, metrics, finish_executor):
+        async with semaphore:
+            attempt = 1
+            while True:
+                try:
+                    result = await self._episode_async(episode_index, user_goal)
+                except Exception as e:
+                    delay = self._retry_delay(episode_index, attempt, e)
+                    if delay is None:
+                        return
+                    await asyncio.sleep(delay)
+                    attempt += 1
+                    continue
+                break
+
+        await asyncio.get_running_loop().run_in_executor(finish_executor, self._finish_episode, episode_index,
+                                                         result, metrics)
+
+    async def _episode_async(self, episode_index, user_goal):
+        timings = self.instrumentation.episode()
+        steps = self._new_episode(user_goal, seed=self.episode_seed(episode_index), timings=timings)
+        try:
+            chatbot_response = next(steps)
+            while True:
+                # includes the time spent waiting for a free NLU connection
+                with timings.stage('nlu'):
+                    chatbot_nlu_output = await self.nlu.async_get_response(chatbot_response)
+                chatbot_response = steps.send(chatbot_nlu_output)
+        except StopIteration as stop:
+            return stop.value
+
+    def simulate_batch(self, num_of_runs=None, batch_size=None, pool_size=None):
+        """
+        Run batch_size conversations in lock-step. At every step the chatbot responses of all running
+        conversations are parsed with a single NLUBackend.parse_batch call; a finished conversation is replaced
+        by the next user goal so the batch stays full.
+
+        Args (default to the configured num_of_runs, nlu_batch_size and nlu_pool_size):
+            - num_of_runs (int): number of user goals (conversations) to simulate
+            - batch_size (int): number of conversations running in lock-step
+            - pool_size (int): maximum number of open connections to the NLU server
+        Returns:
+            - metrics (dict)
+        """
+        batch_size = batch_size or self.config['nlu_batch_size']
+        pool_size = pool_size or self.config['nlu_pool_size']
+        user_goals = self.user.user_goals[:num_of_runs or self.config['num_of_runs']]
+        metrics = self._start_simulation()
+        # the texts of a batch are parsed concurrently on the connection pool of the session
+        self.nlu.create_session(pool_size=pool_size)
+        try:
+            self._simulate_batch(user_goals, batch_size, metrics)
+        finally:
+            self.nlu.close_session()
+
+        return self._end_simulation(metrics)
+
+    def _simulate_batch(self, user_goals, batch_size, metrics):
+        next_goal = iter(enumerate(user_goals))
+        # episode index -> (episode steps, chatbot response waiting for the NLU)
+        running = OrderedDict()
+
+        while True:
+            while len(running) < batch_size:
+                i, user_goal = next(next_goal, (None, None))
+                if user_goal is None:
                     break
-
-            total_turns += num_of_turns
+                steps = self._new_episode(user_goal, seed=self.episode_seed(i))
+                running[i] = (steps, next(steps))
+            if not running:
+                break
+
+            indices = list(running)
+            # the NLU is timed per batch, not per episode
+            with self.instrumentation.stage('nlu_batch'):
+                nlu_outputs = self.nlu.parse_batch([running[i][1] for i in indices])
+            for i, nlu_output in zip(indices, nlu_outputs):
+                steps = running[i][0]
+                try:
+                    running[i] = (steps, steps.send(nlu_output))
+                except StopIteration as stop:
+                    self._finish_episode(i, stop.value, metrics)
+                    del running[i]
+
+    def record_episode(self, user_goal, seed=None, episode_index=None):
+        """
+        Run a single conversation like run_episode and record what the user simulator received from outside:
+        chatbot responses, NLU outputs and random numbers (see chatsim.utils.recording).
+
+        Returns:
+            - (EpisodeResult, EpisodeRecording)
+        """
+        random_source = RandomSource() if self.usersimulator is None else self.usersimulator.random_source
+        random_source = RecordingRandomSource(random_source)
+        usersimulator = self.create_usersimulator(random_source=random_source)
+        user_profile = self.user.user_profile[self.user_profile_name]
+        steps = self._episode_steps(user_goal, usersimulator, self.chatbot, seed=seed, user_profile=user_profile)
+        chatbot_responses, nlu_outputs = [], []
+        try:
+            chatbot_response = next(steps)
+            while True:
+                chatbot_nlu_output = self.nlu.get_response(chatbot_response)
+                chatbot_responses.append(chatbot_response)
+                nlu_outputs.append(chatbot_nlu_output)
+                chatbot_response = steps.send(chatbot_nlu_output)
+        except StopIteration as stop:
+            result = stop.value
+        except Exception:
             self.chatbot.asked_entities = set()
-
-            if (num_of_turns < MAX_TURNS-1) and (not failed):
-                num_of_successful_conversations += 1
-            print(conversation_log)
-
-        self.logger.append(conversation_log)
-        print('Mean number of turns is = {}'.format(total_turns/NUMBER_OF_RUNS))
-        print('Success rate is = {}'.format(num_of_successful_conversations/NUMBER_OF_RUNS))
+            raise
+
+        recording = EpisodeRecording(
+            episode=episode_index, user_goal=user_goal, user_profile=user_profile, seed=seed,
+            chatbot_responses=chatbot_responses, nlu_outputs=nlu_outputs, draws=random_source.draws,
+            outcome={'num_of_turns': result.num_of_turns, 'success': result.success, 'failed': result.failed},
+            conversation_log=result.conversation_log)
+        return result, recording
+
+    def record(self, path, num_of_runs=None):
+        """
+        Simulate num_of_runs conversations one after the other and write their recordings to path (JSON Lines,
+        gzip compressed if path ends with .gz), so they can be replayed without the NLU and the chatbot (see replay).
+
+        Returns:
+            - metrics (dict)
+        """
+        user_goals = self.user.user_goals[:num_of_runs or self.config['num_of_runs']]
+        metrics = self._start_simulation()
+
+        def recordings():
+            for i, user_goal in enumerate(user_goals):
+                result, recording = self.record_episode(user_goal, seed=self.episode_seed(i), episode_index=i)
+                self._finish_episode(i, result, metrics)
+                yield recording
+
+        write_recordings(path, recordings())
+        return self._end_simulation(metrics)
+
+    def replay_episode(self, recording):
+        """
+        Replay a recorded episode: the user simulator and NLG run as usual, but the chatbot responses, NLU outputs and
+        random numbers come from the recording, so neither the NLU nor the chatbot is called.
+
+        Raises:
+            - ReplayDivergence: if the episode asks for more than was recorded
+        Returns:
+            - EpisodeResult
+        """
+        usersimulator = self.create_usersimulator(random_source=ReplayRandomSource(recording.draws))
+        steps = self._episode_steps(recording.user_goal, usersimulator, ReplayChatBot(recording.chatbot_responses),
+                                    user_profile=recording.user_profile)
+        nlu_outputs = iter(recording.nlu_outputs)
+        try:
+            next(steps)
+            while True:
+                chatbot_nlu_output = next(nlu_outputs, None)
+                if chatbot_nlu_output is None:
+                    raise ReplayDivergence("No recorded NLU output left")
+                steps.send(chatbot_nlu_output)
+        except StopIteration as stop:
+            return stop.value
+
+    def replay(self, recordings):
+        """
+        Replay recorded episodes (see replay_episode, read_recordings) and compute their metrics. The episodes whose
+        outcome or conversation differ from their recording, or which diverge, are listed in
+        Moderator.replay_mismatches.
+
+        Returns:
+            - metrics (dict)
+        """
+        metrics = self._start_simulation()
+        for i, recording in enumerate(recordings):
+            episode_index = i if recording.episode is None else recording.episode
+            try:
+                result = self.replay_episode(recording)
+            except ReplayDivergence as e:
+                self.replay_mismatches.append(episode_index)
+                logging.warning('Episode {} diverged from its recording: {}'.format(episode_index, e))
+                continue
+            if not replay_matches(recording, result):
+                self.replay_mismatches.append(episode_index)
+            self._finish_episode(episode_index, result, metrics)
+
+        if self.replay_mismatches:
+            logging.warning('{} replayed episodes differ from their recording: {}'.format(
+                len(self.replay_mismatches), self.replay_mismatches))
+        return self._end_simulation(metrics)
+
+    def _new_episode(self, user_goal, seed=None, timings=None):
+        """
+        Create the steps of an episode which owns its own user simulator and chatbot (see _episode_steps).
+        """
+        if timings is None:
+            timings = self.instrumentation.episode()
+
+        return self._episode_steps(user_goal, self.create_usersimulator(), self._chatbot_class(), seed=seed,
+                                   timings=timings)
+
+    def _report(self, metrics):
+        print('Mean number of turns is = {}'.format(metrics['mean_num_of_turns_per_conversation']))
+        print('Success rate is = {}'.format(metrics['success_rate']))
+        if self.nlu.cache is not None:
+            logging.info('NLU cache stats: {}'.format(self.nlu.cache.stats()))
+        if self.nlg.cache is not None:
+            logging.info('NLG cache stats: {}'.format(self.nlg.cache_stats()))
+        if self.instrumentation.enabled:
+            logging.info('Stage timings: {}'.format(self.instrumentation.summary()))
+            if self.config['instrumentation_json_path'] is not None:
+                self.instrumentation.write_json(self.config['instrumentation_json_path'])
+            if self.config['instrumentation_prometheus_path'] is not None:
+                self.instrumentation.write_prometheus(self.config['instrumentation_prometheus_path'])
 
     def _create_annotation(self, nlu_output):
-        diagact = None
-        if nlu_output['intent']['name'] == 'INFORM':
-            diagact = Inform
-        elif nlu_output['intent']['name'] == 'REQUEST':
-            diagact = Request
-        elif nlu_output['intent']['name'] == 'GREETING':
-            diagact = Greeting
-        elif nlu_output['intent']['name'] == 'AFFIRM':
-            diagact = Affirm
-        elif nlu_output['intent']['name'] == 'NEGATE':
-            diagact = Negate
-        elif nlu_output['intent']['name'] == 'CONFIRM':
-            diagact = Confirm
-        elif nlu_output['intent']['name'] == 'THANK_YOU':
-            diagact = ThankYou
-        elif nlu_output['intent']['name'] == 'GOODBYE':
-            diagact = GoodBye
-        elif nlu_output['intent']['name'] == 'SELECT':
-            diagact = Select
-        elif nlu_output['intent']['name'] == 'NOTIFY_SUCCESS':
-            diagact = NotifySuccess
-        elif nlu_output['intent']['name'] == 'NOTIFY_FAILURE':
-            diagact = NotifyFailure
+        # unknown (or missing) intents are mapped to CantUnderstand
+        intent = nlu_output.get('intent') or {}
+        diagact = get_diagact(intent.get('name'))
 
         goal_list = []
-        for ent_val in nlu_output['entities']:
+        for ent_val in nlu_output.get('entities') or []:
             entity = ent_val['entity']
             value = ent_val['value']
             goal_list.append(Goal(slot=entity, value=value, type=None))
@@ -146,50 +793,129 @@ class Moderator(object):
         # fix nlu select
         if diagact.name == 'SELECT':
             if not goal_list:
-                text = nlu_output['text']
-                if 'time' in text:
-                    goal_list.append(Goal(slot='time', value='2 pm', type=None))
-                if 'date' in text:
-                    goal_list.append(Goal(slot='date', value='tomorrow', type=None))
-                if 'movie' in text:
-                    goal_list.append(Goal(slot='movie', value='12 angry men', type=None))
-                if 'theater' in text:
-                    goal_list.append(Goal(slot='theatre_name', value='angelika', type=None))
-                if 'tickets' in text or 'people' in text:
-                    goal_list.append(Goal(slot='num_people', value='2', type=None))
+                for slot, value in SELECT_ENTITY_AUGMENTER.match(nlu_output['text']):
+                    goal_list.append(Goal(slot=slot, value=value, type=None))
 
         return Annotation(diagact=diagact, goal_list=goal_list, intent='booking', domain='movie')
 
 
-def main():
-    # for _ in range(10):
-    #     print(m.nlu.get_server_response('what time and date?', NLU_PROJECT, NLU_MODEL, port=5000))
+class SimulationMetrics(object):
+    """
+    Running sums of the simulation metrics, updated as episodes finish so that results do not have to be kept.
+    """
+    def __init__(self):
+        self.num_of_runs = 0
+        self.num_of_successful_conversations = 0
+        self.total_turns = 0
+
+    def add(self, result):
+        self.num_of_runs += 1
+        self.num_of_successful_conversations += 1 if result.success else 0
+        self.total_turns += result.num_of_turns
+
+    def state(self):
+        return {'num_of_runs': self.num_of_runs,
+                'num_of_successful_conversations': self.num_of_successful_conversations,
+                'total_turns': self.total_turns}
+
+    @classmethod
+    def from_state(cls, state):
+        metrics = cls()
+        if state:
+            metrics.num_of_runs = state['num_of_runs']
+            metrics.num_of_successful_conversations = state['num_of_successful_conversations']
+            metrics.total_turns = state['total_turns']
+        return metrics
+
+    def as_dict(self):
+        if not self.num_of_runs:
+            return {'success_rate': None, 'mean_num_of_turns_per_conversation': None}
+
+        return {
+            'success_rate': self.num_of_successful_conversations/self.num_of_runs,
+            'mean_num_of_turns_per_conversation': self.total_turns/self.num_of_runs
+        }
+
+
+def compute_metrics(results):
+    """
+    Merge per-episode results into the simulation metrics.
+
+    Args:
+        - results (list[EpisodeResult])
+    Returns:
+        - metrics (dict): success_rate and mean_num_of_turns_per_conversation
+    """
+    metrics = SimulationMetrics()
+    for result in results:
+        metrics.add(result)
+
+    return metrics.as_dict()
+
 
-    # create sample user to be used for user goals and user profile components
+def transient_errors():
+    """
+    Exception classes of the errors an episode is retried on (see Moderator.simulate): connection errors, timeouts,
+    undecodable NLU responses and, if requests is loaded (i.e. the NLU talks to a server), its errors.
+    """
+    errors = (ConnectionError, TimeoutError, json.JSONDecodeError)
+    # requests is only imported by the NLU backends which need it
+    requests = sys.modules.get('requests')
+    if requests is not None:
+        errors += (requests.RequestException,)
+    return errors
 
-    sample_user_profile = read_user_profile(CURRENT_DIR / 'user/sample_user_profile.yml')
-    mansour = User(user_profile=sample_user_profile)
-    mansour.create_random_user_goals(num_of_goals=100)
 
-    m = Moderator(user=mansour)
-    # print(mansour.user_goals)
-    # return
-    # for _ in range(10):
-    #     print(m.chatbot.get_response('hi , buy 3 movie tickets for tomorrow .'))
+def episode_seed(episode_index, simulation_seed):
+    """
+    Seed of the user simulator for the given episode. Every episode of a seeded simulation (see SIMULATION_SEED)
+    gets its own random stream, so an episode can be replayed on its own whatever the mode of the simulation.
+    """
+    if simulation_seed is None:
+        return None
+    return [simulation_seed, episode_index]
 
-    # return
 
-    user_simulator = AgendaUser(
-            params=AGENDA_USER_PARAMS,
-            current_intent='booking'
-        )
-    m.usersimulator = user_simulator
+def split_into_chunks(items, chunk_size):
+    """
+    Split items into contiguous chunks of chunk_size items (the last one may be smaller).
+    """
+    chunk_size = max(1, chunk_size)
+    return [items[start:start + chunk_size] for start in range(0, len(items), chunk_size)]
 
-    m.initialize(mansour)
-    # print(m.usersimulator._agenda)
 
-    # start simulation
-    m.simulate()
+# moderator owned by each worker process of Moderator.simulate_parallel
+_worker_moderator = None
+
+
+def _init_worker(user_name, user_profile, config):
+    global _worker_moderator
+    user = User(name=user_name, user_profile=user_profile)
+    # transcripts are written by the parent process
+    _worker_moderator = Moderator(user=user, config=config, transcript_sink=TranscriptSink())
+    _worker_moderator.usersimulator = _worker_moderator.create_usersimulator()
+    _worker_moderator.initialize(user)
+
+
+def _simulate_chunk(indexed_user_goals):
+    """
+    Simulate a chunk of (episode index, user goal) in the worker and return its (episode index, result) with the
+    stage timings of the chunk.
+    """
+    results = [(i, _worker_moderator.run_episode(user_goal, seed=_worker_moderator.episode_seed(i)))
+               for i, user_goal in indexed_user_goals]
+    instrumentation = _worker_moderator.instrumentation
+    chunk_instrumentation = Instrumentation(enabled=instrumentation.enabled, buckets=instrumentation.buckets)
+    chunk_instrumentation.merge(instrumentation)
+    instrumentation.reset()
+
+    return results, chunk_instrumentation
+
+
+def main():
+    # the simulation is configured by a yaml file and command line options, see chatsim.runner
+    from chatsim.runner import main as run
+    run()
 
 
 if __name__ == "__main__":
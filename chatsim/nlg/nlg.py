@@ -1,19 +1,131 @@
 from chatsim.utils import Annotation, DiagAct, Goal, UserGoal
-from random import choice
+from chatsim.utils.common import _freeze
+from chatsim.utils.cache import LRUCache
+from bisect import bisect_right
+from itertools import accumulate
+from pathlib import Path
+import os
+import random
+
+import yaml
+
+CURRENT_DIR = Path(os.path.dirname(__file__))
+DEFAULT_TEMPLATE = CURRENT_DIR / 'template/template.yml'
+
+
+class CompiledTemplate(object):
+    """
+    Utterance of annotations with a given diagact and list of slots. The slot names are already filled in the
+    format strings of all the variants, so rendering is a single format call with the values of the goals.
+
+    Attributes:
+        - variants (list[str]): format strings of the variants of the utterance
+        - cum_weights (list[float]): cumulative weights of the variants
+        - uses_value (bool): whether the format strings need the goal values
+    """
+    def __init__(self, variants, weights, uses_value):
+        self.variants = variants
+        self.cum_weights = list(accumulate(weights))
+        self.uses_value = uses_value
+
+    @property
+    def is_random(self):
+        return len(self.variants) > 1
+
+    def render(self, values, random_source=None):
+        variant = self.variants[0]
+        if self.is_random:
+            rand = random_source() if random_source else random.random()
+            variant = self.variants[bisect_right(self.cum_weights, rand * self.cum_weights[-1])]
+        return variant.format(*values)
 
 
 class TemplateNLG(object):
+    """
+    Template based NLG. Templates are read from a yaml file (see template/template.yml) and compiled into a
+    CompiledTemplate the first time a (diagact, slots) pair is seen, after which realizing an annotation is a
+    dictionary lookup and one format call.
 
-    def __init__(self):
-        pass
+    Utterances are memoized by the canonical form of their annotation list (see _utterance_key), except for
+    annotation lists containing a diagact whose utterance is chosen at random among several variants.
+
+    Attributes:
+        - slot_aliases (dict{str:str}): slot -> name of the slot in utterances
+        - diagact_templates (dict{str:dict}): diagact name -> template definition
+        - cache (LRUCache): cache of utterances. Utterances are not cached if cache_size is 0.
+        - cache_bypasses (int): number of utterances which could not be cached because they are random
+    """
+    def __init__(self, template_path=DEFAULT_TEMPLATE, cache_size=10000):
+        with open(template_path, 'r') as f:
+            templates = yaml.safe_load(f)
+        self.slot_aliases = templates.get('slot_aliases') or {}
+        self.diagact_templates = templates.get('diagacts') or {}
+        # (diagact name, slots) -> CompiledTemplate
+        self._compiled_templates = {}
+        # diagacts which have more than one template variant
+        self._random_diagacts = {name for name, template in self.diagact_templates.items()
+                                 if len(template['templates']) > 1}
+        self.cache = LRUCache(max_size=cache_size, thread_safe=False) if cache_size else None
+        self.cache_bypasses = 0
+
+    def get_utterance(self, annot_list, random_source=None):
+        if self.cache is None:
+            return self._realize(annot_list, random_source)
+
+        key = self._utterance_key(annot_list)
+        if key is None:
+            self.cache_bypasses += 1
+            return self._realize(annot_list, random_source)
+
+        utterance = self.cache.get(key)
+        if utterance is None:
+            utterance = self._realize(annot_list, random_source)
+            self.cache.put(key, utterance)
+
+        return utterance
+
+    def _utterance_key(self, annot_list):
+        """
+        Canonical form of the parts of the annotations which determine their utterance (see annotation_key).
+        None if the utterance is random.
+        """
+        key = []
+        for annot in annot_list:
+            diagact_name = annot.diagact.name
+            if diagact_name in self._random_diagacts:
+                return None
+            key.append(diagact_name)
+            for goal in annot.goal_list or ():
+                value = goal.value
+                if value.__class__ is list:
+                    value = tuple(value)
+                elif value is not None and value.__class__ is not str:
+                    value = _freeze(value)
+                key.append((goal.slot, value, goal.type))
+            key.append(None)
 
-    def get_utterance(self, annot_list):
+        return tuple(key)
+
+    def cache_stats(self):
+        if self.cache is None:
+            return None
+        stats = self.cache.stats()
+        stats['bypasses'] = self.cache_bypasses
+        return stats
+
+    def _realize(self, annot_list, random_source=None):
         output_text_list = []
         for annot in annot_list:
-            output_text_list.append(self.annot2text(annot))
+            output_text_list.append(self.annot2text(annot, random_source=random_source))
 
         return ' '.join(output_text_list).strip()
 
+    def get_utterances(self, annot_lists, random_source=None):
+        """
+        Realize a batch of annotation lists (e.g. the user responses of many episodes) in one call.
+        """
+        return [self.get_utterance(annot_list, random_source=random_source) for annot_list in annot_lists]
+
     def _get_entity_value_text(self, goal):
         val_text = ''
         if goal.type == 'fixed' or goal.type == 'flexible' or goal.type == 'open':
@@ -23,39 +135,63 @@ class TemplateNLG(object):
 
         return val_text
 
-    def annot2text(self, annotation):
-        output_text = ''
-        if annotation.diagact.name == 'INFORM':
-            goal_list = annotation.goal_list
-            ent_val_tuples = []
-            if goal_list:
-                for goal in goal_list:
-                    entity = goal.slot
-                    value = self._get_entity_value_text(goal)
-                    if entity == 'num_people':
-                        ent_val_tuples.append(('number of people', value))
-                    elif entity == 'theatre_name':
-                        ent_val_tuples.append(('theater', value))
-                    else:
-                        ent_val_tuples.append((entity, value))
-
-            output_text = ' '.join(['{} is {}'.format(ent, val) for (ent, val) in ent_val_tuples]).strip()
-
-        if annotation.diagact.name == 'REQUEST':
-            temp = 'what is '
-            goal = annotation.goal_list[0]
-            entity = goal.slot
-            if entity == 'num_people':
-                output_text = temp + 'number of people ?'
-            elif entity == 'theatre_name':
-                output_text = temp + 'theater ?'
-            else:
-                output_text = temp + entity + ' ?'
-
-        if annotation.diagact.name == 'GREETING':
-            output_text = choice(['hi', 'hello'])
-
-        if annotation.diagact.name == 'AFFIRM':
-            output_text = choice(['that is right', 'yes'])
-
-        return output_text
+    def get_template(self, annotation):
+        """
+        Return the CompiledTemplate of the annotation (None if its diagact has no template).
+        """
+        return self._lookup_template(annotation)[0]
+
+    def _lookup_template(self, annotation):
+        diagact_name = annotation.diagact.name
+        template = self.diagact_templates.get(diagact_name)
+        if template is None:
+            return None, None
+
+        goal_list = self._realized_goals(template, annotation.goal_list)
+        key = (diagact_name, tuple([goal.slot for goal in goal_list]))
+        compiled_template = self._compiled_templates.get(key)
+        if compiled_template is None:
+            compiled_template = self._compile(template, key[1])
+            self._compiled_templates[key] = compiled_template
+
+        return compiled_template, goal_list
+
+    def annot2text(self, annotation, random_source=None):
+        compiled_template, goal_list = self._lookup_template(annotation)
+        if compiled_template is None:
+            return ''
+
+        values = ()
+        if compiled_template.uses_value:
+            values = [self._get_entity_value_text(goal) for goal in goal_list]
+
+        return compiled_template.render(values, random_source=random_source).strip()
+
+    @staticmethod
+    def _realized_goals(template, goal_list):
+        mode = template.get('slots', 'none')
+        if mode == 'each':
+            return goal_list or []
+        if mode == 'first':
+            return (goal_list or [])[:1]
+        return []
+
+    def _compile(self, template, slots):
+        if template.get('slots', 'none') != 'none' and not slots:
+            # annotation has no goal to realize
+            return CompiledTemplate([''], [1], False)
+
+        variants, weights = [], []
+        uses_value = False
+        for variant in template['templates']:
+            text = variant['text']
+            uses_value = uses_value or '{value}' in text
+            parts = []
+            for slot in (slots or [None]):
+                alias = self.slot_aliases.get(slot, slot) or ''
+                alias = alias.replace('{', '{{').replace('}', '}}')
+                parts.append(text.replace('{slot}', alias).replace('{value}', '{}'))
+            variants.append(' '.join(parts).strip())
+            weights.append(variant.get('weight', 1))
+
+        return CompiledTemplate(variants, weights, uses_value)
@@ -0,0 +1,70 @@
+import random
+
+import pytest
+
+from chatsim.nlg import TemplateNLG
+from chatsim.utils import Annotation, Goal
+from chatsim.utils.diagact import DIAGACTS
+
+SLOTS = ['time', 'date', 'movie', 'theatre_name', 'num_people']
+SLOT_NAMES = {'num_people': 'number of people', 'theatre_name': 'theater'}
+RANDOM_UTTERANCES = {'GREETING': ['hi', 'hello'], 'AFFIRM': ['that is right', 'yes']}
+
+
+def value_text(goal):
+    if goal.type in ('fixed', 'flexible', 'open'):
+        return str(goal.value[0])
+    return ' or '.join(goal.value)
+
+
+def reference_annot2text(annotation):
+    """
+    The if-chain of diagacts the templates of template.yml replaced, None for random utterances.
+    """
+    name = annotation.diagact.name
+    if name == 'INFORM':
+        return ' '.join('{} is {}'.format(SLOT_NAMES.get(goal.slot, goal.slot), value_text(goal))
+                        for goal in annotation.goal_list or []).strip()
+    if name == 'REQUEST':
+        return 'what is {} ?'.format(SLOT_NAMES.get(annotation.goal_list[0].slot, annotation.goal_list[0].slot))
+    if name in RANDOM_UTTERANCES:
+        return None
+    return ''
+
+
+def random_annotation(rng, diagact):
+    goal_list = []
+    for slot in rng.sample(SLOTS, rng.randint(1, 3)):
+        goal_type = rng.choice(['fixed', 'flexible', 'open', 'multiple_value'])
+        values = [rng.choice(['2 pm', 'today', 'avatar', '{x}', '3']) for _ in range(rng.randint(1, 3))]
+        goal_list.append(Goal(slot=slot, value=values, type=goal_type))
+    return Annotation(diagact=diagact, goal_list=goal_list, intent='buy_movie_tickets', domain='movie')
+
+
+@pytest.mark.parametrize('name', sorted(DIAGACTS))
+def test_compiled_templates_match_the_previous_nlg(name):
+    rng = random.Random(name)
+    nlg = TemplateNLG(cache_size=0)
+    for _ in range(50):
+        annotation = random_annotation(rng, DIAGACTS[name])
+        expected = reference_annot2text(annotation)
+        if expected is None:
+            assert nlg.annot2text(annotation) in RANDOM_UTTERANCES[name]
+        else:
+            assert nlg.annot2text(annotation) == expected
+
+
+def test_cache_bypasses_random_utterances():
+    rng = random.Random(0)
+    nlg, uncached_nlg = TemplateNLG(), TemplateNLG(cache_size=0)
+    inform = [random_annotation(rng, DIAGACTS['INFORM']), random_annotation(rng, DIAGACTS['REQUEST'])]
+    greeting = [Annotation(diagact=DIAGACTS['GREETING'], goal_list=None, intent=None, domain=None)] + inform
+
+    for _ in range(3):
+        assert nlg.get_utterance(inform) == uncached_nlg.get_utterance(inform)
+    assert nlg.cache_stats()['hits'] == 2 and nlg.cache_stats()['size'] == 1
+
+    # the variant of a random utterance is drawn every time, its utterance is never cached
+    assert [nlg.get_utterance(greeting, random_source=lambda value=value: value) for value in (0.1, 0.9, 0.2)] == \
+        [greeting_text + ' ' + nlg.get_utterance(inform) for greeting_text in ('hi', 'hello', 'hi')]
+    assert nlg.cache_bypasses == 3 and nlg.cache_stats()['size'] == 1
@@ -0,0 +1,81 @@
+import re
+from collections import OrderedDict
+
+# slot -> keywords which mean that a REQUEST utterance asks for the slot
+REQUEST_SLOT_KEYWORDS = OrderedDict([
+    ('date', ['date', 'day']),
+    ('time', ['time', 'when', 'showtime']),
+    ('num_people', ['how many people', 'people', 'tickets', 'many']),
+    ('theatre_name', ['theater', 'theatre']),
+    ('movie', ['movie'])
+])
+
+# slot -> keywords which mean that a SELECT utterance offers the slot
+SELECT_SLOT_KEYWORDS = OrderedDict([
+    ('time', ['time']),
+    ('date', ['date']),
+    ('movie', ['movie']),
+    ('theatre_name', ['theater']),
+    ('num_people', ['tickets', 'people'])
+])
+
+# value used for the slots of a SELECT utterance when the NLU does not find any entity
+SELECT_SLOT_VALUES = {
+    'time': '2 pm',
+    'date': 'tomorrow',
+    'movie': '12 angry men',
+    'theatre_name': 'angelika',
+    'num_people': '2'
+}
+
+
+class KeywordEntityAugmenter(object):
+    """
+    Find the slots mentioned in a text using a slot -> keywords table.
+
+    All keywords are compiled into a single regex alternation, so a text is scanned once no matter how many
+    slots and keywords the table has. A slot matches if any of its keywords is a substring of the text.
+
+    Attributes:
+        - slot_keywords (OrderedDict{str:list[str]}): slot -> keywords. Matched slots are returned in this order.
+        - slot_values (dict{str:str}): optional value of every slot returned with the matched slots
+    """
+    def __init__(self, slot_keywords, slot_values=None):
+        self.slot_keywords = OrderedDict(slot_keywords)
+        self.slot_values = slot_values or {}
+        self._slot_rank = {slot: rank for rank, slot in enumerate(self.slot_keywords)}
+
+        keyword_slots = {}
+        for slot, keywords in self.slot_keywords.items():
+            for keyword in keywords:
+                keyword_slots.setdefault(keyword, set()).add(slot)
+        # the alternation only reports the longest keyword starting at a position, so a keyword also
+        # stands for the slots of every keyword which is a prefix of it
+        self._keyword_to_slots = {}
+        for keyword in keyword_slots:
+            slots = set()
+            for other_keyword, other_slots in keyword_slots.items():
+                if keyword.startswith(other_keyword):
+                    slots |= other_slots
+            self._keyword_to_slots[keyword] = slots
+
+        # zero-width lookahead reports (overlapping) matches at every position of the text
+        alternation = '|'.join(re.escape(k) for k in sorted(keyword_slots, key=len, reverse=True))
+        self._pattern = re.compile('(?=({}))'.format(alternation)) if alternation else None
+
+    def match(self, text):
+        """
+        Return the (slot, value) pairs of all the slots mentioned in text, in the order of slot_keywords.
+        """
+        if not text or self._pattern is None:
+            return []
+
+        matched_slots = set()
+        for keyword in self._pattern.findall(text):
+            matched_slots |= self._keyword_to_slots[keyword]
+
+        return [(slot, self.slot_values.get(slot)) for slot in sorted(matched_slots, key=self._slot_rank.get)]
+
+
+REQUEST_ENTITY_AUGMENTER = KeywordEntityAugmenter(REQUEST_SLOT_KEYWORDS)
+SELECT_ENTITY_AUGMENTER = KeywordEntityAugmenter(SELECT_SLOT_KEYWORDS, SELECT_SLOT_VALUES)
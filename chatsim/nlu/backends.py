@@ -0,0 +1,242 @@
+import asyncio
+import functools
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List
+
+from chatsim.nlu.rasa.rasanlu import RasaNLU, augment_request_entities, request_server_parse
+
+
+class NLUBackend(object):
+    """
+    Base class of the NLU backends used by the moderator to annotate chatbot utterances.
+
+    A backend only has to implement _parse(text). Caching, batching and the REQUEST entity augmentation
+    (see augment_request_entities) are shared by all backends, so every backend returns the same kind of output.
+
+    Attributes:
+        - project_name (str): NLU project, part of the cache key
+        - model_name (str): NLU model, part of the cache key
+        - cache (NLUCache): optional cache of NLU outputs
+    """
+    def __init__(self, project_name, model_name, cache=None):
+        self.project_name = project_name
+        self.model_name = model_name
+        self.cache = cache
+
+    def _parse(self, text: str) -> Dict:
+        raise NotImplementedError
+
+    def _parse_many(self, texts: List[str]) -> List[Dict]:
+        return [self._parse(text) for text in texts]
+
+    def get_response(self, text: str) -> Dict:
+        """
+        Parse text and return the NLU output (with the REQUEST entities added). The output may be shared with the
+        cache, so it must not be mutated.
+        """
+        if self.cache is not None:
+            cached_response = self.cache.get_response(text, self.project_name, self.model_name)
+            if cached_response is not None:
+                return cached_response
+
+        response = augment_request_entities(self._parse(text), text)
+        if self.cache is not None:
+            self.cache.put_response(text, self.project_name, self.model_name, response)
+
+        return response
+
+    def parse_batch(self, texts: List[str]) -> List[Dict]:
+        """
+        Parse a batch of utterances (e.g. the chatbot responses of many concurrent episodes) at once.
+        Every distinct text is parsed only once, and the texts which are not cached are given together to
+        _parse_many, which backends override to amortize the cost of a parse over the batch.
+
+        Args:
+            - texts (list[str]): utterances to parse
+        Returns:
+            - list[dict]: NLU output for every text, in the order of texts (repeated texts share their output, which
+              must not be mutated)
+        """
+        parsed = {}
+        unique_texts = []
+        for text in OrderedDict.fromkeys(texts):
+            cached_response = None
+            if self.cache is not None:
+                cached_response = self.cache.get_response(text, self.project_name, self.model_name)
+            if cached_response is not None:
+                parsed[text] = cached_response
+            else:
+                unique_texts.append(text)
+
+        for text, response in zip(unique_texts, self._parse_many(unique_texts)):
+            parsed[text] = augment_request_entities(response, text)
+            if self.cache is not None:
+                self.cache.put_response(text, self.project_name, self.model_name, parsed[text])
+
+        return [parsed[text] for text in texts]
+
+    async def async_get_response(self, text: str) -> Dict:
+        return self.get_response(text)
+
+    def create_session(self, pool_size: int = 10):
+        pass
+
+    def close_session(self):
+        pass
+
+
+class HTTPNLUBackend(NLUBackend):
+    """
+    Parse utterances with a running Rasa NLU server.
+
+    create_session shares a keep-alive connection pool to the server between requests. At most pool_size
+    connections are opened and async_get_response / parse_batch run at most pool_size requests at the same time.
+    """
+    def __init__(self, project_name, model_name, port=5000, cache=None):
+        super().__init__(project_name, model_name, cache=cache)
+        self.port = port
+        self.session = None
+        self._executor = None
+
+    def _parse(self, text: str) -> Dict:
+        post = self.session.post if self.session is not None else None
+        return request_server_parse(text, self.project_name, self.model_name, port=self.port, post=post)
+
+    def _parse_many(self, texts: List[str]) -> List[Dict]:
+        if self._executor is None:
+            return super()._parse_many(texts)
+        return list(self._executor.map(self._parse, texts))
+
+    async def async_get_response(self, text: str) -> Dict:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(self.get_response, text))
+
+    def create_session(self, pool_size: int = 10):
+        import requests
+
+        self.close_session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, pool_block=True)
+        self.session = requests.Session()
+        self.session.mount('http://', adapter)
+        self._executor = ThreadPoolExecutor(max_workers=pool_size)
+
+    def close_session(self):
+        if self.session is not None:
+            self.session.close()
+            self.session = None
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+
+class InterpreterNLUBackend(NLUBackend):
+    """
+    Parse utterances in-process with a trained Rasa NLU Interpreter, without the HTTP server.
+
+    Rasa NLU components process one message at a time, so a batch (see _parse_many) only runs the spaCy model of the
+    pipeline, which dominates the cost of a parse, once over all the texts with nlp.pipe.
+
+    Attributes:
+        - model_dir (str): directory of the trained model (MODELS_DIR/<project_name>/<model_name>)
+    """
+    def __init__(self, model_dir, cache=None):
+        model_dir = Path(model_dir)
+        super().__init__(model_dir.parent.name, model_dir.name, cache=cache)
+        if cache is not None:
+            cache.set_model_dir(self.project_name, self.model_name, model_dir)
+        self._rasa = RasaNLU()
+        self._rasa.create_interpreter(model_dir.absolute().as_posix())
+
+    def _parse(self, text: str) -> Dict:
+        return self._rasa.interpreter.parse(text)
+
+    def _parse_many(self, texts: List[str]) -> List[Dict]:
+        interpreter = self._rasa.interpreter
+        pipeline = interpreter.pipeline
+        # the spaCy component has to come first, since the next components read the spacy_doc it sets
+        if not pipeline or getattr(pipeline[0], 'name', None) != 'nlp_spacy':
+            return super()._parse_many(texts)
+
+        from rasa_nlu.training_data import Message
+
+        spacy_nlp = pipeline[0]
+        case_sensitive = getattr(spacy_nlp, 'component_config', {}).get('case_sensitive', True)
+        docs = spacy_nlp.nlp.pipe([text if case_sensitive else text.lower() for text in texts])
+        responses = []
+        for text, doc in zip(texts, docs):
+            if not text:
+                responses.append(interpreter.parse(text))
+                continue
+            # what Interpreter.parse does, with the spacy_doc of the batch
+            message = Message(text, interpreter.default_output_attributes())
+            message.set('spacy_doc', doc)
+            for component in pipeline[1:]:
+                component.process(message, **interpreter.context)
+            response = interpreter.default_output_attributes()
+            response.update(message.as_dict(only_output_properties=True))
+            responses.append(response)
+
+        return responses
+
+
+# ordered (intent, keywords) rules of KeywordNLUBackend, the first rule with a keyword in the text wins
+DEFAULT_KEYWORD_INTENTS = [
+    ('NOTIFY_SUCCESS', ['success', 'purchase']),
+    ('NOTIFY_FAILURE', ['sorry', 'fail', 'not available']),
+    ('CONFIRM', ['confirm', 'is that right', 'is that correct']),
+    ('GOODBYE', ['goodbye', 'bye']),
+    ('THANK_YOU', ['thank']),
+    ('GREETING', ['hello', 'hi ']),
+    ('REQUEST', ['?']),
+]
+
+
+class KeywordNLUBackend(NLUBackend):
+    """
+    Fake NLU which assigns intents with keyword rules. It needs neither a server nor a trained model and is
+    meant for benchmarking the rest of the simulation pipeline.
+
+    Attributes:
+        - intent_keywords (list[(str, list[str])]): ordered (intent, keywords) rules
+        - default_intent (str): intent of texts which match no rule
+    """
+    def __init__(self, intent_keywords=None, default_intent='INFORM', cache=None):
+        super().__init__('keyword', 'keyword', cache=cache)
+        self.intent_keywords = intent_keywords or DEFAULT_KEYWORD_INTENTS
+        self.default_intent = default_intent
+
+    def _parse(self, text: str) -> Dict:
+        lowered_text = (text or '').lower() + ' '
+        intent = self.default_intent
+        for rule_intent, keywords in self.intent_keywords:
+            if any(keyword in lowered_text for keyword in keywords):
+                intent = rule_intent
+                break
+
+        return {
+            'text': text,
+            'intent': {'name': intent, 'confidence': 1.0},
+            'entities': []
+        }
+
+
+NLU_BACKENDS = {
+    'http': HTTPNLUBackend,
+    'interpreter': InterpreterNLUBackend,
+    'keyword': KeywordNLUBackend
+}
+
+
+def create_nlu_backend(nlu_config, cache=None):
+    """
+    Create the NLU backend selected by nlu_config['backend'].
+    The rest of nlu_config is passed to the backend (see NLU_BACKENDS).
+    """
+    params = dict(nlu_config)
+    backend = params.pop('backend')
+    if backend not in NLU_BACKENDS:
+        raise ValueError("Unknown NLU backend {}! Choose one of {}".format(backend, list(NLU_BACKENDS)))
+
+    return NLU_BACKENDS[backend](cache=cache, **params)
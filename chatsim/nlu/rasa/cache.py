@@ -0,0 +1,116 @@
+import json
+import logging
+import os
+from pathlib import Path
+
+from chatsim.utils.cache import LRUCache, _MISSING
+
+logger = logging.getLogger(__name__)
+
+CURRENT_DIR = Path(os.path.dirname(__file__))
+MODELS_DIR = CURRENT_DIR / 'trained_models'
+
+
+class NLUCache(LRUCache):
+    """
+    LRU cache of NLU outputs keyed by (text, project, model).
+
+    Every entry remembers the fingerprint of the trained model it was produced with (the modification time
+    of the model directory), so entries are dropped as soon as the model is retrained or replaced. The cache
+    can be persisted to a local json file and reloaded by later runs.
+
+    get_response returns the cached response itself rather than a copy, so callers must not mutate it.
+
+    The directory of a model is the one given to set_model_dir (e.g. by the backend which loads it), or
+    models_dir/<project_name>/<model_name>.
+
+    Attributes:
+        - path (str|Path): File used to persist the cache. Nothing is persisted if None.
+        - models_dir (Path): Directory containing the trained models of every project
+    """
+    def __init__(self, max_size=10000, path=None, models_dir=MODELS_DIR):
+        super().__init__(max_size=max_size)
+        self.path = Path(path) if path else None
+        self.models_dir = Path(models_dir)
+        self._model_dirs = {}
+        self._fingerprints = {}
+        if self.path and self.path.exists():
+            self.load()
+
+    def fingerprint(self, project_name, model_name):
+        """
+        Fingerprint of the trained model. It is computed once per model and only updated by refresh().
+        """
+        key = (project_name, model_name)
+        if key not in self._fingerprints:
+            self._fingerprints[key] = self._compute_fingerprint(project_name, model_name)
+        return self._fingerprints[key]
+
+    def set_model_dir(self, project_name, model_name, model_dir):
+        """
+        Fingerprint the model (project_name, model_name) with the content of model_dir.
+        """
+        key = (project_name, model_name)
+        self._model_dirs[key] = Path(model_dir)
+        self._fingerprints.pop(key, None)
+
+    def _compute_fingerprint(self, project_name, model_name):
+        model_dir = self._model_dirs.get((project_name, model_name))
+        if model_dir is None:
+            model_dir = self.models_dir / str(project_name) / str(model_name)
+        if not model_dir.exists():
+            return 'missing'
+        mtimes = [model_dir.stat().st_mtime_ns] + [entry.stat().st_mtime_ns for entry in os.scandir(model_dir)]
+        return str(max(mtimes))
+
+    def refresh(self):
+        """
+        Re-check the trained models. Entries of a model which changed since they were cached become stale and
+        are never returned again.
+        """
+        self._fingerprints.clear()
+
+    def get_response(self, text, project_name, model_name):
+        """
+        Cached response of text, or None if it is not cached or was cached with another version of the model.
+        """
+        fingerprint = self.fingerprint(project_name, model_name)
+        if self._lock is None:
+            return self._get_response((text, project_name, model_name), fingerprint)
+        with self._lock:
+            return self._get_response((text, project_name, model_name), fingerprint)
+
+    def _get_response(self, key, fingerprint):
+        entry = self._data.get(key, _MISSING)
+        if entry is _MISSING or entry[0] != fingerprint:
+            # not cached, or the model changed after the response was cached
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def put_response(self, text, project_name, model_name, response):
+        self.put((text, project_name, model_name), (self.fingerprint(project_name, model_name), response))
+
+    def load(self):
+        # the model directories may not be known yet (see set_model_dir), so stale entries are only dropped when
+        # they are read (see get_response) or saved
+        with open(self.path, 'r') as f:
+            entries = json.load(f)
+
+        for text, project_name, model_name, fingerprint, response in entries:
+            self.put((text, project_name, model_name), (fingerprint, response))
+        logger.info('Loaded {} cached NLU responses from {}'.format(len(entries), self.path))
+
+    def save(self):
+        if not self.path:
+            return
+        entries = [[text, project_name, model_name, fingerprint, response]
+                   for (text, project_name, model_name), (fingerprint, response) in self.items()
+                   if fingerprint == self.fingerprint(project_name, model_name)]
+        tmp_path = self.path.with_name(self.path.name + '.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(entries, f)
+        os.replace(tmp_path, self.path)
+        logger.info('Persisted {} cached NLU responses to {}'.format(len(entries), self.path))
@@ -5,16 +5,12 @@ from typing import Dict, List
 from chatsim.utils import Annotation, DiagAct, Goal, UserGoal, read_user_profile
 from chatsim.utils.diagact import *
 
-import requests
 import json
 
 import yaml
 
-from rasa_nlu import config
-from rasa_nlu.model import Interpreter, Trainer
-from rasa_nlu.training_data import load_data
-
 from chatsim.utils import DATA_DIR
+from chatsim.nlu.augmenter import REQUEST_ENTITY_AUGMENTER
 
 logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
@@ -29,6 +25,8 @@ class RasaNLU(object):
 
     def __init__(self):
         self.interpreter = None
+        # (input_text, response) of the last in-process parse, shared by get_intent and get_entities
+        self._last_response = (None, None)
 
     def run(self, config_path: [str, PosixPath] = DEFAULT_RASA_NLU):
         # read the config file
@@ -46,15 +44,18 @@ class RasaNLU(object):
         project_path = MODELS_DIR / rasa_config['trainer']['project_name']
         model_name = project_path / rasa_config['trainer']['config_name']
         if not model_name.exists():
+            from rasa_nlu.training_data import load_data
             training_data = load_data(filename.absolute().as_posix())
             # train the model with given config and persist
             model_directory = self.train_model(rasa_config, training_data)
 
         # create an interpreter for inference
-        self.interpreter = Interpreter.load(model_name.absolute().as_posix())
-        logger.info('Created interpreter with the trained model! Ready of inference!')
+        self.create_interpreter(model_name.absolute().as_posix())
 
     def train_model(self, rasa_config: Dict, training_data):
+        from rasa_nlu import config
+        from rasa_nlu.model import Trainer
+
         # load config
         trainer_config_path = RASA_NLU_PIPELINE_DEFAULT_PATH / rasa_config['trainer']['config_name']
         trainer_config = config.load(trainer_config_path)
@@ -81,73 +82,71 @@ class RasaNLU(object):
     def get_entities(self, input_text: str) -> List:
         return self.get_nlu_response(input_text)['entities']
 
-    # def get_nlu_response(self, input_text: str) -> Dict:
-    #     response = self.interpreter.parse(input_text)
+    def get_nlu_response(self, input_text: str) -> Dict:
+        last_text, last_response = self._last_response
+        if input_text == last_text:
+            return last_response
+        response = self.interpreter.parse(input_text)
+        self._last_response = (input_text, response)
 
-    #     return response
+        return response
 
     def create_interpreter(self, model_dir: str):
+        from rasa_nlu.model import Interpreter
+
         self.interpreter = Interpreter.load(model_dir)
         logger.info('Created interpreter with the trained model! Ready of inference!')
 
     def read_config(self, config_path: [str, PosixPath]) -> Dict:
         with open(config_path, 'r') as stream:
             try:
-                config = yaml.load(stream)
+                config = yaml.safe_load(stream)
             except yaml.YAMLError as exc:
                 logger.error(exc)
 
         return config
 
     def get_server_response(self, input_text: str, project_name: str, model_name: str, port: int = 5000) -> Dict:
-        url = f'http://127.0.0.1:{port}/parse'
-        data = {
-            "q": input_text,
-            "project": project_name,
-            "model": model_name
-        }
-        response = requests.post(url, data=json.dumps(data))
-        json_data = json.loads(response.text)
-
-        # add entities if dialgoue action is of type REQUEST
-        if json_data['intent']['name'] == 'REQUEST':
-            if ('date' in input_text) or ('day' in input_text):
-                json_data['entities'].append(
-                    {
-                        'entity': 'date',
-                        'value': None
-                    }
-                    )
-            if ('time' in input_text) or ('when' in input_text) or ('showtime' in input_text):
-                json_data['entities'].append(
-                    {
-                        'entity': 'time',
-                        'value': None
-                    }
-                    )
-            if ('how many people' in input_text) or ('people' in input_text) or ('tickets' in input_text) or ('many' in input_text):
-                json_data['entities'].append(
-                    {
-                        'entity': 'num_people',
-                        'value': None
-                    }
-                )
-            if ('theater' in input_text) or ('theatre' in input_text):
-                json_data['entities'].append(
-                    {
-                        'entity': 'theatre_name',
-                        'value': None
-                    }
-                )
-            if ('movie' in input_text):
-                json_data['entities'].append(
-                    {
-                        'entity': 'movie',
-                        'value': None
-                    }
-                )
-
-        return json_data
+        json_data = request_server_parse(input_text, project_name, model_name, port)
+
+        return augment_request_entities(json_data, input_text)
+
+
+def request_server_parse(input_text: str, project_name: str, model_name: str, port: int = 5000,
+                         post=None) -> Dict:
+    """
+    Parse input_text with the Rasa NLU server listening on the given port.
+
+    Args:
+        - post: function used to send the request (e.g. the post method of a requests.Session)
+    """
+    url = f'http://127.0.0.1:{port}/parse'
+    data = {
+        "q": input_text,
+        "project": project_name,
+        "model": model_name
+    }
+    if post is None:
+        # imported here so that the backends which do not talk to a server do not pay for it
+        import requests
+        post = requests.post
+    response = post(url, data=json.dumps(data))
+
+    return json.loads(response.text)
+
+
+def augment_request_entities(json_data: Dict, input_text: str) -> Dict:
+    # add entities if dialgoue action is of type REQUEST
+    if json_data['intent']['name'] == 'REQUEST':
+        for slot, _ in REQUEST_ENTITY_AUGMENTER.match(input_text):
+            json_data['entities'].append(
+                {
+                    'entity': slot,
+                    'value': None
+                }
+            )
+
+    return json_data
 
 
 def main():
@@ -0,0 +1,49 @@
+import random
+from collections import OrderedDict
+
+import pytest
+
+from chatsim.nlu.augmenter import KeywordEntityAugmenter, REQUEST_SLOT_KEYWORDS, SELECT_SLOT_KEYWORDS, \
+    SELECT_SLOT_VALUES
+
+# overlapping keywords, keywords which are prefixes (or suffixes) of others and keywords shared by slots
+OVERLAPPING_SLOT_KEYWORDS = OrderedDict([
+    ('a', ['ab', 'abc']),
+    ('b', ['bc', 'b']),
+    ('c', ['cab', 'abcd']),
+    ('d', ['ab']),
+    ('e', []),
+])
+
+
+def substring_match(slot_keywords, text, slot_values=None):
+    # the if-chains the augmenter replaces: a slot matches if one of its keywords is in the text
+    return [(slot, (slot_values or {}).get(slot)) for slot, keywords in slot_keywords.items()
+            if any(keyword in text for keyword in keywords)]
+
+
+def random_text(rng, slot_keywords):
+    keywords = [keyword for keywords in slot_keywords.values() for keyword in keywords]
+    pieces = keywords + [keyword[:rng.randint(0, len(keyword))] for keyword in keywords] + [' ', 'x', 'what ', '?']
+    return ''.join(rng.choice(pieces) for _ in range(rng.randint(0, 6)))
+
+
+@pytest.mark.parametrize('slot_keywords,slot_values', [(REQUEST_SLOT_KEYWORDS, None),
+                                                       (SELECT_SLOT_KEYWORDS, SELECT_SLOT_VALUES),
+                                                       (OVERLAPPING_SLOT_KEYWORDS, {'a': 1, 'c': 3})])
+def test_augmenter_matches_substring_semantics(slot_keywords, slot_values):
+    rng = random.Random(0)
+    augmenter = KeywordEntityAugmenter(slot_keywords, slot_values)
+    for _ in range(2000):
+        text = random_text(rng, slot_keywords)
+        assert augmenter.match(text) == substring_match(slot_keywords, text, slot_values), text
+
+
+@pytest.mark.parametrize('text,slots', [('abc', ['a', 'b', 'd']), ('abcd', ['a', 'b', 'c', 'd']),
+                                        ('cab', ['a', 'b', 'c', 'd']), ('b', ['b']), ('', [])])
+def test_augmenter_finds_prefix_and_overlapping_keywords(text, slots):
+    assert [slot for slot, _ in KeywordEntityAugmenter(OVERLAPPING_SLOT_KEYWORDS).match(text)] == slots
+
+
+def test_augmenter_without_keywords():
+    assert KeywordEntityAugmenter({'time': []}).match('what time ?') == []
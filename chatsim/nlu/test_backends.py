@@ -0,0 +1,166 @@
+import os
+import sys
+import types
+
+import pytest
+
+from chatsim.nlu.backends import InterpreterNLUBackend
+from chatsim.nlu.rasa.cache import NLUCache
+
+
+class FakeMessage(object):
+    """
+    rasa_nlu.training_data.Message
+    """
+    def __init__(self, text, data=None, output_properties=None, time=None):
+        self.text = text
+        self.data = dict(data or {})
+        self.output_properties = set(output_properties or [])
+
+    def set(self, prop, info, add_to_output=False):
+        self.data[prop] = info
+        if add_to_output:
+            self.output_properties.add(prop)
+
+    def get(self, prop, default=None):
+        return self.data.get(prop, default)
+
+    def as_dict(self, only_output_properties=False):
+        data = {key: value for key, value in self.data.items()
+                if not only_output_properties or key in self.output_properties}
+        return dict(data, text=self.text)
+
+
+class FakeNLP(object):
+    def __init__(self):
+        self.calls = 0
+        self.pipe_calls = 0
+
+    def __call__(self, text):
+        self.calls += 1
+        return text.split()
+
+    def pipe(self, texts):
+        self.pipe_calls += 1
+        return [text.split() for text in texts]
+
+
+class FakeSpacyNLP(object):
+    name = 'nlp_spacy'
+
+    def __init__(self, case_sensitive):
+        self.nlp = FakeNLP()
+        self.component_config = {'case_sensitive': case_sensitive}
+
+    def process(self, message, **kwargs):
+        text = message.text if self.component_config['case_sensitive'] else message.text.lower()
+        message.set('spacy_doc', self.nlp(text))
+
+
+class FakeIntentClassifier(object):
+    name = 'intent_classifier_sklearn'
+
+    def process(self, message, **kwargs):
+        tokens = message.get('spacy_doc')
+        message.set('intent', {'name': tokens[0] if tokens else None, 'confidence': len(tokens) / 10},
+                    add_to_output=True)
+        message.set('entities', [{'entity': 'token', 'value': token} for token in tokens[1:]], add_to_output=True)
+
+
+class FakeInterpreter(object):
+    """
+    rasa_nlu.model.Interpreter
+    """
+    def __init__(self, pipeline):
+        self.pipeline = pipeline
+        self.context = {}
+
+    @staticmethod
+    def default_output_attributes():
+        return {'intent': {'name': None, 'confidence': 0.0}, 'entities': []}
+
+    def parse(self, text, time=None, only_output_properties=True):
+        if not text:
+            output = self.default_output_attributes()
+            output['text'] = ''
+            return output
+        message = FakeMessage(text, self.default_output_attributes(), time=time)
+        for component in self.pipeline:
+            component.process(message, **self.context)
+        output = self.default_output_attributes()
+        output.update(message.as_dict(only_output_properties=only_output_properties))
+        return output
+
+
+@pytest.fixture
+def fake_rasa(monkeypatch):
+    """
+    Install fake rasa_nlu modules whose Interpreter.load returns the interpreter of fake_rasa.interpreter.
+    """
+    rasa = types.SimpleNamespace(interpreter=None)
+    model = types.ModuleType('rasa_nlu.model')
+    model.Interpreter = types.SimpleNamespace(load=lambda model_dir: rasa.interpreter)
+    training_data = types.ModuleType('rasa_nlu.training_data')
+    training_data.Message = FakeMessage
+    monkeypatch.setitem(sys.modules, 'rasa_nlu', types.ModuleType('rasa_nlu'))
+    monkeypatch.setitem(sys.modules, 'rasa_nlu.model', model)
+    monkeypatch.setitem(sys.modules, 'rasa_nlu.training_data', training_data)
+    return rasa
+
+
+TEXTS = ['what TIME ?', '', 'Do you confirm ?', 'what time ?', 'sorry it is not available', 'hello']
+
+
+@pytest.mark.parametrize('case_sensitive', [True, False])
+def test_interpreter_batch_matches_parse(fake_rasa, tmp_path, case_sensitive):
+    spacy_nlp = FakeSpacyNLP(case_sensitive)
+    fake_rasa.interpreter = FakeInterpreter([spacy_nlp, FakeIntentClassifier()])
+    backend = InterpreterNLUBackend(tmp_path / 'project' / 'model')
+    expected = [fake_rasa.interpreter.parse(text) for text in TEXTS]
+    spacy_nlp.nlp.calls = 0
+
+    assert backend._parse_many(TEXTS) == expected
+    # the spaCy model runs once over the batch
+    assert spacy_nlp.nlp.pipe_calls == 1 and spacy_nlp.nlp.calls == 0
+
+
+def test_interpreter_batch_without_spacy_parses_every_text(fake_rasa, tmp_path):
+    parsed = []
+
+    class Interpreter(FakeInterpreter):
+        def parse(self, text, **kwargs):
+            parsed.append(text)
+            return super().parse(text, **kwargs)
+
+    fake_rasa.interpreter = Interpreter([])
+    backend = InterpreterNLUBackend(tmp_path / 'project' / 'model')
+    assert backend._parse_many(TEXTS) == [FakeInterpreter([]).parse(text) for text in TEXTS]
+    assert parsed == TEXTS
+
+
+def test_interpreter_cache_is_keyed_by_the_model_dir(fake_rasa, tmp_path):
+    parsed = []
+
+    class Interpreter(FakeInterpreter):
+        def parse(self, text, **kwargs):
+            parsed.append(text)
+            return super().parse(text, **kwargs)
+
+    fake_rasa.interpreter = Interpreter([FakeSpacyNLP(True), FakeIntentClassifier()])
+    model_dir = tmp_path / 'elsewhere' / 'model'
+    model_dir.mkdir(parents=True)
+    cache_path = tmp_path / 'cache.json'
+    backend = InterpreterNLUBackend(model_dir, cache=NLUCache(path=cache_path, models_dir=tmp_path / 'models'))
+    response = backend.get_response('hello there')
+    assert backend.get_response('hello there') == response and parsed == ['hello there']
+
+    # the cache persisted by a run is used by the next one with the same model
+    backend.cache.save()
+    backend = InterpreterNLUBackend(model_dir, cache=NLUCache(path=cache_path, models_dir=tmp_path / 'models'))
+    assert backend.get_response('hello there') == response and parsed == ['hello there']
+
+    # a retrained model makes the cached responses stale
+    stat = model_dir.stat()
+    os.utime(model_dir, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    backend.cache.refresh()
+    assert backend.get_response('hello there') == response and parsed == ['hello there', 'hello there']
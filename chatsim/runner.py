@@ -0,0 +1,210 @@
+"""
+Run a simulation configured by a yaml file and command line options instead of the constants of chatsim.moderator.
+
+    python -m chatsim.runner --config chatsim/sample_simulation_config.yml --episodes 1000 --mode batch
+    python -m chatsim.runner --nlu-backend keyword --episodes 100 --set history_max_turns=6
+
+The configuration is made of (in increasing priority) the defaults of the Moderator (see default_config), the yaml
+file given with --config, the command line options and the --set key=value options. Besides the keys of the
+Moderator configuration, the yaml file and --set can give the keys of RUNNER_CONFIG. Nested keys are separated by a
+dot (e.g. --set nlu.port=5001) and --set values are parsed as yaml.
+
+Chatbots (see CHATBOTS) and NLU backends are imported when they are selected, so a run with the rule based chatbot
+and the keyword NLU does not load Rasa or spaCy.
+"""
+import argparse
+import logging
+
+import yaml
+
+from chatsim.moderator import Moderator, CHATBOTS, CURRENT_DIR, default_config
+from chatsim.nlu.backends import NLU_BACKENDS
+from chatsim.user import User
+from chatsim.utils import read_user_profile
+from chatsim.utils.recording import read_recordings
+from chatsim.utils.transcripts import create_transcript_sink
+
+logger = logging.getLogger(__name__)
+
+# simulation driver of every mode (see Moderator)
+MODES = ('sequential', 'parallel', 'async', 'batch', 'record', 'replay')
+
+RUNNER_CONFIG = {
+    # one of MODES, None runs 'parallel' if the configured number of workers is more than 1 and 'sequential' otherwise
+    'mode': None,
+    'user_profile_path': str(CURRENT_DIR / 'user/sample_user_profile.yml'),
+    # seed of the user goals (None for different goals in every run)
+    'goals_seed': None,
+    # resume the sequential simulation from the configured checkpoint_path (the other modes do not checkpoint)
+    'resume': False,
+    # recordings written by the 'record' mode and read by the 'replay' mode
+    'recording_path': None,
+}
+
+
+def load_config(path=None, overrides=None):
+    """
+    Build the Moderator and runner configurations.
+
+    Args:
+        - path (str): yaml configuration file
+        - overrides (dict): {key: value} applied after the file, keys of nested values are separated by a dot
+    Returns:
+        - (config (dict), runner_config (dict))
+    Raises:
+        - ValueError: for an unknown configuration key
+    """
+    config, runner_config = default_config(), dict(RUNNER_CONFIG)
+    settings = {}
+    if path is not None:
+        with open(path, 'r') as f:
+            settings.update(yaml.safe_load(f) or {})
+    settings.update(overrides or {})
+
+    for key, value in settings.items():
+        name, _, nested_key = key.partition('.')
+        if name in runner_config and not nested_key:
+            runner_config[name] = value
+        elif name not in config:
+            raise ValueError("Unknown configuration {}! Choose one of {}".format(
+                key, list(config) + list(runner_config)))
+        elif not nested_key:
+            config[name] = value
+        elif key == 'nlu.backend' and value != config['nlu'].get('backend'):
+            # the parameters of the default backend do not apply to another one
+            config['nlu'] = {'backend': value}
+        else:
+            config[name] = dict(config[name], **{nested_key: value})
+
+    return config, runner_config
+
+
+def create_moderator(config, runner_config):
+    """
+    Create the moderator of the simulation and its user (not for the 'replay' mode, which needs neither).
+    """
+    transcript_sink = None
+    if runner_config['resume'] and config['transcript_path'] is not None:
+        transcript_sink = create_transcript_sink(config['transcript_path'], append=True)
+    if runner_config['mode'] == 'replay':
+        return Moderator(config=config, transcript_sink=transcript_sink)
+
+    user = User(user_profile=read_user_profile(runner_config['user_profile_path']))
+    user.create_random_user_goals(config['num_of_runs'], seed=runner_config['goals_seed'])
+    moderator = Moderator(user=user, config=config, transcript_sink=transcript_sink)
+    moderator.usersimulator = moderator.create_usersimulator()
+    moderator.initialize(user)
+    return moderator
+
+
+def check_config(config, runner_config):
+    """
+    Check the configuration of a run and return its runner configuration with the mode resolved.
+
+    Raises:
+        - ValueError: for an unknown mode, options the mode does not support or an NLU backend without its model
+    """
+    runner_config = dict(runner_config)
+    mode = runner_config['mode']
+    if mode is None:
+        mode = runner_config['mode'] = 'parallel' if config['workers'] > 1 else 'sequential'
+    if mode not in MODES:
+        raise ValueError("Unknown mode {}! Choose one of {}".format(mode, MODES))
+    if mode in ('record', 'replay') and runner_config['recording_path'] is None:
+        raise ValueError("The {} mode needs a recording_path".format(mode))
+    # only Moderator.simulate saves checkpoints
+    if mode != 'sequential' and (config['checkpoint_path'] is not None or runner_config['resume']):
+        raise ValueError("Checkpoints are only supported by the sequential mode, not the {} mode".format(mode))
+    if runner_config['resume'] and config['checkpoint_path'] is None:
+        raise ValueError("Resuming needs a checkpoint_path")
+    nlu_config = config['nlu']
+    if nlu_config.get('backend') == 'interpreter' and not nlu_config.get('model_dir'):
+        raise ValueError("The interpreter NLU backend needs a model_dir")
+
+    return runner_config
+
+
+def run(config, runner_config):
+    """
+    Run the simulation and return its metrics.
+    """
+    runner_config = check_config(config, runner_config)
+    mode = runner_config['mode']
+
+    moderator = create_moderator(config, runner_config)
+    try:
+        if mode == 'sequential':
+            metrics = moderator.simulate(resume=runner_config['resume'])
+        elif mode == 'parallel':
+            metrics = moderator.simulate_parallel()
+        elif mode == 'async':
+            metrics = moderator.simulate_async()
+        elif mode == 'batch':
+            metrics = moderator.simulate_batch()
+        elif mode == 'record':
+            metrics = moderator.record(runner_config['recording_path'])
+        else:
+            metrics = moderator.replay(read_recordings(runner_config['recording_path']))
+    finally:
+        if moderator.nlu.cache is not None:
+            moderator.nlu.cache.save()
+        moderator.close()
+
+    return metrics
+
+
+def parse_setting(setting):
+    key, separator, value = setting.partition('=')
+    if not separator:
+        raise argparse.ArgumentTypeError("Expected key=value, got {}".format(setting))
+    return key.strip(), yaml.safe_load(value)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Simulate conversations between the user simulator and a chatbot")
+    # every option is stored under its configuration key and only the given ones override the configuration
+    option = parser.add_argument
+    option('--config', default=None, help="yaml configuration file")
+    option('--mode', choices=MODES, dest='mode', default=argparse.SUPPRESS)
+    option('--episodes', type=int, dest='num_of_runs', default=argparse.SUPPRESS, help="number of conversations")
+    option('--seed', type=int, dest='seed', default=argparse.SUPPRESS, help="seed of the user simulator")
+    option('--goals-seed', type=int, dest='goals_seed', default=argparse.SUPPRESS, help="seed of the user goals")
+    option('--max-turns', type=int, dest='max_turns', default=argparse.SUPPRESS)
+    option('--chatbot', choices=list(CHATBOTS), dest='chatbot', default=argparse.SUPPRESS)
+    option('--nlu-backend', choices=list(NLU_BACKENDS), dest='nlu.backend', default=argparse.SUPPRESS)
+    option('--profile-file', dest='user_profile_path', default=argparse.SUPPRESS,
+           help="yaml file of the user profiles")
+    option('--profile', dest='user_profile', default=argparse.SUPPRESS, help="profile of the simulated user")
+    option('--workers', type=int, dest='workers', default=argparse.SUPPRESS)
+    option('--batch-size', type=int, dest='nlu_batch_size', default=argparse.SUPPRESS)
+    option('--concurrency', type=int, dest='max_concurrent_episodes', default=argparse.SUPPRESS)
+    option('--nlu-cache-size', type=int, dest='nlu_cache_size', default=argparse.SUPPRESS)
+    option('--nlu-cache-path', dest='nlu_cache_path', default=argparse.SUPPRESS)
+    option('--nlg-cache-size', type=int, dest='nlg_cache_size', default=argparse.SUPPRESS)
+    option('--transcripts', dest='transcript_path', default=argparse.SUPPRESS,
+           help="JSON Lines file of the transcripts (.gz to compress)")
+    option('--results', dest='results_path', default=argparse.SUPPRESS, help=".npz file of the results store")
+    option('--checkpoint', dest='checkpoint_path', default=argparse.SUPPRESS)
+    option('--resume', action='store_true', dest='resume', default=argparse.SUPPRESS)
+    option('--recording', dest='recording_path', default=argparse.SUPPRESS,
+           help="recordings written by --mode record and read by --mode replay")
+    option('--timings', action='store_true', dest='instrumentation', default=argparse.SUPPRESS,
+           help="time the stages of the simulation loop")
+    option('--timings-json', dest='instrumentation_json_path', default=argparse.SUPPRESS)
+    option('--timings-prometheus', dest='instrumentation_prometheus_path', default=argparse.SUPPRESS)
+    option('--set', type=parse_setting, action='append', dest='settings', default=[], metavar='KEY=VALUE',
+           help="set any configuration key (the value is parsed as yaml)")
+    args = vars(parser.parse_args(argv))
+
+    config_path = args.pop('config')
+    overrides = dict(args.pop('settings'))
+    try:
+        config, runner_config = load_config(config_path, dict(args, **overrides))
+        runner_config = check_config(config, runner_config)
+    except ValueError as e:
+        parser.error(str(e))
+    run(config, runner_config)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,204 @@
+import numpy as np
+import pytest
+
+from chatsim.moderator import Moderator, CURRENT_DIR
+from chatsim.user import User
+from chatsim.utils import read_user_profile
+from chatsim.utils.checkpoint import Checkpoint
+from chatsim.utils.recording import read_recordings
+from chatsim.utils.results import ResultsStore
+from chatsim.utils.transcripts import create_transcript_sink, read_transcripts
+
+NUM_OF_RUNS = 60
+
+
+def create_moderator(seed):
+    user = User(user_profile=read_user_profile(CURRENT_DIR / 'user/sample_user_profile.yml'))
+    user.create_random_user_goals(NUM_OF_RUNS, seed=1)
+    moderator = Moderator(user=user, config={'nlu': {'backend': 'keyword'}, 'num_of_runs': NUM_OF_RUNS, 'seed': seed,
+                                             'checkpoint_interval': 10, 'episode_retry_delay': 0})
+    moderator.usersimulator = moderator.create_usersimulator()
+    # an unseeded simulation goes on with the random stream of the user simulator
+    moderator.usersimulator.random_source.seed(11)
+    return moderator
+
+
+def interrupt_nlu(moderator, after_calls):
+    get_response, calls = moderator.nlu.get_response, [0]
+
+    def interrupted_get_response(text):
+        calls[0] += 1
+        if calls[0] > after_calls:
+            raise KeyboardInterrupt
+        return get_response(text)
+
+    moderator.nlu.get_response = interrupted_get_response
+
+
+def episode_outcomes(results):
+    episodes = results.episodes
+    order = np.argsort(episodes.column('episode'))
+    return {name: episodes.column(name)[order].tolist() for name in ('episode', 'num_of_turns', 'success')}
+
+
+@pytest.mark.parametrize('seed', [3, None])
+def test_resumed_simulation_matches_uninterrupted_simulation(tmp_path, seed):
+    checkpoint_path = str(tmp_path / 'checkpoint.json')
+    moderator = create_moderator(seed)
+    expected_metrics = moderator.simulate()
+    expected_outcomes = episode_outcomes(moderator.results)
+
+    moderator = create_moderator(seed)
+    # about 5 NLU calls per episode, so the run stops in the middle of an episode after some checkpoints
+    interrupt_nlu(moderator, after_calls=163)
+    with pytest.raises(KeyboardInterrupt):
+        moderator.simulate(checkpoint_path=checkpoint_path)
+    assert 0 < len(moderator.results) < NUM_OF_RUNS
+
+    moderator = create_moderator(seed)
+    # the resumed run restores the random state of the checkpoint
+    moderator.usersimulator.random_source.seed(999)
+    assert moderator.simulate(checkpoint_path=checkpoint_path, resume=True) == expected_metrics
+    assert episode_outcomes(moderator.results) == expected_outcomes
+    assert not moderator.quarantined
+
+
+def test_transient_nlu_errors_are_retried_and_quarantined(tmp_path):
+    checkpoint_path = str(tmp_path / 'checkpoint.json')
+    moderator = create_moderator(3)
+    expected_metrics = moderator.simulate()
+
+    moderator = create_moderator(3)
+    get_response, calls = moderator.nlu.get_response, [0]
+
+    def flaky_get_response(text):
+        calls[0] += 1
+        # a single failure is retried, three failures in a row quarantine the episode
+        if calls[0] == 20 or 100 <= calls[0] <= 102:
+            raise ConnectionError('NLU server is not answering')
+        return get_response(text)
+
+    moderator.nlu.get_response = flaky_get_response
+    moderator.simulate(checkpoint_path=checkpoint_path)
+    assert len(moderator.quarantined) == 1
+    assert len(moderator.results) == NUM_OF_RUNS - 1
+
+    # the quarantined episode is run again when the simulation is resumed
+    moderator = create_moderator(3)
+    assert moderator.simulate(checkpoint_path=checkpoint_path, resume=True) == expected_metrics
+    assert not moderator.quarantined
+
+
+def test_other_errors_stop_the_simulation():
+    moderator = create_moderator(3)
+
+    def broken_get_response(text):
+        raise KeyError('intent')
+
+    moderator.nlu.get_response = broken_get_response
+    with pytest.raises(KeyError):
+        moderator.simulate()
+    assert not moderator.quarantined
+
+
+def test_async_episodes_are_retried_and_quarantined():
+    moderator = create_moderator(3)
+    expected_metrics = moderator.simulate()
+    expected_outcomes = episode_outcomes(moderator.results)
+
+    moderator = create_moderator(3)
+    assert moderator.simulate_async() == expected_metrics
+    assert episode_outcomes(moderator.results) == expected_outcomes
+
+    moderator = create_moderator(3)
+    get_response, calls = moderator.nlu.get_response, [0]
+
+    def flaky_get_response(text):
+        calls[0] += 1
+        if calls[0] == 20 or 100 <= calls[0] <= 102:
+            raise ConnectionError('NLU server is not answering')
+        return get_response(text)
+
+    moderator.nlu.get_response = flaky_get_response
+    # one conversation at a time, so that the three failures in a row are those of one episode
+    moderator.simulate_async(max_concurrency=1)
+    assert len(moderator.quarantined) == 1
+    assert len(moderator.results) == NUM_OF_RUNS - 1
+
+    moderator.nlu.get_response = lambda text: {}['intent']
+    with pytest.raises(KeyError):
+        moderator.simulate_async()
+
+
+def test_checkpoints_save_only_the_new_results(tmp_path):
+    checkpoint_path = str(tmp_path / 'checkpoint.json')
+    moderator = create_moderator(3)
+    moderator.simulate(checkpoint_path=checkpoint_path)
+
+    checkpoint = Checkpoint(checkpoint_path, seed=3).load()
+    # one segment of 10 episodes per checkpoint_interval
+    assert len(checkpoint.results_segments) == NUM_OF_RUNS // 10
+    assert [len(ResultsStore.load(path)) for path in checkpoint.results_segments] == [10] * (NUM_OF_RUNS // 10)
+    assert checkpoint.results_sizes == moderator.results.sizes
+    assert episode_outcomes(ResultsStore.load_segments(checkpoint.results_segments)) == \
+        episode_outcomes(moderator.results)
+
+
+def test_results_are_optional():
+    moderator = create_moderator(3)
+    expected_metrics = moderator.simulate()
+
+    moderator = create_moderator(3)
+    moderator.config['keep_results'] = False
+    assert moderator.simulate() == expected_metrics
+    assert moderator.results is None
+
+
+@pytest.mark.parametrize('config', [{'checkpoint_interval': 0}, {'keep_results': False, 'results_path': 'r.npz'}])
+def test_invalid_configurations_are_rejected(config):
+    with pytest.raises(ValueError):
+        Moderator(config=dict(config, nlu={'backend': 'keyword'}))
+
+
+def test_parallel_chunks_are_streamed_like_the_sequential_simulation(tmp_path):
+    transcripts = {}
+    for mode in ('sequential', 'parallel'):
+        moderator = create_moderator(3)
+        moderator.config['parallel_chunk_size'] = 7
+        moderator.transcript_sink = create_transcript_sink(str(tmp_path / '{}.jsonl'.format(mode)))
+        metrics = moderator.simulate() if mode == 'sequential' else moderator.simulate_parallel(num_workers=3)
+        moderator.close()
+        transcripts[mode] = sorted(read_transcripts(tmp_path / '{}.jsonl'.format(mode)), key=lambda r: r['episode'])
+        if mode == 'sequential':
+            expected_metrics, expected_outcomes = metrics, episode_outcomes(moderator.results)
+        else:
+            assert metrics == expected_metrics
+            assert episode_outcomes(moderator.results) == expected_outcomes
+
+    assert [record['episode'] for record in transcripts['parallel']] == list(range(NUM_OF_RUNS))
+    assert transcripts['parallel'] == transcripts['sequential']
+
+
+def test_replay_reports_the_episodes_which_diverge(tmp_path):
+    path = str(tmp_path / 'recordings.jsonl.gz')
+    moderator = create_moderator(3)
+    expected_metrics = moderator.record(path)
+    recordings = list(read_recordings(path))
+    assert len(recordings) == NUM_OF_RUNS
+
+    moderator = create_moderator(3)
+    assert moderator.replay(recordings) == expected_metrics
+    assert not moderator.replay_mismatches
+
+    # random numbers missing from a recording, a conversation which is not the recorded one and a recorded NLU
+    # output which makes the user simulator answer differently
+    recordings[2] = recordings[2]._replace(draws={})
+    recordings[5] = recordings[5]._replace(conversation_log=recordings[5].conversation_log[:-1])
+    nlu_outputs = list(recordings[7].nlu_outputs)
+    nlu_outputs[0] = dict(nlu_outputs[0], intent={'name': 'GOODBYE', 'confidence': 1.0}, entities=[])
+    recordings[7] = recordings[7]._replace(nlu_outputs=nlu_outputs)
+    moderator = create_moderator(3)
+    moderator.replay(recordings)
+    assert moderator.replay_mismatches == [2, 5, 7]
+    # the episodes which diverged are not in the results
+    assert len(moderator.results) == NUM_OF_RUNS - 1
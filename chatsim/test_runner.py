@@ -0,0 +1,19 @@
+import pytest
+
+from chatsim.runner import check_config, load_config, main
+
+
+def test_interpreter_backend_needs_a_model_dir(tmp_path):
+    config, runner_config = load_config(overrides={'nlu.backend': 'interpreter'})
+    with pytest.raises(ValueError):
+        check_config(config, runner_config)
+
+    config, runner_config = load_config(overrides={'nlu.backend': 'interpreter', 'nlu.model_dir': str(tmp_path)})
+    assert check_config(config, runner_config)['mode'] == 'sequential'
+
+
+@pytest.mark.parametrize('argv', [['--nlu-backend', 'interpreter'], ['--mode', 'async', '--resume'],
+                                  ['--set', 'unknown=1']])
+def test_invalid_configurations_are_command_line_errors(argv):
+    with pytest.raises(SystemExit):
+        main(argv)
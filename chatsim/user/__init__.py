@@ -1 +1 @@
-from .user import User
+from .user import User, UserGoalGenerator, CorpusGoalSampler
@@ -0,0 +1,75 @@
+import numpy as np
+import pytest
+
+from chatsim.user.user import AliasTable
+
+WEIGHTS = [
+    [1],
+    [1, 1, 1, 1],
+    [5, 1],
+    [0, 3, 0, 1],
+    [1000, 1, 1, 1, 250, 40],
+    list(np.random.default_rng(0).pareto(1.5, size=300) + 1e-3),
+]
+
+
+def alias_probabilities(table):
+    """
+    Probability of every index of an alias table: the index is drawn and kept, or another index is drawn and replaced
+    by its alias.
+    """
+    n = len(table)
+    probabilities = table.prob / n
+    np.add.at(probabilities, table.alias, (1.0 - table.prob) / n)
+    return probabilities
+
+
+@pytest.mark.parametrize('weights', WEIGHTS)
+def test_alias_table_probabilities(weights):
+    expected = np.asarray(weights) / np.sum(weights)
+    assert np.allclose(alias_probabilities(AliasTable(weights)), expected, rtol=1e-9, atol=1e-12)
+
+
+@pytest.mark.parametrize('weights', WEIGHTS)
+def test_alias_table_frequencies(weights):
+    size = 200000
+    expected = np.asarray(weights) / np.sum(weights)
+    samples = AliasTable(weights).sample(np.random.default_rng(1), size)
+    frequencies = np.bincount(samples, minlength=len(weights)) / size
+    choice_frequencies = np.bincount(np.random.default_rng(2).choice(len(weights), size=size, p=expected),
+                                     minlength=len(weights)) / size
+
+    # 6 standard deviations of the frequency of every value
+    tolerance = 6 * np.sqrt(expected * (1 - expected) / size) + 1e-9
+    assert np.all(np.abs(frequencies - expected) <= tolerance)
+    assert np.all(np.abs(frequencies - choice_frequencies) <= 2 * tolerance)
+    # values of weight 0 are never drawn
+    assert not np.any(frequencies[expected == 0])
+
+
+@pytest.mark.parametrize('weights', [[], [0, 0], [-1, 0]])
+def test_alias_table_rejects_weights_without_positive_weight(weights):
+    with pytest.raises(ValueError):
+        AliasTable(weights)
+
+
+def test_value_counts_fall_back_for_slots_missing_from_the_corpus(monkeypatch):
+    from collections import Counter
+    from chatsim.user import user
+    from chatsim.utils import data_providers
+
+    index = data_providers.CorpusIndex()
+    index.slot_values = {'time': Counter({'7 pm': 3, '8 pm': 1}), 'num_tickets': Counter({'2': 2}),
+                         'date': Counter()}
+    monkeypatch.setattr(data_providers, 'corpus_index', lambda corpus: index)
+    user.load_value_counts.cache_clear()
+    try:
+        value_counts = user.load_value_counts('fake-corpus')
+    finally:
+        user.load_value_counts.cache_clear()
+
+    assert list(value_counts) == user.MOVIE_SLOTS
+    assert value_counts['time'] == [('7 pm', 3), ('8 pm', 1)]
+    assert value_counts['num_people'] == [('2', 2)]
+    for slot in ['date', 'movie', 'theatre_name']:
+        assert value_counts[slot] == [(value, 1) for value in user.entity_value_sets[slot]]
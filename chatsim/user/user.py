@@ -1,7 +1,18 @@
+import logging
+from functools import lru_cache
 from pathlib import Path
 from chatsim.utils import Goal, UserGoal, read_user_profile
-from random import choice
+import numpy as np
 
+logger = logging.getLogger(__name__)
+
+# slots of the simulated (movie booking) user and the corpus their values are read from (see load_entity_value_sets)
+MOVIE_SLOTS = ['time', 'date', 'movie', 'theatre_name', 'num_people']
+ENTITY_VALUES_CORPUS = 'sim-M'
+# corpus slots which have another name in the simulator
+CORPUS_SLOT_ALIASES = {'num_tickets': 'num_people'}
+
+# values used when the corpus is not available
 entity_value_sets = {
     'time': ['2', '3', '12', '7', '2 pm', '12 pm', '7 pm', '12 am', '7 am'],
     'date': ['today', 'tomorrow', 'saturday', 'monday', 'tuesday', 'wednesday', 'friday'],
@@ -13,6 +24,39 @@ entity_types = ['fixed', 'flexible', 'multiple_value', 'open']
 # entity_types = ['fixed', 'flexible']
 
 
+@lru_cache(maxsize=None)
+def load_value_counts(corpus=ENTITY_VALUES_CORPUS, slots=tuple(MOVIE_SLOTS)):
+    """
+    (value, count) pairs of every slot in the dialogue states of corpus, from the most to the least frequent, read
+    from the persisted CorpusIndex of the corpus. Falls back to entity_value_sets (with a count of 1 for every value)
+    if the corpus is not available or cannot be read, and for the slots the corpus has no value of.
+    """
+    from chatsim.utils.data_providers import corpus_index
+    try:
+        index = corpus_index(corpus)
+    except (OSError, EOFError, ValueError) as e:
+        # missing or unreadable corpus
+        logger.warning("Using the default entity values: {!r}".format(e))
+        return {slot: [(value, 1) for value in entity_value_sets[slot]] for slot in slots}
+
+    slot_names = {CORPUS_SLOT_ALIASES.get(slot, slot): slot for slot in index.slot_values}
+    value_counts = {}
+    for slot in slots:
+        counts = index.value_counts(slot_names[slot]) if slot in slot_names else []
+        if not counts:
+            logger.warning("No value of slot {} in corpus {}, using the default values".format(slot, corpus))
+            counts = [(value, 1) for value in entity_value_sets[slot]]
+        value_counts[slot] = counts
+    return value_counts
+
+
+def load_entity_value_sets(corpus=ENTITY_VALUES_CORPUS, slots=tuple(MOVIE_SLOTS)):
+    """
+    Values of every slot in the dialogue states of corpus, from the most to the least frequent (see load_value_counts).
+    """
+    return {slot: [value for value, _ in counts] for slot, counts in load_value_counts(corpus, slots).items()}
+
+
 class User():
 
     def __init__(self, name='Mansour', user_profile=None):
@@ -20,33 +64,139 @@ class User():
         self.user_profile = user_profile
         self.user_goals = []
 
-    def create_random_user_goals(self, num_of_goals: int = 100):
-        for _ in range(num_of_goals):
-            self.user_goals.append(self._create_random_user_goal())
-
-    def _create_random_user_goal(self):
-        user_goals = []
-        for entity in list(entity_value_sets.keys()):
-            created_goal = self._create_random_goal(entity)
-            user_goals.append(created_goal)
-
-        new_user_goal = UserGoal(goal_list=user_goals, domain='movie', intent='booking')
-
-        return new_user_goal
-
-    def _create_random_goal(self, entity: str):
-        ent_type = choice(entity_types)
-        ent_val = []
-        if ent_type == 'fixed' or ent_type == 'flexible':
-            ent_val.append(choice(list(entity_value_sets[entity])))
-        elif ent_type == 'open':
-            ent_val.append('dont care')
-        elif ent_type == 'multiple_value':
-            ent_val = list(entity_value_sets[entity])[:3]
-
-        new_goal = Goal(slot=entity, value=ent_val, type=ent_type)
-
-        return new_goal
+    def create_random_user_goals(self, num_of_goals: int = 100, seed=None):
+        self.user_goals += CorpusGoalSampler(seed=seed).generate(num_of_goals)
+
+
+class UserGoalGenerator(object):
+    """
+    Generate random UserGoals in batches.
+
+    Goal types and values of batch_size goals are drawn at once from a numpy Generator, so producing a large number
+    of goals only costs a few vectorized draws per batch. generate() yields the goals lazily, so they do not have to be
+    held in memory. Generators created with spawn() get independent seeded streams (e.g. one per worker process)
+    which makes the generated goals reproducible.
+
+    Attributes:
+        - entity_value_sets (dict{str:list[str]}): possible values of every slot (see load_entity_value_sets)
+        - entity_types (list[str]): possible goal types
+        - batch_size (int): number of goals drawn at once
+    """
+    def __init__(self, entity_value_sets=None, entity_types=entity_types, seed=None, batch_size=10000):
+        if entity_value_sets is None:
+            entity_value_sets = load_entity_value_sets()
+        self.entity_value_sets = entity_value_sets
+        self.entity_types = entity_types
+        self.batch_size = batch_size
+        self.rng = np.random.default_rng(seed)
+        self._slots = list(entity_value_sets.keys())
+        self._values = [list(entity_value_sets[slot]) for slot in self._slots]
+        self._num_of_values = np.array([len(values) for values in self._values])
+
+    @classmethod
+    def spawn(cls, seed, num_of_streams, **kwargs):
+        """
+        Create num_of_streams generators with independent random streams derived from seed.
+        """
+        seed_sequences = np.random.SeedSequence(seed).spawn(num_of_streams)
+        return [cls(seed=seed_sequence, **kwargs) for seed_sequence in seed_sequences]
+
+    def generate(self, num_of_goals):
+        """
+        Yield num_of_goals random UserGoals.
+        """
+        num_of_slots = len(self._slots)
+        for start in range(0, num_of_goals, self.batch_size):
+            batch_size = min(self.batch_size, num_of_goals - start)
+            goal_types = self.rng.integers(len(self.entity_types), size=(batch_size, num_of_slots)).tolist()
+            value_indices = self._draw_value_indices(batch_size).tolist()
+            for types, indices in zip(goal_types, value_indices):
+                yield self._create_user_goal(types, indices)
+
+    def _draw_value_indices(self, batch_size):
+        """
+        Draw the index of the value of every slot for batch_size goals (uniform over the values of the slot).
+        """
+        return (self.rng.random((batch_size, len(self._slots))) * self._num_of_values).astype(np.int64)
+
+    def _create_user_goal(self, goal_types, value_indices):
+        goal_list = []
+        for slot, values, type_index, value_index in zip(self._slots, self._values, goal_types, value_indices):
+            ent_type = self.entity_types[type_index]
+            if ent_type == 'fixed' or ent_type == 'flexible':
+                ent_val = [values[value_index]]
+            elif ent_type == 'open':
+                ent_val = ['dont care']
+            elif ent_type == 'multiple_value':
+                ent_val = values[:3]
+            else:
+                ent_val = []
+            goal_list.append(Goal(slot=slot, value=ent_val, type=ent_type))
+
+        return UserGoal(goal_list=goal_list, domain='movie', intent='booking')
+
+
+class AliasTable(object):
+    """
+    Vose's alias method: after an O(n) setup, every draw from the discrete distribution given by weights costs O(1)
+    (one uniform index and one uniform threshold), whatever the number of values.
+
+    Attributes:
+        - prob (np.ndarray): probability of keeping the drawn index
+        - alias (np.ndarray): index returned instead when the drawn index is not kept
+    """
+    def __init__(self, weights):
+        weights = np.asarray(weights, dtype=np.float64)
+        n = len(weights)
+        if n == 0 or weights.sum() <= 0:
+            raise ValueError("AliasTable needs at least one positive weight!")
+        scaled = weights * (n / weights.sum())
+        self.prob = np.ones(n)
+        self.alias = np.arange(n)
+
+        small = [i for i in range(n) if scaled[i] < 1.0]
+        large = [i for i in range(n) if scaled[i] >= 1.0]
+        while small and large:
+            s, l = small.pop(), large.pop()
+            self.prob[s] = scaled[s]
+            self.alias[s] = l
+            scaled[l] -= 1.0 - scaled[s]
+            (small if scaled[l] < 1.0 else large).append(l)
+        # the remaining entries have a scaled weight of 1 (up to rounding errors) and keep prob = 1
+
+    def __len__(self):
+        return len(self.prob)
+
+    def sample(self, rng, size):
+        indices = (rng.random(size) * len(self.prob)).astype(np.int64)
+        keep = rng.random(size) < self.prob[indices]
+        return np.where(keep, indices, self.alias[indices])
+
+
+class CorpusGoalSampler(UserGoalGenerator):
+    """
+    UserGoalGenerator which draws the value of every slot from its empirical distribution in the dialogue states of a
+    corpus (see load_value_counts) instead of uniformly. The frequency tables are read once per corpus from its
+    CorpusIndex and turned into alias tables, so every draw is O(1) per slot even for slots with thousands of values.
+
+    Attributes:
+        - value_counts (dict{str:list[tuple]}): (value, count) pairs of every slot, from the most to the least frequent
+    """
+    def __init__(self, corpus=ENTITY_VALUES_CORPUS, value_counts=None, entity_types=entity_types, seed=None,
+                 batch_size=10000):
+        if value_counts is None:
+            value_counts = load_value_counts(corpus)
+        self.value_counts = value_counts
+        super().__init__(entity_value_sets={slot: [value for value, _ in counts]
+                                            for slot, counts in value_counts.items()},
+                         entity_types=entity_types, seed=seed, batch_size=batch_size)
+        self._alias_tables = [AliasTable([count for _, count in value_counts[slot]]) for slot in self._slots]
+
+    def _draw_value_indices(self, batch_size):
+        """
+        Draw the index of the value of every slot for batch_size goals (from the corpus frequencies of the slot).
+        """
+        return np.stack([table.sample(self.rng, batch_size) for table in self._alias_tables], axis=1)
 
 
 def main():
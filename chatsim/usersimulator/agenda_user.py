@@ -1,6 +1,8 @@
-from chatsim.utils import Annotation, Goal, get_random_number
+from chatsim.utils import Annotation, Goal, RandomSource, annotation_key
 from chatsim.utils.diagact import *
 
+from collections import defaultdict
+from itertools import islice
 import logging
 import copy
 
@@ -13,12 +15,25 @@ class Agenda():
     Agenda in agenda-based user simulator.
     Agenda is a stack-like data structure which we use to store user Constraints and Requests.
 
+    Annotations are stored in an insertion ordered map next to secondary indexes by diagact name and by
+    (diagact name, slot), so pushing without duplicates, popping, remove_annotation and remove_matching do not scan
+    the agenda. The positional methods (search_agenda, remove_by_index, stack and indexing from the bottom) have to
+    count the annotations below a position and cost O(len(agenda)).
+
     Attributes:
-        - data (list[Annotation]): Container for annotations in agenda
+        - stack (list[Annotation]): Annotations in agenda (the last one is the top of the agenda)
     """
     def __init__(self):
-        # self._data = []
-        self.stack = []
+        # annotation id -> (annotation, annotation key) of the annotations in agenda
+        self._annotations = {}
+        # annotation ids from the bottom to the top of the agenda. Ids of removed annotations are dropped lazily.
+        self._order = []
+        # annotation key -> annotation id
+        self._key_to_id = {}
+        # diagact name -> annotation ids, (diagact name, slot) -> annotation ids
+        self._ids_by_diagact = defaultdict(set)
+        self._ids_by_diagact_slot = defaultdict(set)
+        self._next_id = 0
 
     def pop(self, number_of_items=1, multi_diagact=False):
         """
@@ -40,20 +55,20 @@ class Agenda():
         popped_annotations = []
         if not multi_diagact:
             if not self.is_empty():
-                current_da = self.stack[-1].diagact.name
+                current_da = self._top().diagact.name
                 prev_da = current_da
                 while current_da == prev_da and number_of_items:
-                    annot = self.stack.pop()
+                    annot = self._pop_top()
                     popped_annotations.append(annot)
                     if self.is_empty():
                         break
                     prev_da = annot.diagact.name
-                    current_da = self.stack[-1].diagact.name
+                    current_da = self._top().diagact.name
                     number_of_items -= 1
 
         else:
             while number_of_items and not self.is_empty():
-                popped_annotations.append(self.stack.pop())
+                popped_annotations.append(self._pop_top())
                 number_of_items -= 1
 
         logger.debug("Successfully poped {} items from agenda".format(len(popped_annotations)))
@@ -65,11 +80,14 @@ class Agenda():
         """
         remove annotation from the agenda
         """
-        self.stack.remove(annotation)
+        annotation_id = self._key_to_id.get(annotation_key(annotation))
+        if annotation_id is None:
+            raise ValueError("Annotation is not in the agenda!")
+        self._remove_id(annotation_id)
 
     def remove_by_index(self, index_list):
         """
-        Remove the annotations which their index is in the index_list
+        Remove the annotations which their index is in the index_list. Scans the agenda, see remove_matching.
 
         Args:
             index_list (list(int))
@@ -77,12 +95,23 @@ class Agenda():
         if not isinstance(index_list, list):
             raise TypeError("You have to pass a list of indices to remove from agenda!")
 
-        new_agenda = []
-        for i,annotation in enumerate(self.stack):
-            if i not in index_list:
-                new_agenda.append(annotation)
+        index_set = set(index_list)
+        for i, annotation_id in enumerate(self._live_ids()):
+            if i in index_set:
+                self._remove_id(annotation_id)
+
+    def remove_matching(self, diagact_type, goal_slot_name=None):
+        """
+        Remove all the annotations with the given diagact (and goal_slot_name) from the agenda
+
+        Returns:
+            number of removed annotations
+        """
+        annotation_ids = list(self._matching_ids(diagact_type, goal_slot_name))
+        for annotation_id in annotation_ids:
+            self._remove_id(annotation_id)
 
-        self.stack = new_agenda
+        return len(annotation_ids)
 
     def push(self, annotation):
         """
@@ -104,14 +133,67 @@ class Agenda():
         Args:
             - annotation (Annotation)
         """
-        if annotation in self.stack:
-            self.stack.remove(annotation)
-        self.stack.append(annotation)
+        key = annotation_key(annotation)
+        if key in self._key_to_id:
+            self._remove_id(self._key_to_id[key])
+
+        annotation_id = self._next_id
+        self._next_id += 1
+        self._annotations[annotation_id] = (annotation, key)
+        self._order.append(annotation_id)
+        self._key_to_id[key] = annotation_id
+        diagact_name = annotation.diagact.name
+        self._ids_by_diagact[diagact_name].add(annotation_id)
+        for gs in annotation.goal_list or []:
+            self._ids_by_diagact_slot[(diagact_name, gs.slot)].add(annotation_id)
+
+    def _remove_id(self, annotation_id):
+        annotation, key = self._annotations.pop(annotation_id)
+        del self._key_to_id[key]
+        diagact_name = annotation.diagact.name
+        self._discard_from_index(self._ids_by_diagact, diagact_name, annotation_id)
+        for gs in annotation.goal_list or []:
+            self._discard_from_index(self._ids_by_diagact_slot, (diagact_name, gs.slot), annotation_id)
+
+        # drop the ids of removed annotations once they are the majority of _order
+        if len(self._order) > 2 * len(self._annotations) + 16:
+            self._order = list(self._live_ids())
+
+        return annotation
+
+    @staticmethod
+    def _discard_from_index(index, index_key, annotation_id):
+        ids = index[index_key]
+        ids.discard(annotation_id)
+        if not ids:
+            del index[index_key]
+
+    def _live_ids(self):
+        return (annotation_id for annotation_id in self._order if annotation_id in self._annotations)
+
+    def _top_id(self):
+        while self._order[-1] not in self._annotations:
+            self._order.pop()
+        return self._order[-1]
+
+    def _top(self):
+        return self._annotations[self._top_id()][0]
+
+    def _pop_top(self):
+        annotation_id = self._top_id()
+        self._order.pop()
+        return self._remove_id(annotation_id)
+
+    def _matching_ids(self, diagact_type, goal_slot_name=None):
+        if not goal_slot_name:
+            return self._ids_by_diagact.get(diagact_type, set())
+        return self._ids_by_diagact_slot.get((diagact_type, goal_slot_name), set())
 
     def search_agenda(self, diagact_type, goal_slot_name=None):
         """
         Find all the annotations with the given diagact and goal_slot_name and
-        return their index in the agenda
+        return their index in the agenda. The matching annotations are found with the indexes, but their
+        positions are counted by scanning the agenda.
         Args:
             diagact_type (str): Diagact type
             goal_slot_name (str): Name of the GoalSlot object in the annotation
@@ -119,25 +201,35 @@ class Agenda():
         Returns:
             index_list (list(int)): List of indices for the annotations with the given diagact
         """
-        index_list = []
-        for i, annotation in enumerate(self.stack):
-            if annotation.diagact.name == diagact_type:
-                if not goal_slot_name:
-                    index_list.append(i)
-                else:
-                    if goal_slot_name in list(gs.slot for gs in annotation.goal_list):
-                        index_list.append(i)
+        matching_ids = self._matching_ids(diagact_type, goal_slot_name)
+        if not matching_ids:
+            return []
 
-        return index_list
+        return [i for i, annotation_id in enumerate(self._live_ids()) if annotation_id in matching_ids]
 
     def clear(self):
-        self.stack.clear()
+        self._annotations.clear()
+        self._order.clear()
+        self._key_to_id.clear()
+        self._ids_by_diagact.clear()
+        self._ids_by_diagact_slot.clear()
 
     def is_empty(self):
-        return len(self.stack) == 0
+        return len(self._annotations) == 0
+
+    @property
+    def stack(self):
+        """
+        Copy of the annotations in agenda, from the bottom to the top (O(len(agenda))).
+        """
+        return [self._annotations[annotation_id][0] for annotation_id in self._live_ids()]
 
     def __len__(self):
-        return len(self.stack)
+        return len(self._annotations)
+
+    def __iter__(self):
+        # the agenda must not be modified while it is iterated
+        return (self._annotations[annotation_id][0] for annotation_id in self._live_ids())
 
     def __str__(self):
         s = ""
@@ -148,7 +240,22 @@ class Agenda():
         return s
 
     def __getitem__(self, index):
-        return self.stack[index]
+        """
+        Annotation at index (from the bottom of the agenda, or from the top for a negative index) in O(|index|)
+        without copying the agenda. Slices are taken from a copy (see stack).
+        """
+        if isinstance(index, slice):
+            return self.stack[index]
+        if index == -1 and not self.is_empty():
+            return self._top()
+        if index >= 0:
+            annotation_ids = islice(self._live_ids(), index, None)
+        else:
+            annotation_ids = islice((annotation_id for annotation_id in reversed(self._order)
+                                     if annotation_id in self._annotations), -index - 1, None)
+        for annotation_id in annotation_ids:
+            return self._annotations[annotation_id][0]
+        raise IndexError("agenda index out of range")
 
 
 class AgendaUser(object):
@@ -169,8 +276,11 @@ class AgendaUser(object):
             user intentions. User behaviour later will be used to determine how user switches between different
             Agendas (intentions) to simulate the multi-domain user.
     """
-    def __init__(self, name=None, params=None, user_profile=None, user_goals=None, current_intent=None):
+    def __init__(self, name=None, params=None, user_profile=None, user_goals=None, current_intent=None,
+                 random_source=None):
         self._max_turn = params["max_turn"]
+        # every stochastic decision of the user is drawn from this source (see initialize for per-episode seeds)
+        self._random = random_source or RandomSource()
         self._profile = user_profile
         self._user_goals = user_goals
         self._current_intent = current_intent
@@ -180,8 +290,24 @@ class AgendaUser(object):
         # special memory items to keep track of user behaviour
         self._request_option_slots = set()
         self._informed_slots = set()
-
-    def initialize(self, user_profile, user_goals):
+        # system diagact name -> (response method, does the act end the episode, does the episode fail)
+        self._sys_act_handlers = {
+            Greeting.name: (self.response_to_greeting, False, False),
+            Inform.name: (self.response_to_inform, False, False),
+            Request.name: (self.response_to_request, False, False),
+            Confirm.name: (self.response_to_confirm, False, False),
+            Offer.name: (self.response_to_offer, False, False),
+            Select.name: (self.response_to_select, False, False),
+            Affirm.name: (self.response_to_affirm, False, False),
+            Negate.name: (self.response_to_negate, False, False),
+            GoodBye.name: (self.response_to_goodbye, True, False),
+            'ACKNOWLEDGE': (self.response_to_acknowledge, False, False),
+            NotifySuccess.name: (self.response_to_notifysuccess, True, False),
+            NotifyFailure.name: (self.response_to_notifyfailure, True, True),
+            CantUnderstand.name: (self.response_to_cant_understand, False, False),
+        }
+
+    def initialize(self, user_profile, user_goals, seed=None):
         """
         Initialize agenda-based user.
 
@@ -192,6 +318,7 @@ class AgendaUser(object):
             - domain_dict (dict{str:Domain}): Mapping form domain names to Domain objects. Each Domain has a number
                 of intentions which AgendaUser uses to get information about slots of that intention (see m2m_core/
                 ontology/ontologies/movie_domain.yml for an example)
+            - seed: Seed of the random source of the user for this episode. The random stream is not reset if None.
 
         The following steps happen in this function:
             1- UserProfile and UserGoal will be set from the current scenario.
@@ -201,14 +328,19 @@ class AgendaUser(object):
             5- For each intention, choose what slots to put from UserGoal in Agenda and create the Agenda using
               the selected slots.
         """
-        # clear agenda
+        # clear agenda and the memory of the previous episode
         self._agenda.clear()
+        self._informed_slots.clear()
+        self._request_option_slots.clear()
+        # the episode can be replayed by initializing the user with the same seed
+        if seed is not None:
+            self._random.seed(seed)
         # # 1
-        if not self._profile:
+        if user_profile:
             self._profile = user_profile
 
         # We save user goals for handling requests from system. Agenda will be built using user_goals.
-        if not self._user_goals:
+        if user_goals:
             self._user_goals = user_goals
 
         # 2
@@ -260,7 +392,7 @@ class AgendaUser(object):
 
         # 2
         # add greeting() act to agenda if user is polite!
-        if get_random_number() < self._profile["polite"]:
+        if self._random() < self._profile["polite"]:
             # user can express intention with greeting
             response_list += [Annotation(diagact=Greeting, intent='booking', domain='movie', goal_list=None)]
             # if get_random_number() < self._profile["expresses_intention_with_greeting"]:
@@ -304,7 +436,7 @@ class AgendaUser(object):
                 atleast_one_inform_in_agenda = True
             # only required slots with is_open flag
             else:
-                rand = get_random_number()
+                rand = self._random()
                 if not atleast_one_inform_in_agenda:
                     rand = 0.0
                 if rand < self._profile["inform"]:
@@ -347,7 +479,7 @@ class AgendaUser(object):
                 # make sure there is at least one chosen!
                 rand = 0.0
             else:
-                rand = get_random_number()
+                rand = self._random()
             if rand < self._profile["agenda_size"]:
                 # if not domain.is_slot_required(intent,gs.name):
                 #     # optional slots are not always chosen! (user maybe is too picky)
@@ -381,37 +513,12 @@ class AgendaUser(object):
 
         else:
             for sys_annotation in sys_annotaions:
-                sys_act = sys_annotation.diagact
-                if sys_act.name == "GREETING":
-                    print(sys_annotaions)
-                    user_annoations += self.start_conversation()
-                elif sys_act.name == "INFORM":
-                    user_annoations += self.response_to_inform(sys_annotation)
-                elif sys_act.name == "REQUEST":
-                    user_annoations += self.response_to_request(sys_annotation)
-                elif sys_act.name == "CONFIRM":
-                    user_annoations += self.response_to_confirm(sys_annotation)
-                elif sys_act.name == "OFFER":
-                    user_annoations += self.response_to_offer(sys_annotation)
-                elif sys_act.name == "SELECT":
-                    user_annoations += self.response_to_select(sys_annotation)
-                elif sys_act.name == "AFFIRM":
-                    # TODO: How to response to system AFFIRM ?!
-                    user_annoations = []
-                elif sys_act.name == "NEGATE":
-                    user_annoations += self.response_to_negate(sys_annotation)
-                elif sys_act.name == "GOOD_BYE":
-                    episode_over = True
-                elif sys_act.name == "ACKNOWLEDGE":
-                    # Ignore System Acknowlegement
-                    user_annoations = []
-                elif sys_act.name == "NOTIFY_SUCCESS":
-                    user_annoations += self.response_to_notifysuccess(sys_annotation)
-                    episode_over = True
-                elif sys_act.name == "NOTIFY_FAILURE":
-                    user_annoations += self.response_to_notifyfailure(sys_annotation)
-                    episode_over = True
-                    failed = True
+                # unknown system acts are handled like CANT_UNDERSTAND
+                response_to_sys_act, ends_episode, fails_episode = self._sys_act_handlers.get(
+                    sys_annotation.diagact.name, self._sys_act_handlers[CantUnderstand.name])
+                user_annoations += response_to_sys_act(sys_annotation) or []
+                episode_over = episode_over or ends_episode
+                failed = failed or fails_episode
 
             # Break user annotation into single GoalSlot annotations and  add them to agenda
             self.update_agenda(self._break_annotations(user_annoations), self._agenda)
@@ -430,9 +537,9 @@ class AgendaUser(object):
 
             # if user_response is empty then terminate episode
             if not user_response:
-                print("USER RESPNSE IS EMPTY")
+                logger.debug("User response is empty")
                 episode_over = True
-                if get_random_number() < self._profile["polite"]:
+                if self._random() < self._profile["polite"]:
                     user_response = [Annotation(diagact=GoodBye, intent='booking', domain='movie', goal_list=None)]
 
                 logger.debug("Agenda is empty now. Setting episove_over to True to end the conversation!")
@@ -483,6 +590,10 @@ class AgendaUser(object):
     def max_turn(self):
         return self._max_turn
 
+    @property
+    def random_source(self):
+        return self._random
+
     @property
     def profile(self):
         return self._profile
@@ -508,6 +619,30 @@ class AgendaUser(object):
         s += "Agenda is:\n {}\n\n".format(self.agenda)
         return s
 
+    def response_to_greeting(self, sys_annotaion):
+        """
+        Reply to system greeting by (re)starting the conversation.
+        """
+        return self.start_conversation()
+
+    def response_to_affirm(self, sys_annotaion):
+        # TODO: How to response to system AFFIRM ?!
+        return []
+
+    def response_to_acknowledge(self, sys_annotaion):
+        # Ignore System Acknowlegement
+        return []
+
+    def response_to_goodbye(self, sys_annotaion):
+        return []
+
+    def response_to_cant_understand(self, sys_annotaion):
+        """
+        Reply to a system act that the user does not understand (or that NLU could not recognize).
+        The user ignores it and continues with the agenda.
+        """
+        return []
+
     def response_to_inform(self, sys_annotaion):
         """
         Reply to system inform. User can modify some of the previously informed values
@@ -556,7 +691,7 @@ class AgendaUser(object):
 
             # If user does not care about the slot; then either inform the system or request for options
             if user_goal_for_slot.value == ['dont care']:
-                if get_random_number() < self._profile["requests_for_options"]:
+                if self._random() < self._profile["requests_for_options"]:
                     # make sure slot is not already asked for ReqOpt
                     if slot_name not in self._request_option_slots:
                         goal_slots_to_request_option.append(copy.deepcopy(user_goal[slot_name]))
@@ -578,11 +713,8 @@ class AgendaUser(object):
 
             # It is possible that we have already added INFROM annotations with current slot_name
             # to agenda. Make sure to remove them since we are requesting optios for those slots
-            to_be_removed_annotations_index = []
             for req_opt_goal_slot in goal_slots_to_request_option:
-                to_be_removed_annotations_index += self.current_agenda.search_agenda("INFORM",
-                                                                                     goal_slot_name=req_opt_goal_slot.name)
-            self.current_agenda.remove_by_index(to_be_removed_annotations_index)
+                self.current_agenda.remove_matching("INFORM", goal_slot_name=req_opt_goal_slot.name)
 
         # print(response_list)
 
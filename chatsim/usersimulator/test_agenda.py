@@ -1,3 +1,7 @@
+import random
+
+import pytest
+
 from chatsim.utils import Annotation, DiagAct, Goal
 from chatsim.utils.diagact import *
 from chatsim.usersimulator import Agenda
@@ -34,5 +38,110 @@ def main():
     print(ag)
 
 
+class ListAgenda(object):
+    """
+    Reference agenda with the list semantics of Agenda (a plain list scanned by every operation).
+    """
+    def __init__(self):
+        self.stack = []
+
+    def pop(self, number_of_items=1, multi_diagact=False):
+        popped_annotations = []
+        if not multi_diagact:
+            if self.stack:
+                current_da = self.stack[-1].diagact.name
+                prev_da = current_da
+                while current_da == prev_da and number_of_items:
+                    annot = self.stack.pop()
+                    popped_annotations.append(annot)
+                    if not self.stack:
+                        break
+                    prev_da = annot.diagact.name
+                    current_da = self.stack[-1].diagact.name
+                    number_of_items -= 1
+        else:
+            while number_of_items and self.stack:
+                popped_annotations.append(self.stack.pop())
+                number_of_items -= 1
+        return popped_annotations[::-1]
+
+    def remove_annotation(self, annotation):
+        self.stack.remove(annotation)
+
+    def remove_by_index(self, index_list):
+        self.stack = [annotation for i, annotation in enumerate(self.stack) if i not in index_list]
+
+    def remove_matching(self, diagact_type, goal_slot_name=None):
+        index_list = self.search_agenda(diagact_type, goal_slot_name)
+        self.remove_by_index(index_list)
+        return len(index_list)
+
+    def push(self, annotation):
+        for annot in annotation if isinstance(annotation, list) else [annotation]:
+            if annot in self.stack:
+                self.stack.remove(annot)
+            self.stack.append(annot)
+
+    def search_agenda(self, diagact_type, goal_slot_name=None):
+        return [i for i, annotation in enumerate(self.stack) if annotation.diagact.name == diagact_type and
+                (not goal_slot_name or goal_slot_name in [gs.slot for gs in annotation.goal_list])]
+
+    def clear(self):
+        self.stack.clear()
+
+
+DIAGACTS = [Greeting, Inform, Request, Confirm]
+SLOTS = ['time', 'date', 'movie']
+
+
+def random_annotation(rng):
+    goal_list = [Goal(slot=slot, value=rng.choice([['7 pm'], ['today', 'tomorrow'], 'avatar', None]), type=None)
+                 for slot in rng.sample(SLOTS, rng.randint(0, 2))]
+    return Annotation(diagact=rng.choice(DIAGACTS), goal_list=goal_list, intent='booking', domain='movie')
+
+
+def apply(agenda, operation, args):
+    try:
+        return getattr(agenda, operation)(*args)
+    except ValueError as e:
+        return type(e)
+
+
+@pytest.mark.parametrize('seed', range(100))
+def test_agenda_matches_list_semantics(seed):
+    rng = random.Random(seed)
+    agenda, reference = Agenda(), ListAgenda()
+    for _ in range(200):
+        operation = rng.choice(['push', 'push', 'push_list', 'pop', 'remove_annotation', 'remove_by_index',
+                                'remove_matching', 'search_agenda', 'clear' if rng.random() < 0.05 else 'pop'])
+        if operation == 'push':
+            args = (random_annotation(rng),)
+        elif operation == 'push_list':
+            operation, args = 'push', ([random_annotation(rng) for _ in range(rng.randint(0, 3))],)
+        elif operation == 'pop':
+            args = (rng.randint(0, 3), rng.random() < 0.5)
+        elif operation == 'remove_annotation':
+            # an annotation of the agenda or (mostly) one which is not in it
+            args = (rng.choice(reference.stack) if reference.stack and rng.random() < 0.7 else random_annotation(rng),)
+        elif operation == 'remove_by_index':
+            args = (rng.sample(range(len(reference.stack) + 2), rng.randint(0, 2)),)
+        elif operation in ('remove_matching', 'search_agenda'):
+            args = (rng.choice(DIAGACTS).name, rng.choice(SLOTS + [None]))
+        else:
+            args = ()
+
+        assert apply(agenda, operation, args) == apply(reference, operation, args), (operation, args)
+        assert agenda.stack == reference.stack
+        assert len(agenda) == len(reference.stack)
+        assert agenda.is_empty() == (not reference.stack)
+        assert list(agenda) == reference.stack
+        for index in range(-len(reference.stack), len(reference.stack)):
+            assert agenda[index] == reference.stack[index]
+        assert agenda[1:-1] == reference.stack[1:-1]
+        for index in (len(reference.stack), -len(reference.stack) - 1):
+            with pytest.raises(IndexError):
+                agenda[index]
+
+
 if __name__ == '__main__':
     main()
@@ -1,6 +1,8 @@
 import os
 from pathlib import Path
-from .common import Annotation, Goal, UserGoal, DiagAct, read_user_profile, get_random_number
+from .common import Annotation, Goal, UserGoal, DiagAct, annotation_key, read_user_profile, get_random_number, \
+    RandomSource
+from .history import ConversationHistory
 
 CURRENT_DIR = Path(os.path.dirname(__file__))
 DATA_DIR = CURRENT_DIR / '../../data'
@@ -0,0 +1,83 @@
+from collections import OrderedDict
+import threading
+
+_MISSING = object()
+
+
+class LRUCache(object):
+    """
+    Bounded key-value store which evicts the least recently used entry once max_size entries are stored.
+    Lookups are counted so that the hit rate of the cache can be monitored. The cache is thread-safe unless it is
+    created with thread_safe=False (which makes lookups cheaper for caches used by a single thread).
+
+    Attributes:
+        - max_size (int): Maximum number of entries kept in the cache
+        - hits (int): Number of lookups that found their key
+        - misses (int): Number of lookups that did not find their key
+    """
+    def __init__(self, max_size=1024, thread_safe=True):
+        if max_size < 1:
+            raise ValueError("max_size of the cache should be at least 1!")
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock() if thread_safe else None
+
+    def get(self, key, default=None):
+        if self._lock is None:
+            return self._get(key, default)
+        with self._lock:
+            return self._get(key, default)
+
+    def _get(self, key, default):
+        value = self._data.get(key, _MISSING)
+        if value is _MISSING:
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        if self._lock is None:
+            return self._put(key, value)
+        with self._lock:
+            return self._put(key, value)
+
+    def _put(self, key, value):
+        self._data[key] = value
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+
+    def items(self):
+        """
+        Snapshot of the cached (key, value) pairs from the least to the most recently used.
+        """
+        if self._lock is None:
+            return list(self._data.items())
+        with self._lock:
+            return list(self._data.items())
+
+    def clear(self):
+        if self._lock is None:
+            return self._data.clear()
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self._data),
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits/lookups if lookups else None
+        }
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __len__(self):
+        return len(self._data)
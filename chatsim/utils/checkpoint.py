@@ -0,0 +1,125 @@
+import hashlib
+import json
+import os
+
+CHECKPOINT_VERSION = 2
+
+
+def goals_digest(user_goals):
+    """
+    Digest of the user goals of a simulation, so a checkpoint is not resumed with other goals.
+    """
+    digest = hashlib.sha1()
+    for user_goal in user_goals:
+        digest.update(repr(user_goal).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def to_ranges(indices):
+    """
+    Compress sorted episode indices into [start, end) ranges, e.g. [0, 1, 2, 5] -> [[0, 3], [5, 6]].
+    """
+    ranges = []
+    for i in indices:
+        if ranges and ranges[-1][1] == i:
+            ranges[-1][1] = i + 1
+        else:
+            ranges.append([i, i + 1])
+    return ranges
+
+
+def from_ranges(ranges):
+    return {i for start, end in ranges for i in range(start, end)}
+
+
+class Checkpoint(object):
+    """
+    Progress of a long simulation, saved periodically so an interrupted run can be resumed without redoing the
+    finished episodes (see Moderator.simulate).
+
+    The checkpoint is a json file replaced atomically (a crash while saving leaves the previous checkpoint). The
+    results store of the finished episodes is saved next to it in segments (<path>.results.<n>.npz): every save only
+    writes the rows added since the previous one, so checkpointing does not get slower as the simulation goes on.
+
+    Attributes:
+        - path (str): path of the checkpoint file
+        - completed (set[int]): indices of the finished episodes
+        - quarantined (dict{int:dict}): error and number of attempts of the episodes which kept failing
+        - metrics (dict): state of the SimulationMetrics of the finished episodes
+        - random_state (dict): state of the random source of the user simulator (see RandomSource.get_state)
+        - seed (int): seed of the simulation (see SIMULATION_SEED)
+        - goals_digest (str): digest of the user goals of the simulation (see goals_digest)
+        - results_segments (list[str]): files of the saved segments of the results store, in order
+        - results_sizes (list[int]): number of episode and turn rows of the saved segments (see ResultsStore.sizes)
+    """
+    def __init__(self, path, seed=None, goals_digest=None):
+        self.path = str(path)
+        self.completed = set()
+        self.quarantined = {}
+        self.metrics = None
+        self.random_state = None
+        self.seed = seed
+        self.goals_digest = goals_digest
+        self.results_segments = []
+        self.results_sizes = [0, 0]
+
+    def results_segment_path(self, n):
+        return '{}.results.{}.npz'.format(self.path, n)
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def save(self, results=None):
+        """
+        Atomically write the checkpoint (and the rows of the results store added since the previous save).
+        """
+        if results is not None and results.sizes != self.results_sizes:
+            # a segment which is not in the checkpoint file yet (e.g. of a crash while saving) is overwritten
+            segment_path = self.results_segment_path(len(self.results_segments))
+            tmp_path = segment_path + '.tmp'
+            results.save(tmp_path, start=self.results_sizes)
+            os.replace(tmp_path, segment_path)
+            self.results_segments.append(segment_path)
+            self.results_sizes = results.sizes
+
+        state = {
+            'version': CHECKPOINT_VERSION,
+            'seed': self.seed,
+            'goals_digest': self.goals_digest,
+            'completed': to_ranges(sorted(self.completed)),
+            'quarantined': {str(i): episode for i, episode in sorted(self.quarantined.items())},
+            'metrics': self.metrics,
+            'random_state': self.random_state,
+            'results_segments': self.results_segments,
+            'results_sizes': self.results_sizes,
+        }
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(state, f)
+        os.replace(tmp_path, self.path)
+
+    def load(self):
+        """
+        Read the checkpoint file.
+
+        Raises:
+            - ValueError: if the checkpoint was written by a simulation with another seed or other user goals
+        """
+        with open(self.path) as f:
+            state = json.load(f)
+        if state.get('version') != CHECKPOINT_VERSION:
+            raise ValueError("Checkpoint {} has version {}, expected {}".format(
+                self.path, state.get('version'), CHECKPOINT_VERSION))
+        if state['seed'] != self.seed:
+            raise ValueError("Checkpoint {} was written with seed {}, not {}".format(self.path, state['seed'],
+                                                                                    self.seed))
+        if self.goals_digest is not None and state['goals_digest'] != self.goals_digest:
+            raise ValueError("Checkpoint {} was written for other user goals".format(self.path))
+
+        self.completed = from_ranges(state['completed'])
+        self.quarantined = {int(i): episode for i, episode in state['quarantined'].items()}
+        self.metrics = state['metrics']
+        self.random_state = state['random_state']
+        self.results_segments = state['results_segments']
+        self.results_sizes = state['results_sizes']
+        return self
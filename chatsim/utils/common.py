@@ -1,6 +1,7 @@
 # from m2m_core.scenario.goal_slot import GoalSlot
 
 from collections import namedtuple
+import hashlib
 import yaml
 import numpy as np
 # Goal
@@ -13,9 +14,31 @@ Annotation = namedtuple('Annotation', ['diagact', 'goal_list', 'intent', 'domain
 DiagAct = namedtuple('DiagAct', ['name', 'priority'])
 
 
+def annotation_key(annotation):
+    """
+    Hashable canonical form of an annotation. Two annotations have the same key if they are equal.
+    """
+    goal_list = annotation.goal_list
+    if goal_list is not None:
+        goal_list = tuple((goal.slot, _freeze(goal.value), goal.type) for goal in goal_list)
+    return (annotation.diagact, goal_list, annotation.intent, annotation.domain)
+
+
+def _freeze(value):
+    if value is None or isinstance(value, str):
+        return value
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(v) for v in value)
+    if isinstance(value, set):
+        return frozenset(value)
+    if isinstance(value, dict):
+        return tuple(sorted((k, _freeze(v)) for k, v in value.items()))
+    return value
+
+
 def read_user_profile(path):
     with open(path, 'r') as f:
-        return yaml.load(f)
+        return yaml.safe_load(f)
 
 
 def get_random_number(dist="uniform"):
@@ -23,6 +46,94 @@ def get_random_number(dist="uniform"):
         return np.random.rand()
 
 
+# distribution name -> function drawing an array of samples from a numpy Generator
+RANDOM_DISTRIBUTIONS = {
+    'uniform': lambda rng, size: rng.random(size),
+    'normal': lambda rng, size: rng.standard_normal(size),
+    'exponential': lambda rng, size: rng.standard_exponential(size)
+}
+
+
+class RandomSource(object):
+    """
+    Source of random numbers for the hot path of the simulation.
+
+    Numbers are drawn from a numpy Generator in blocks and handed out one at a time, which avoids one numpy call per
+    number. The first block of a distribution has initial_block_size samples and every refill doubles it up to
+    block_size, so a source which is re-seeded for every episode (to make a run replayable) does not draw samples it
+    will not use. Seeding sets the state of the PCG64 generator from a digest of the seed instead of creating a new
+    generator, which is several times cheaper than np.random.default_rng(seed).
+
+    Re-seeding still costs a few microseconds (the digest and the state of the generator), so an episode of a seeded
+    simulation draws its numbers about 1.2-1.4 times slower than with np.random.seed and np.random.rand (e.g. 12us
+    against 10.5us for 10 draws, see chatsim.benchmark_random_source), while an unseeded source is faster than
+    np.random.rand. This is the price of episodes which can be replayed and run in any order, and it is negligible
+    next to the cost of an episode.
+
+    Attributes:
+        - block_size (int): maximum number of samples drawn at once for each distribution
+        - initial_block_size (int): number of samples of the first block of each distribution after seeding
+        - distributions (dict{str:function}): distribution name -> function(rng, size) drawing samples
+    """
+    def __init__(self, seed=None, block_size=1024, distributions=None, initial_block_size=16):
+        self.block_size = block_size
+        self.initial_block_size = min(initial_block_size, block_size)
+        self.distributions = distributions or RANDOM_DISTRIBUTIONS
+        self._rng = np.random.default_rng()
+        self.seed(seed)
+
+    def seed(self, seed=None):
+        """
+        Args:
+            - seed (int|list[int]): None seeds the source from the operating system entropy
+        """
+        if seed is None:
+            self._rng = np.random.default_rng()
+        else:
+            self._rng.bit_generator.state = pcg64_state(seed)
+        # distribution name -> [block of samples (list), index of the next sample]
+        self._blocks = {}
+
+    def __call__(self, dist="uniform"):
+        block = self._blocks.get(dist)
+        if block is None or block[1] == len(block[0]):
+            size = self.initial_block_size if block is None else min(2 * len(block[0]), self.block_size)
+            block = [self.distributions[dist](self._rng, size).tolist(), 0]
+            self._blocks[dist] = block
+        number = block[0][block[1]]
+        block[1] += 1
+        return number
+
+    def get_state(self):
+        """
+        Json-serializable state of the source (generator state and current blocks), see set_state. The blocks are
+        shared with the source, which is cheap since a block is never modified once drawn. The size of the next
+        block of a distribution follows from the size of its current block.
+        """
+        return {'bit_generator': self._rng.bit_generator.state,
+                'blocks': {dist: [block[0], block[1]] for dist, block in self._blocks.items()}}
+
+    def set_state(self, state):
+        self._rng.bit_generator.state = state['bit_generator']
+        self._blocks = {dist: [list(block[0]), block[1]] for dist, block in state['blocks'].items()}
+
+
+def pcg64_state(seed):
+    """
+    State of a PCG64 bit generator made of the blake2b digest of seed (int or sequence of ints), so different seeds
+    give unrelated streams.
+    """
+    if isinstance(seed, (list, tuple)):
+        seed = [int(s) for s in seed]
+    else:
+        seed = int(seed)
+    digest = hashlib.blake2b(repr(seed).encode('ascii'), digest_size=32).digest()
+    return {'bit_generator': 'PCG64',
+            'state': {'state': int.from_bytes(digest[:16], 'little'),
+                      'inc': int.from_bytes(digest[16:], 'little') | 1},
+            'has_uint32': 0, 'uinteger': 0}
+
+
 # class Annotation(object):
 # 	"""
 # 	Attributes:
@@ -1,49 +1,215 @@
+import argparse
+import gzip
+import hashlib
 import logging
 import json
-from collections import OrderedDict, Counter
+import os
+from collections import OrderedDict, Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
 
 from chatsim.utils import DATA_DIR
 
 logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
+# number of characters read from a corpus file at a time by iter_json_array
+READ_CHUNK_SIZE = 1 << 16
+
+# splits of every corpus, compiled (in this order) into DATA_DIR/compiled/<corpus>-complete.json
+CORPORA = {
+    'sim-M': ('dev', 'test', 'train'),
+    'sim-R': ('dev', 'test', 'train'),
+}
+COMPILED_DIR = DATA_DIR / 'compiled'
+# number of dialogues converted to rasa examples by a compile worker at a time
+COMPILE_SHARD_SIZE = 256
+# values of dialogue_state slots which are not actual values of the slot
+NON_VALUES = ('dontcare',)
+# bump when the content of CorpusIndex changes, so that persisted indexes are rebuilt
+INDEX_VERSION = 1
+# bump when the compiled output changes for the same sources, so that existing builds are recompiled
+COMPILER_VERSION = 2
+
+_WHITESPACE = ' \t\n\r'
+_NUMBER_CHARS = '0123456789.eE+-'
+
+
+def _is_number(element):
+    return isinstance(element, (int, float)) and not isinstance(element, bool)
+
+
+def iter_json_array(file_obj, chunk_size=READ_CHUNK_SIZE):
+    """
+    Yield the elements of the JSON array stored in file_obj one at a time.
+    Only the element being decoded (and one chunk of the file) is kept in memory, so arbitrarily large corpora can
+    be read in bounded memory.
+
+    Args:
+        - file_obj (file): text file (or file-like object) which contains a JSON array
+        - chunk_size (int): number of characters read at a time
+    """
+    decoder = json.JSONDecoder()
+    buffer, pos, eof = '', 0, False
+
+    def fill():
+        nonlocal buffer, pos, eof
+        # at least double the pending data so that elements larger than a chunk are decoded O(log n) times
+        chunk = file_obj.read(max(chunk_size, len(buffer) - pos))
+        if not chunk:
+            eof = True
+        buffer = buffer[pos:] + chunk
+        pos = 0
+
+    def skip_whitespace():
+        nonlocal pos
+        while True:
+            while pos < len(buffer) and buffer[pos] in _WHITESPACE:
+                pos += 1
+            if pos < len(buffer) or eof:
+                return
+            fill()
+
+    skip_whitespace()
+    if buffer[pos:pos + 1] != '[':
+        raise ValueError("Expected a JSON array in {}".format(getattr(file_obj, 'name', file_obj)))
+    pos += 1
+
+    expect_element = True
+    while True:
+        skip_whitespace()
+        if pos >= len(buffer):
+            raise ValueError("Unterminated JSON array in {}".format(getattr(file_obj, 'name', file_obj)))
+        if buffer[pos] == ']':
+            return
+        if not expect_element:
+            if buffer[pos] != ',':
+                raise ValueError("Expected ',' or ']' at offset {} of the current chunk".format(pos))
+            pos += 1
+            skip_whitespace()
+
+        while True:
+            try:
+                element, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                # the element is split over chunks (or malformed, which shows once the file is exhausted)
+                if eof:
+                    raise
+                fill()
+                continue
+            if not eof and _is_number(element) and (end == len(buffer) or buffer[end] in _NUMBER_CHARS):
+                # the number may continue in the next chunk (e.g. "2." followed by "5")
+                fill()
+                continue
+            break
+
+        pos = end
+        expect_element = False
+        yield element
+
+
+def token_char_offsets(text, tokens):
+    """
+    Character offsets (start, end) of every token in text, computed in a single left-to-right pass so that
+    repeated tokens (e.g. the two '2' of '2 tickets at 2 pm') get their own offsets.
+    A token which does not occur in text (after the previous token) gets an empty span at the current position.
+    """
+    offsets = []
+    position = 0
+    for token in tokens:
+        start = text.find(token, position)
+        if start < 0:
+            offsets.append((position, position))
+            continue
+        position = start + len(token)
+        offsets.append((start, position))
+    return offsets
+
+
+def iter_json_file(path, chunk_size=READ_CHUNK_SIZE):
+    """
+    Yield the elements of the JSON array stored at path. The file is closed as soon as the generator is exhausted
+    or closed (e.g. with contextlib.closing), not when it is garbage collected.
+    """
+    with open(path) as f:
+        yield from iter_json_array(f, chunk_size=chunk_size)
+
 
 class GoogleDataReader(object):
+    """
+    Reader for the sim-M / sim-R dialogue corpora (JSON arrays of dialogues).
+    Dialogues are streamed from the files on every pass (diag_iter, turn_iter), so only one dialogue is resident at
+    a time. The reader can be used as a context manager (or closed with close()) to release the file handles of
+    passes which were stopped early.
+
+    Attributes:
+        - path_list (list): corpus files which are read, in order
+    """
 
-    def __init__(self, path_list=None):
-        self._data = []
-        if path_list:
-            for path in path_list:
-                self._data += self.read_json_file(path)
+    def __init__(self, path_list=None, chunk_size=READ_CHUNK_SIZE, index_path=None):
+        self.path_list = list(path_list) if path_list else []
+        self.chunk_size = chunk_size
+        self.index_path = index_path
+        self._open_iters = set()
+        self._index = None
 
         self.meta = {}
         self.meta["user_intents"] = Counter()
-        self._user_intents = Counter()
-        self._sys_intents = Counter()
-        self._solo_intent = 0
+
+    @property
+    def index(self):
+        """
+        CorpusIndex of the corpus files, built on first use (or loaded from index_path if it is up to date).
+        """
+        if self._index is None or list(self._index.sources) != [str(path) for path in self.path_list]:
+            self._index = CorpusIndex.load_or_build(self.path_list, self.index_path)
+        return self._index
 
     @staticmethod
     def read_json_file(path):
-        return json.load(open(path))
+        with open(path) as f:
+            return json.load(f)
 
     @property
     def data(self):
-        return self._data
+        """
+        All the dialogues as a list. This loads every corpus in memory, prefer diag_iter.
+        """
+        return list(self.diag_iter())
 
     def read_data_from(self, file_path):
-        self._data = self.read_json_file(file_path)
+        self.close()
+        self.path_list = [file_path]
+
+    def close(self):
+        """
+        Close the files of the passes which are still open.
+        """
+        for file_iter in list(self._open_iters):
+            file_iter.close()
+        self._open_iters.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
 
     def create_rasa_nlu_dict(self):
-        exmaples = []
-        for turn in self.turn_iter():
+        return list(self.iter_rasa_nlu_examples())
+
+    def iter_rasa_nlu_examples(self, dialogues=None):
+        """
+        Yield the rasa examples of dialogues (all the dialogues of the reader by default).
+        """
+        turns = self.turn_iter() if dialogues is None else (turn for d in dialogues for turn in d["turns"])
+        for turn in turns:
             if "user_acts" in turn:
                 if self._is_rasa_nlu_compatible(turn, "user"):
-                    exmaples.append(self._create_rasa_nlu_example(turn, sytem_or_user="user"))
+                    yield self._create_rasa_nlu_example(turn, sytem_or_user="user")
             if "system_acts" in turn:
                 if self._is_rasa_nlu_compatible(turn, "system"):
-                    exmaples.append(self._create_rasa_nlu_example(turn, sytem_or_user="system"))
-
-        return exmaples
+                    yield self._create_rasa_nlu_example(turn, sytem_or_user="system")
 
     def _create_rasa_nlu_example(self, turn, sytem_or_user="user"):
         example = OrderedDict()
@@ -56,14 +222,14 @@ class GoogleDataReader(object):
         # adding entities
         entities = []
         text = utter["text"]
-        tokens = utter["tokens"]
-        for slot in utter["slots"]:
+        slots = utter["slots"]
+        # token indices of the slots are converted to character offsets
+        offsets = token_char_offsets(text, utter["tokens"]) if slots else None
+        for slot in slots:
             entity = OrderedDict()
 
-            # convert indices!!!
-            slot_tokens = tokens[slot["start"]:slot["exclusive_end"]]
-            start = text.find(slot_tokens[0])
-            end = text.find(slot_tokens[-1]) + len(slot_tokens[-1])
+            start = offsets[slot["start"]][0]
+            end = offsets[slot["exclusive_end"] - 1][1]
             entity["start"] = start
             entity["end"] = end
             entity["value"] = text[start:end]
@@ -74,18 +240,10 @@ class GoogleDataReader(object):
         return example
 
     def get_intents(self):
-        for turn in self.turn_iter():
-            if "user_acts" in turn:
-                for ua in turn["user_acts"]:
-                    self._user_intents.update({ua["type"]: 1})
-                if len(ua) == 1:
-                    self._solo_intent += 1
-            if "system_acts" in turn:
-                for ua in turn["system_acts"]:
-                    self._sys_intents.update({ua["type"]: 1})
-        return "User acts:\n {}\n\n System acts:\n {} with {} solo intents".format(self._user_intents,
-                                                                                   self._sys_intents,
-                                                                                   self._solo_intent)
+        index = self.index
+        return "User acts:\n {}\n\n System acts:\n {} with {} solo intents".format(index.user_acts,
+                                                                                   index.system_acts,
+                                                                                   index.solo_intents)
 
     def _get_slot_value_map(self, utter):
         svmap = OrderedDict()
@@ -96,11 +254,17 @@ class GoogleDataReader(object):
         return svmap
 
     def diag_iter(self):
-        for dialogue in self.data:
-            yield dialogue
+        for path in self.path_list:
+            file_iter = iter_json_file(path, chunk_size=self.chunk_size)
+            self._open_iters.add(file_iter)
+            try:
+                yield from file_iter
+            finally:
+                file_iter.close()
+                self._open_iters.discard(file_iter)
 
     def turn_iter(self):
-        for dialogue in self.data:
+        for dialogue in self.diag_iter():
             for turn in dialogue["turns"]:
                 yield turn
 
@@ -118,37 +282,374 @@ class GoogleDataReader(object):
         return is_compatible
 
     def stats(self):
-        nlu_turns, num_turns = 0,0
-        for turn in self.turn_iter():
-            num_turns += 1
-            if self._is_rasa_nlu_compatible(turn, speaker="user"):
-                nlu_turns += 1
-        result = "Totol turns={} with {} nlu compatible turns".format(num_turns, nlu_turns)
+        index = self.index
+        result = "Totol turns={} with {} nlu compatible turns".format(index.num_turns, index.nlu_turns)
         return result
 
     def __str__(self):
         return self.stats()
 
     def nlu_to_json(self, nlu_data, path):
-        rasa_nlu_data = OrderedDict()
-        rasa_nlu_data["rasa_nlu_data"] = dict(common_examples=nlu_data, entity_examples=[], intent_examples=[])
-        res = json.dumps(rasa_nlu_data, indent=2)
+        """
+        Write the rasa examples in nlu_data (any iterable, e.g. iter_rasa_nlu_examples()) to path in the rasa NLU
+        json format. Examples are written one at a time so that the export runs in bounded memory.
+        """
         with open(path, 'w') as f:
-            f.write(res)
+            write_rasa_nlu_json(f, (serialize_rasa_nlu_example(example) for example in nlu_data))
 
 
-def main():
-    dr = GoogleDataReader()
-    dr.read_data_from(DATA_DIR / 'sim-M/dev.json')
-    dev_data = dr.create_rasa_nlu_dict()
+class CorpusIndex(object):
+    """
+    Statistics of a corpus computed in a single pass over its dialogues, so that stats queries and goal generation
+    do not have to rescan the json files. The index is persisted to a gzipped json file and reused as long as the
+    corpus files are unchanged (see load_or_build).
+
+    Attributes:
+        - sources (OrderedDict{str:dict}): fingerprint (size, mtime, sha256) of every corpus file
+        - user_acts (Counter): number of user acts of every type
+        - system_acts (Counter): number of system acts of every type
+        - user_intents (Counter): number of turns with every user intent
+        - num_turns (int): number of turns
+        - nlu_turns (int): number of turns with at least one user act (see GoogleDataReader._is_rasa_nlu_compatible)
+        - solo_intents (int): number of turns with exactly one user act
+        - slot_values (dict{str:Counter}): number of dialogues in which every value of every slot appears in the
+          dialogue_state
+        - dialogue_ids (list[str]): id of every dialogue, in corpus order
+        - dialogue_sources (list[int]): index in sources of the file of every dialogue
+        - dialogue_num_turns (list[int]): number of turns of every dialogue
+    """
+
+    def __init__(self, sources=None):
+        self.sources = sources if sources is not None else OrderedDict()
+        self.user_acts = Counter()
+        self.system_acts = Counter()
+        self.user_intents = Counter()
+        self.num_turns = 0
+        self.nlu_turns = 0
+        self.solo_intents = 0
+        self.slot_values = {}
+        self.dialogue_ids = []
+        self.dialogue_sources = []
+        self.dialogue_num_turns = []
+
+    @classmethod
+    def build(cls, path_list, sources=None):
+        if sources is None:
+            sources = OrderedDict((str(path), _file_fingerprint(path)) for path in path_list)
+        index = cls(sources)
+        for source_index, path in enumerate(path_list):
+            for dialogue in iter_json_file(path):
+                index._add_dialogue(dialogue, source_index)
+        return index
+
+    def _add_dialogue(self, dialogue, source_index):
+        turns = dialogue["turns"]
+        dialogue_values = set()
+        for turn in turns:
+            user_acts = turn.get("user_acts")
+            if user_acts:
+                self.nlu_turns += 1
+                if len(user_acts) == 1:
+                    self.solo_intents += 1
+                self.user_acts.update(act["type"] for act in user_acts)
+            self.system_acts.update(act["type"] for act in turn.get("system_acts", ()))
+            self.user_intents.update(turn.get("user_intents", ()))
+            for state in turn.get("dialogue_state", ()):
+                if state["value"] not in NON_VALUES:
+                    dialogue_values.add((state["slot"], state["value"]))
+
+        for slot, value in dialogue_values:
+            self.slot_values.setdefault(slot, Counter())[value] += 1
+        self.num_turns += len(turns)
+        self.dialogue_ids.append(dialogue.get("dialogue_id"))
+        self.dialogue_sources.append(source_index)
+        self.dialogue_num_turns.append(len(turns))
+
+    @property
+    def turn_offsets(self):
+        """
+        Index of the first turn of every dialogue in the sequence of all the turns of the corpus (see turn_iter).
+        """
+        offsets, offset = [], 0
+        for num_turns in self.dialogue_num_turns:
+            offsets.append(offset)
+            offset += num_turns
+        return offsets
 
-    dr.read_data_from(DATA_DIR / 'sim-M/test.json')
-    test_data = dr.create_rasa_nlu_dict()
+    def value_counts(self, slot):
+        """
+        Values of slot with their number of dialogues, from the most to the least frequent.
+        """
+        return self.slot_values.get(slot, Counter()).most_common()
 
-    dr.read_data_from(DATA_DIR / 'sim-M/train.json')
-    train_data = dr.create_rasa_nlu_dict()
+    def entity_value_sets(self, slot_aliases=None, slots=None):
+        """
+        Values of every slot from the most to the least frequent (the format of chatsim.user.user.entity_value_sets).
+
+        Args:
+            - slot_aliases (dict{str:str}): renaming of the corpus slots (e.g. {'num_tickets': 'num_people'})
+            - slots (list[str]): slots to keep (after renaming), all the slots by default
+        """
+        slot_aliases = slot_aliases or {}
+        value_sets = OrderedDict()
+        for slot in sorted(self.slot_values):
+            name = slot_aliases.get(slot, slot)
+            if slots is None or name in slots:
+                value_sets[name] = [value for value, _ in self.value_counts(slot)]
+        if slots is not None:
+            value_sets = OrderedDict((slot, value_sets[slot]) for slot in slots if slot in value_sets)
+        return value_sets
+
+    def to_dict(self):
+        return OrderedDict(
+            version=INDEX_VERSION,
+            sources=self.sources,
+            user_acts=self.user_acts,
+            system_acts=self.system_acts,
+            user_intents=self.user_intents,
+            num_turns=self.num_turns,
+            nlu_turns=self.nlu_turns,
+            solo_intents=self.solo_intents,
+            slot_values=self.slot_values,
+            dialogue_ids=self.dialogue_ids,
+            dialogue_sources=self.dialogue_sources,
+            dialogue_num_turns=self.dialogue_num_turns,
+        )
+
+    @classmethod
+    def from_dict(cls, data):
+        if data.get("version") != INDEX_VERSION:
+            raise ValueError("Unsupported corpus index version {}".format(data.get("version")))
+        index = cls(OrderedDict(data["sources"]))
+        index.user_acts = Counter(data["user_acts"])
+        index.system_acts = Counter(data["system_acts"])
+        index.user_intents = Counter(data["user_intents"])
+        index.num_turns = data["num_turns"]
+        index.nlu_turns = data["nlu_turns"]
+        index.solo_intents = data["solo_intents"]
+        index.slot_values = {slot: Counter(values) for slot, values in data["slot_values"].items()}
+        index.dialogue_ids = data["dialogue_ids"]
+        index.dialogue_sources = data["dialogue_sources"]
+        index.dialogue_num_turns = data["dialogue_num_turns"]
+        return index
+
+    def save(self, path):
+        tmp_path = str(path) + '.tmp'
+        with gzip.open(tmp_path, 'wt') as f:
+            json.dump(self.to_dict(), f, separators=(',', ':'))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with gzip.open(path, 'rt') as f:
+            return cls.from_dict(json.load(f))
+
+    @classmethod
+    def load_or_build(cls, path_list, index_path=None):
+        """
+        Load the index at index_path if it was built from the current content of path_list, otherwise build it
+        (and save it to index_path if it is set).
+        """
+        previous = None
+        if index_path is not None and os.path.exists(index_path):
+            try:
+                previous = cls.load(index_path)
+            except (OSError, EOFError, ValueError, KeyError) as e:
+                # outdated, truncated or corrupt index
+                logger.info("Rebuilding the corpus index {}: {!r}".format(index_path, e))
+
+        previous_sources = previous.sources if previous is not None else {}
+        sources = OrderedDict((str(path), _file_fingerprint(path, previous_sources.get(str(path))))
+                              for path in path_list)
+        if previous is not None and list(previous_sources) == list(sources) and \
+                all(previous_sources[p]['sha256'] == source['sha256'] for p, source in sources.items()):
+            index = previous
+            index.sources = sources
+            if sources != previous_sources:
+                index._try_save(index_path)
+            return index
+
+        index = cls.build(path_list, sources)
+        if index_path is not None:
+            index._try_save(index_path)
+        return index
+
+    def _try_save(self, path):
+        # the index is only a cache of the corpus, it is used from memory if it cannot be saved (e.g. read-only data)
+        try:
+            self.save(path)
+        except OSError as e:
+            logger.warning("Could not save the corpus index to {}: {!r}".format(path, e))
+
+
+def corpus_index(corpus, data_dir=DATA_DIR, index_dir=COMPILED_DIR):
+    """
+    CorpusIndex of the splits of corpus (see CORPORA) which exist, persisted to index_dir/<corpus>-index.json.gz.
+    """
+    data_dir = Path(data_dir)
+    split_paths = [data_dir / corpus / '{}.json'.format(split) for split in CORPORA[corpus]]
+    split_paths = [path for path in split_paths if path.exists()]
+    if not split_paths:
+        raise FileNotFoundError("No split of {} found in {}".format(corpus, data_dir / corpus))
+    return CorpusIndex.load_or_build(split_paths, Path(index_dir) / '{}-index.json.gz'.format(corpus))
+
+
+def serialize_rasa_nlu_example(example):
+    """
+    Serialize a rasa example the way it is indented in the common_examples of a rasa NLU json file.
+    """
+    indent = ' ' * 6
+    return indent + json.dumps(example, indent=2).replace('\n', '\n' + indent)
+
+
+def write_rasa_nlu_json(f, serialized_examples):
+    """
+    Write serialized examples (see serialize_rasa_nlu_example) to the file f in the rasa NLU json format, one at a
+    time. The output is identical to json.dumps(rasa_nlu_data, indent=2).
+    """
+    f.write('{\n  "rasa_nlu_data": {\n    "common_examples": [')
+    separator = '\n'
+    for serialized_example in serialized_examples:
+        f.write(separator)
+        f.write(serialized_example)
+        separator = ',\n'
+    f.write('\n    ]' if separator == ',\n' else ']')
+    f.write(',\n    "entity_examples": [],\n    "intent_examples": []\n  }\n}')
+
+
+def _compile_shard(dialogues):
+    reader = GoogleDataReader()
+    return [serialize_rasa_nlu_example(example) for example in reader.iter_rasa_nlu_examples(dialogues)]
+
+
+def _iter_shards(iterable, shard_size):
+    shard = []
+    for item in iterable:
+        shard.append(item)
+        if len(shard) == shard_size:
+            yield shard
+            shard = []
+    if shard:
+        yield shard
+
+
+def _file_fingerprint(path, previous=None):
+    """
+    Size, mtime and sha256 of the file at path. The file is only hashed if its size or mtime differ from the
+    previous fingerprint (a touched but unchanged file is therefore still recognised by its hash).
+    """
+    stat = os.stat(path)
+    fingerprint = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+    if previous and all(previous.get(k) == v for k, v in fingerprint.items()):
+        fingerprint['sha256'] = previous['sha256']
+        return fingerprint
+
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            sha256.update(block)
+    fingerprint['sha256'] = sha256.hexdigest()
+    return fingerprint
+
+
+def _is_up_to_date(manifest, sources, output_path):
+    previous_sources = manifest.get('sources', {})
+    return (manifest.get('compiler_version') == COMPILER_VERSION and
+            list(previous_sources) == list(sources) and
+            all(previous_sources[name]['sha256'] == source['sha256'] for name, source in sources.items()) and
+            output_path.exists() and
+            manifest.get('output_size') == output_path.stat().st_size)
+
+
+def _write_manifest(manifest_path, sources, output_path):
+    manifest = OrderedDict(compiler_version=COMPILER_VERSION, sources=sources,
+                           output_size=output_path.stat().st_size)
+    with open(manifest_path, 'w') as f:
+        json.dump(manifest, f, indent=2)
+
+
+def compile_corpus(corpus, data_dir=DATA_DIR, output_dir=COMPILED_DIR, workers=None, force=False,
+                   allow_missing_splits=False, shard_size=COMPILE_SHARD_SIZE):
+    """
+    Compile the splits of a corpus (see CORPORA) into output_dir/<corpus>-complete.json for rasa NLU training.
+    Dialogues are streamed from the splits in shards, converted to rasa examples by worker processes and the examples
+    are streamed to the output file in corpus order, so memory stays bounded by the shards in flight.
+    The sources are recorded in output_dir/<corpus>-complete.manifest.json and the compilation is skipped when they
+    are unchanged (same content hash) since the last build, unless force is set.
+
+    Args:
+        - corpus (str): name of the corpus, a key of CORPORA
+        - workers (int): number of worker processes (defaults to the number of CPUs)
+        - allow_missing_splits (bool): compile the splits which exist instead of raising FileNotFoundError
+    Returns:
+        - (bool): True if the corpus was compiled, False if the existing build is up to date
+    """
+    data_dir, output_dir = Path(data_dir), Path(output_dir)
+    split_paths = [data_dir / corpus / '{}.json'.format(split) for split in CORPORA[corpus]]
+    missing = [str(path) for path in split_paths if not path.exists()]
+    if missing:
+        if not allow_missing_splits or len(missing) == len(split_paths):
+            raise FileNotFoundError("Missing splits of {}: {}".format(corpus, ', '.join(missing)))
+        logger.warning("Compiling {} without the missing splits {}".format(corpus, ', '.join(missing)))
+        split_paths = [path for path in split_paths if path.exists()]
+
+    output_path = output_dir / '{}-complete.json'.format(corpus)
+    manifest_path = output_dir / '{}-complete.manifest.json'.format(corpus)
+    manifest = {}
+    if manifest_path.exists():
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+
+    previous_sources = manifest.get('sources', {})
+    sources = OrderedDict((path.name, _file_fingerprint(path, previous_sources.get(path.name)))
+                          for path in split_paths)
+    if not force and _is_up_to_date(manifest, sources, output_path):
+        if sources != previous_sources:
+            # touched but unchanged sources, record their mtime so that they are not hashed again
+            _write_manifest(manifest_path, sources, output_path)
+        logger.info("{} is up to date".format(output_path))
+        return False
+
+    output_dir.mkdir(parents=True, exist_ok=True)
+    tmp_path = output_path.with_name(output_path.name + '.tmp')
+    workers = workers or os.cpu_count() or 1
+    with GoogleDataReader(split_paths) as reader, ProcessPoolExecutor(max_workers=workers) as executor, \
+            open(tmp_path, 'w') as f:
+        write_rasa_nlu_json(f, _ordered_map(executor, _compile_shard,
+                                            _iter_shards(reader.diag_iter(), shard_size), workers * 2))
+    os.replace(tmp_path, output_path)
+    _write_manifest(manifest_path, sources, output_path)
+    logger.info("Compiled {} into {}".format(', '.join(str(p) for p in split_paths), output_path))
+    return True
+
+
+def _ordered_map(executor, fn, shards, max_pending):
+    """
+    Yield the items of fn(shard) for every shard, in order, with at most max_pending shards submitted at a time.
+    """
+    pending = deque()
+    for shard in shards:
+        pending.append(executor.submit(fn, shard))
+        if len(pending) >= max_pending:
+            yield from pending.popleft().result()
+    while pending:
+        yield from pending.popleft().result()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compile the dialogue corpora into rasa NLU training data")
+    parser.add_argument('corpora', nargs='*', default=list(CORPORA), choices=list(CORPORA))
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--force', action='store_true', help="recompile even if the sources are unchanged")
+    parser.add_argument('--allow-missing-splits', action='store_true')
+    args = parser.parse_args()
 
-    dr.nlu_to_json(dev_data + test_data + train_data, DATA_DIR / 'compiled/sim-M-complete.json')
+    for corpus in args.corpora:
+        try:
+            compile_corpus(corpus, workers=args.workers, force=args.force,
+                           allow_missing_splits=args.allow_missing_splits)
+        except FileNotFoundError as e:
+            logger.warning("Skipping {}: {}".format(corpus, e))
 
 
 if __name__ == "__main__":
@@ -18,5 +18,24 @@ GoodBye = DiagAct(name='GOODBYE', priority=2)
 CantUnderstand = DiagAct(name='CANT_UNDERSTAND', priority=2)
 Other = DiagAct(name='Other', priority=2)
 
+# registry of diag acts by name. Besides the names of the diag acts above it contains the act names used by the NLU
+# and the sim-M/sim-R datasets (e.g. NEGATE, GOOD_BYE).
+DIAGACTS = {diagact.name: diagact for diagact in [Greeting, Inform, Request, Confirm, RequestAlts, Offer, Select,
+                                                   Affirm, Negate, NotifySuccess, NotifyFailure, ThankYou, GoodBye,
+                                                   CantUnderstand, Other]}
+DIAGACTS.update({
+    'NEGATE': Negate,
+    'GOOD_BYE': GoodBye,
+    'OTHER': Other
+})
+
+
+def get_diagact(name, default=CantUnderstand):
+    """
+    Return the diag act with the given name (e.g. an NLU intent name) or default if the name is unknown.
+    """
+    return DIAGACTS.get(name, default)
+
+
 __all__ = ['Greeting', 'Inform', 'Request', 'Confirm', 'RequestAlts', 'Offer', 'Select', 'Affirm', 'GoodBye',
-           'NotifySuccess', 'NotifyFailure', 'ThankYou', 'Other', 'Negate']
+           'NotifySuccess', 'NotifyFailure', 'ThankYou', 'Other', 'Negate', 'CantUnderstand']
@@ -0,0 +1,69 @@
+from collections import deque
+
+
+class ConversationHistory(object):
+    """
+    History of a conversation which is given to the chatbot as its input.
+
+    The concatenated text of the utterances is joined when it is read and cached until the next utterance is
+    appended, so appending does not copy the history and reading it twice does not join it twice. The text can be
+    limited to a sliding window of the last max_turns utterances
+    and/or the last utterances which fit in max_tokens (whitespace separated) tokens.
+
+    Attributes:
+        - max_turns (int): maximum number of utterances in the text. No limit if None.
+        - max_tokens (int): maximum number of tokens in the text. No limit if None. The last utterance is always
+            kept even if it is longer than max_tokens.
+        - log (list[(str, str)]): (speaker, utterance) of every utterance of the conversation. Not kept if
+            keep_log is False.
+    """
+    def __init__(self, max_turns=None, max_tokens=None, keep_log=True):
+        self.max_turns = max_turns
+        self.max_tokens = max_tokens
+        self.log = [] if keep_log else None
+        # (utterance, number of tokens) of the utterances in the window
+        self._window = deque()
+        self._num_of_tokens = 0
+        # joined utterances of the window, None until text is read after an append
+        self._text = ''
+
+    def append(self, speaker, utterance):
+        if self.log is not None:
+            self.log.append((speaker, utterance))
+
+        num_of_tokens = len(utterance.split()) if self.max_tokens is not None else 0
+        self._text = None
+        self._window.append((utterance, num_of_tokens))
+        self._num_of_tokens += num_of_tokens
+
+        # slide the window
+        while len(self._window) > 1 and self._is_over_limit():
+            _, evicted_num_of_tokens = self._window.popleft()
+            self._num_of_tokens -= evicted_num_of_tokens
+
+    def _is_over_limit(self):
+        if self.max_turns is not None and len(self._window) > self.max_turns:
+            return True
+        return self.max_tokens is not None and self._num_of_tokens > self.max_tokens
+
+    @property
+    def text(self):
+        """
+        Utterances in the window joined by a space.
+        """
+        if self._text is None:
+            self._text = ' '.join(utterance for utterance, _ in self._window)
+        return self._text
+
+    def clear(self):
+        if self.log is not None:
+            self.log = []
+        self._window.clear()
+        self._num_of_tokens = 0
+        self._text = ''
+
+    def __len__(self):
+        return len(self._window)
+
+    def __str__(self):
+        return self.text
@@ -0,0 +1,284 @@
+import json
+import os
+import time
+from bisect import bisect_left
+from collections import OrderedDict
+
+# upper bounds (in seconds) of the histogram buckets: 4 buckets per power of 2 from 1 microsecond to ~2 minutes
+DEFAULT_BUCKETS = tuple(1e-6 * 2 ** (i / 4) for i in range(4 * 27 + 1))
+PERCENTILES = (50, 95, 99)
+
+
+class Histogram(object):
+    """
+    Histogram of durations with fixed bucket boundaries (Prometheus style), so observations cost O(log buckets) and
+    memory does not grow with the number of observations. Percentiles are estimated by interpolating in the buckets.
+
+    Attributes:
+        - buckets (tuple[float]): upper bound of every bucket (an implicit +Inf bucket follows the last one)
+        - counts (list[int]): number of observations in every bucket (not cumulative)
+        - count (int): number of observations
+        - sum (float): sum of the observations
+    """
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def merge(self, other):
+        for i, count in enumerate(other.counts):
+            self.counts[i] += count
+        self.count += other.count
+        self.sum += other.sum
+        if other.min is not None and (self.min is None or other.min < self.min):
+            self.min = other.min
+        if other.max is not None and (self.max is None or other.max > self.max):
+            self.max = other.max
+
+    def percentile(self, percentile):
+        if not self.count:
+            return None
+        rank = self.count * percentile / 100
+        cumulative = 0
+        for i, count in enumerate(self.counts):
+            if count and cumulative + count >= rank:
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                upper = self.buckets[i] if i < len(self.buckets) else self.max
+                lower, upper = max(lower, self.min), min(upper, self.max)
+                return lower + (upper - lower) * (rank - cumulative) / count
+            cumulative += count
+        return self.max
+
+    def summary(self):
+        summary = OrderedDict(count=self.count, sum=self.sum,
+                              mean=self.sum / self.count if self.count else None, min=self.min, max=self.max)
+        for percentile in PERCENTILES:
+            summary['p{}'.format(percentile)] = self.percentile(percentile)
+        return summary
+
+    def to_dict(self):
+        return OrderedDict(count=self.count, sum=self.sum, min=self.min, max=self.max,
+                           buckets=[[bound, count] for bound, count in zip(self.buckets + ('+Inf',), self.counts)
+                                    if count])
+
+
+class _Stage(object):
+    __slots__ = ('_episode', '_name', '_start')
+
+    def __init__(self, episode, name):
+        self._episode = episode
+        self._name = name
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._episode.record(self._name, time.perf_counter() - self._start)
+        return False
+
+
+class _NullStage(object):
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+NULL_STAGE = _NullStage()
+
+
+class EpisodeTimings(object):
+    """
+    Stage durations of a single episode. Every duration is also added to the aggregate histograms of the
+    Instrumentation it belongs to; the per-episode totals are added when the episode ends (see Instrumentation.end).
+
+    Attributes:
+        - stages (OrderedDict{str:list}): [count, total duration] of every stage of the episode
+    """
+    def __init__(self, instrumentation):
+        self._instrumentation = instrumentation
+        self.stages = OrderedDict()
+
+    def stage(self, name):
+        return _Stage(self, name)
+
+    def record(self, name, duration):
+        stage = self.stages.get(name)
+        if stage is None:
+            stage = self.stages[name] = [0, 0.0]
+        stage[0] += 1
+        stage[1] += duration
+        self._instrumentation.observe(name, duration)
+
+
+class _NullEpisodeTimings(object):
+    stages = OrderedDict()
+
+    def stage(self, name):
+        return NULL_STAGE
+
+    def record(self, name, duration):
+        pass
+
+
+NULL_EPISODE_TIMINGS = _NullEpisodeTimings()
+
+
+class Instrumentation(object):
+    """
+    Opt-in timing of the stages of the simulation loop (chatbot, nlu, annotation, simulator, nlg).
+
+    Usage:
+        timings = instrumentation.episode()
+        with timings.stage('nlu'):
+            ...
+        instrumentation.end(timings)
+
+    Durations are kept as histograms: one of every call of a stage and one of the total duration of the stage in every
+    episode, plus the number of calls of the stage per episode. When disabled, episode() returns a shared null object
+    whose stages do nothing, so the instrumentation costs a method call and an empty with block per stage.
+    The summary can be exported to json (write_json) and to the Prometheus text format (write_prometheus).
+    Instrumentation is not thread-safe, every process (e.g. the workers of simulate_parallel) keeps its own and merges
+    them (see merge).
+
+    Attributes:
+        - enabled (bool): whether stages are timed
+        - episodes (int): number of finished episodes
+        - calls (OrderedDict{str:Histogram}): duration of every call of every stage
+        - episode_durations (OrderedDict{str:Histogram}): total duration of every stage per episode
+        - episode_calls (OrderedDict{str:Histogram}): number of calls of every stage per episode
+    """
+    def __init__(self, enabled=True, buckets=DEFAULT_BUCKETS):
+        self.enabled = enabled
+        self.buckets = buckets
+        self.reset()
+
+    def reset(self):
+        self.episodes = 0
+        self.calls = OrderedDict()
+        self.episode_durations = OrderedDict()
+        self.episode_calls = OrderedDict()
+
+    def _histogram(self, histograms, name):
+        histogram = histograms.get(name)
+        if histogram is None:
+            histogram = histograms[name] = Histogram(self.buckets)
+        return histogram
+
+    def episode(self):
+        """
+        Start timing an episode.
+        """
+        if not self.enabled:
+            return NULL_EPISODE_TIMINGS
+        return EpisodeTimings(self)
+
+    def stage(self, name):
+        """
+        Time a stage which does not belong to a single episode (e.g. an NLU call for a batch of episodes).
+        """
+        if not self.enabled:
+            return NULL_STAGE
+        return _Stage(self, name)
+
+    def record(self, name, duration):
+        self.observe(name, duration)
+
+    def observe(self, name, duration):
+        self._histogram(self.calls, name).observe(duration)
+
+    def end(self, timings):
+        """
+        Add the per-episode totals of a finished episode.
+        """
+        if timings is NULL_EPISODE_TIMINGS:
+            return
+        self.episodes += 1
+        for name, (count, duration) in timings.stages.items():
+            self._histogram(self.episode_durations, name).observe(duration)
+            self._histogram(self.episode_calls, name).observe(count)
+
+    def merge(self, other):
+        self.episodes += other.episodes
+        for histograms, other_histograms in ((self.calls, other.calls),
+                                             (self.episode_durations, other.episode_durations),
+                                             (self.episode_calls, other.episode_calls)):
+            for name, histogram in other_histograms.items():
+                self._histogram(histograms, name).merge(histogram)
+
+    def summary(self):
+        """
+        Json-serializable summary: number of episodes and, for every stage, the count, sum, mean, min, max and
+        percentiles of the durations of its calls (seconds) and of its total duration and number of calls per episode.
+        """
+        summary = OrderedDict(episodes=self.episodes, stages=OrderedDict())
+        for name, histogram in self.calls.items():
+            stage = summary['stages'][name] = OrderedDict(calls=histogram.summary())
+            if name in self.episode_durations:
+                stage['per_episode'] = self.episode_durations[name].summary()
+                stage['calls_per_episode'] = self.episode_calls[name].summary()
+        return summary
+
+    def to_dict(self):
+        return OrderedDict(
+            summary=self.summary(),
+            histograms=OrderedDict((name, histogram.to_dict()) for name, histogram in self.calls.items()),
+            episode_histograms=OrderedDict((name, histogram.to_dict())
+                                           for name, histogram in self.episode_durations.items()),
+        )
+
+    def write_json(self, path):
+        _write_atomically(path, json.dumps(self.to_dict(), indent=2))
+
+    def to_prometheus(self, prefix='chatsim'):
+        lines = ['# HELP {}_episodes_total Number of simulated episodes.'.format(prefix),
+                 '# TYPE {}_episodes_total counter'.format(prefix),
+                 '{}_episodes_total {}'.format(prefix, self.episodes)]
+        lines += _prometheus_histogram('{}_stage_duration_seconds'.format(prefix),
+                                       'Duration of the calls of every stage of the simulation loop.', self.calls)
+        lines += _prometheus_histogram('{}_episode_stage_duration_seconds'.format(prefix),
+                                       'Total duration of every stage of the simulation loop per episode.',
+                                       self.episode_durations)
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, path, prefix='chatsim'):
+        """
+        Write the histograms in the Prometheus text format (e.g. for the node exporter textfile collector).
+        """
+        _write_atomically(path, self.to_prometheus(prefix))
+
+
+def _prometheus_histogram(metric, help_text, histograms):
+    lines = ['# HELP {} {}'.format(metric, help_text), '# TYPE {} histogram'.format(metric)]
+    for name, histogram in histograms.items():
+        cumulative = 0
+        for bound, count in zip(histogram.buckets, histogram.counts):
+            cumulative += count
+            lines.append('{}_bucket{{stage="{}",le="{:.6g}"}} {}'.format(metric, name, bound, cumulative))
+        lines.append('{}_bucket{{stage="{}",le="+Inf"}} {}'.format(metric, name, histogram.count))
+        lines.append('{}_sum{{stage="{}"}} {!r}'.format(metric, name, histogram.sum))
+        lines.append('{}_count{{stage="{}"}} {}'.format(metric, name, histogram.count))
+    return lines
+
+
+def _write_atomically(path, text):
+    tmp_path = str(path) + '.tmp'
+    with open(tmp_path, 'w') as f:
+        f.write(text)
+    os.replace(tmp_path, path)
@@ -0,0 +1,130 @@
+from collections import namedtuple
+
+from chatsim.utils import Goal, UserGoal
+from chatsim.utils.transcripts import read_transcripts
+
+import gzip
+import json
+
+# everything an episode received from outside the user simulator / NLG: the chatbot responses, the NLU outputs of the
+# chatbot responses and the numbers drawn from the random source of the user ({distribution: [numbers]}). The user
+# goal, user profile and outcome / conversation of the recorded run are kept to replay and check the episode.
+EpisodeRecording = namedtuple('EpisodeRecording', ['episode', 'user_goal', 'user_profile', 'seed',
+                                                   'chatbot_responses', 'nlu_outputs', 'draws', 'outcome',
+                                                   'conversation_log'])
+
+
+class ReplayDivergence(Exception):
+    """
+    Raised when a replayed episode asks for a chatbot response, NLU output or random number which was not recorded,
+    i.e. the simulator does not behave as it did when the episode was recorded.
+    """
+    pass
+
+
+class RecordingRandomSource(object):
+    """
+    Random source which records the numbers drawn from another one (see RandomSource).
+
+    Attributes:
+        - random_source (RandomSource): source the numbers are drawn from
+        - draws (dict{str:list[float]}): numbers drawn from every distribution, in order
+    """
+    def __init__(self, random_source):
+        self.random_source = random_source
+        self.draws = {}
+
+    def seed(self, seed=None):
+        self.random_source.seed(seed)
+
+    def __call__(self, dist="uniform"):
+        number = self.random_source(dist)
+        draws = self.draws.get(dist)
+        if draws is None:
+            draws = self.draws[dist] = []
+        draws.append(number)
+        return number
+
+
+class ReplayRandomSource(object):
+    """
+    Random source which hands out recorded numbers (see RecordingRandomSource). Seeding it does nothing.
+    """
+    def __init__(self, draws):
+        self._draws = {dist: iter(numbers) for dist, numbers in draws.items()}
+
+    def seed(self, seed=None):
+        pass
+
+    def __call__(self, dist="uniform"):
+        try:
+            return next(self._draws[dist])
+        except (KeyError, StopIteration):
+            raise ReplayDivergence("No recorded {} random number left".format(dist))
+
+
+class ReplayChatBot(object):
+    """
+    Chatbot which gives the recorded responses in order, whatever the conversation.
+    """
+    def __init__(self, responses):
+        self.asked_entities = set()
+        self._responses = iter(responses)
+
+    def get_response(self, input_text):
+        try:
+            return next(self._responses)
+        except StopIteration:
+            raise ReplayDivergence("No recorded chatbot response left")
+
+
+def replay_matches(recording, result):
+    """
+    Whether a replayed episode (EpisodeResult) has the outcome and the conversation of its recording.
+    """
+    outcome = {'num_of_turns': result.num_of_turns, 'success': result.success, 'failed': result.failed}
+    return outcome == recording.outcome and \
+        [list(turn) for turn in result.conversation_log] == [list(turn) for turn in recording.conversation_log]
+
+
+def recording_to_dict(recording):
+    user_goal = recording.user_goal
+    record = recording._asdict()
+    record['user_goal'] = {'domain': user_goal.domain, 'intent': user_goal.intent,
+                           'goal_list': [[goal.slot, goal.value, goal.type] for goal in user_goal.goal_list]}
+    return record
+
+
+def recording_from_dict(record):
+    user_goal = record['user_goal']
+    record = dict(record)
+    record['user_goal'] = UserGoal(domain=user_goal['domain'], intent=user_goal['intent'],
+                                   goal_list=[Goal(slot=slot, value=value, type=goal_type)
+                                              for slot, value, goal_type in user_goal['goal_list']])
+    return EpisodeRecording(**record)
+
+
+def write_recordings(path, recordings):
+    """
+    Write episode recordings to a JSON Lines file (gzip compressed if path ends with .gz).
+
+    Returns:
+        - number of recordings written
+    """
+    path = str(path)
+    opener = gzip.open if path.endswith('.gz') else open
+    count = 0
+    with opener(path, 'wt', encoding='utf-8') as f:
+        for recording in recordings:
+            f.write(json.dumps(recording_to_dict(recording), separators=(',', ':')))
+            f.write('\n')
+            count += 1
+    return count
+
+
+def read_recordings(path):
+    """
+    Yield the EpisodeRecordings of a file written by write_recordings.
+    """
+    for record in read_transcripts(path):
+        yield recording_from_dict(record)
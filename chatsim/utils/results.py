@@ -0,0 +1,283 @@
+import json
+
+import numpy as np
+
+# outcome of the episodes which succeeded / ran out of turns, the other ones are named after the chatbot act which
+# made the user fail (e.g. NOTIFY_FAILURE)
+SUCCESS = 'success'
+MAX_TURNS_REACHED = 'max_turns'
+
+_SLOT_TYPE_PREFIX = 'slot_type:'
+
+
+class Table(object):
+    """
+    Append-only table stored column by column in numpy arrays which grow by doubling, so appending a row is
+    amortized O(1) and aggregations are vectorized over whole columns. String columns are categorical: they store
+    int32 codes into a per-column vocabulary. Columns can be added after rows were appended (earlier rows get the
+    missing value: -1 for categorical columns, 0 / NaN otherwise).
+
+    Attributes:
+        - dtypes (dict{str:np.dtype}): dtype of every column ('category' for categorical columns)
+        - vocabularies (dict{str:list[str]}): values of every categorical column
+    """
+    def __init__(self, capacity=1024):
+        self.dtypes = {}
+        self.vocabularies = {}
+        self._codes = {}
+        self._columns = {}
+        self._capacity = capacity
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def columns(self):
+        return list(self._columns)
+
+    def add_column(self, name, dtype):
+        if name in self._columns:
+            return
+        if dtype == 'category':
+            self.vocabularies[name] = []
+            self._codes[name] = {}
+        else:
+            dtype = np.dtype(dtype)
+        self.dtypes[name] = dtype
+        self._columns[name] = np.full(self._capacity, self._missing(name),
+                                      dtype=np.int32 if dtype == 'category' else dtype)
+
+    def encode(self, name, value):
+        """
+        Code of value in the vocabulary of the categorical column name (added to the vocabulary if it is new).
+        """
+        if value is None:
+            return -1
+        codes = self._codes[name]
+        code = codes.get(value)
+        if code is None:
+            code = codes[value] = len(self.vocabularies[name])
+            self.vocabularies[name].append(value)
+        return code
+
+    def append(self, row):
+        """
+        Append a row given as {column: value}. Columns which are not in row get the missing value.
+        """
+        if self._size == self._capacity:
+            self._grow(self._capacity * 2)
+        i = self._size
+        for name, value in row.items():
+            if self.dtypes[name] == 'category':
+                value = self.encode(name, value)
+            elif value is None:
+                value = self._missing(name)
+            self._columns[name][i] = value
+        self._size += 1
+
+    def _grow(self, capacity):
+        for name, column in self._columns.items():
+            grown = np.full(capacity, self._missing(name), dtype=column.dtype)
+            grown[:self._size] = column[:self._size]
+            self._columns[name] = grown
+        self._capacity = capacity
+
+    def _missing(self, name):
+        if self.dtypes[name] == 'category':
+            return -1
+        return np.nan if self.dtypes[name].kind == 'f' else 0
+
+    def column(self, name):
+        """
+        Values of a column (a view, codes for categorical columns, see decode).
+        """
+        return self._columns[name][:self._size]
+
+    def decode(self, name):
+        """
+        Values of a categorical column as an object array (None for missing values).
+        """
+        vocabulary = np.array(self.vocabularies[name] + [None], dtype=object)
+        return vocabulary[self.column(name)]
+
+    def to_arrays(self, prefix, start=0):
+        """
+        Rows from start on and the schema of the table (with the whole vocabularies), see append_arrays.
+        """
+        arrays = {'{}{}'.format(prefix, name): self.column(name)[start:] for name in self._columns}
+        arrays['{}__schema__'.format(prefix)] = np.array(json.dumps({
+            'columns': [[name, str(dtype)] for name, dtype in self.dtypes.items()],
+            'vocabularies': self.vocabularies,
+        }))
+        return arrays
+
+    def append_arrays(self, arrays, prefix):
+        """
+        Append the rows of arrays written by to_arrays, e.g. by a table whose earlier rows are already in this one.
+        Vocabularies only grow, so the codes of the rows are those of the vocabularies of the schema.
+        """
+        schema = json.loads(str(arrays['{}__schema__'.format(prefix)]))
+        columns = [(name, dtype) for name, dtype in schema['columns']]
+        size = len(arrays['{}{}'.format(prefix, columns[0][0])]) if columns else 0
+        for name, dtype in columns:
+            self.add_column(name, dtype)
+            if dtype == 'category':
+                vocabulary, codes = self.vocabularies[name], self._codes[name]
+                for code in range(len(vocabulary), len(schema['vocabularies'][name])):
+                    vocabulary.append(schema['vocabularies'][name][code])
+                    codes[vocabulary[code]] = code
+        if self._size + size > self._capacity:
+            self._grow(max(self._size + size, self._capacity * 2))
+        for name, _ in columns:
+            self._columns[name][self._size:self._size + size] = arrays['{}{}'.format(prefix, name)]
+        self._size += size
+
+    @classmethod
+    def from_arrays(cls, arrays, prefix):
+        table = cls()
+        table.append_arrays(arrays, prefix)
+        return table
+
+
+class ResultsStore(object):
+    """
+    Columnar store of the outcome of every episode and of every chatbot turn of a simulation, so that new metrics
+    can be computed offline from a single run.
+
+    Episode table: episode, num_of_turns, success, outcome (see SUCCESS, MAX_TURNS_REACHED), profile and the goal
+    type of every slot (column slot_type:<slot>).
+    Turn table: episode, turn (index of the chatbot utterance in the conversation), diagact (NLU annotation of the
+    chatbot utterance) and confidence (NLU intent confidence).
+
+    Attributes:
+        - episodes (Table): one row per episode
+        - turns (Table): one row per chatbot turn
+    """
+    def __init__(self):
+        self.episodes = Table()
+        self.turns = Table()
+        for name, dtype in (('episode', np.int64), ('num_of_turns', np.int32), ('success', np.bool_),
+                            ('outcome', 'category'), ('profile', 'category')):
+            self.episodes.add_column(name, dtype)
+        for name, dtype in (('episode', np.int64), ('turn', np.int32), ('diagact', 'category'),
+                            ('confidence', np.float32)):
+            self.turns.add_column(name, dtype)
+
+    def __len__(self):
+        return len(self.episodes)
+
+    def add(self, episode_index, result, profile=None):
+        """
+        Add a finished episode (EpisodeResult).
+        """
+        row = {'episode': episode_index, 'num_of_turns': result.num_of_turns, 'success': result.success,
+               'outcome': SUCCESS if result.success else result.failure_reason or MAX_TURNS_REACHED,
+               'profile': profile}
+        if result.user_goal is not None:
+            for goal in result.user_goal.goal_list:
+                name = _SLOT_TYPE_PREFIX + goal.slot
+                if name not in self.episodes.dtypes:
+                    self.episodes.add_column(name, 'category')
+                row[name] = goal.type
+        self.episodes.append(row)
+
+        annotations = result.annotations or ()
+        confidences = iter(result.nlu_confidences or ())
+        # chatbot utterances are the odd turns of the conversation
+        for turn in range(1, len(annotations), 2):
+            diagact = annotations[turn][0].diagact.name if annotations[turn] else None
+            self.turns.append({'episode': episode_index, 'turn': turn, 'diagact': diagact,
+                               'confidence': next(confidences, np.nan)})
+
+    @property
+    def slots(self):
+        return [name[len(_SLOT_TYPE_PREFIX):] for name in self.episodes.columns
+                if name.startswith(_SLOT_TYPE_PREFIX)]
+
+    def success_rate(self):
+        success = self.episodes.column('success')
+        return float(success.mean()) if len(success) else None
+
+    def success_rate_by(self, column):
+        """
+        Success rate of the episodes grouped by the values of a categorical episode column
+        (e.g. 'profile', 'outcome' or 'slot_type:time', see success_rate_by_slot_type).
+
+        Returns:
+            - dict{str:float}
+        """
+        codes = self.episodes.column(column)
+        vocabulary = self.episodes.vocabularies[column]
+        valid = codes >= 0
+        totals = np.bincount(codes[valid], minlength=len(vocabulary))
+        successes = np.bincount(codes[valid], weights=self.episodes.column('success')[valid],
+                                minlength=len(vocabulary))
+        return {value: float(successes[code] / totals[code]) for code, value in enumerate(vocabulary) if totals[code]}
+
+    def success_rate_by_slot_type(self):
+        """
+        Success rate for every slot and goal type, e.g. {'time': {'fixed': 0.9, 'open': 1.0, ...}, ...}.
+        """
+        return {slot: self.success_rate_by(_SLOT_TYPE_PREFIX + slot) for slot in self.slots}
+
+    def outcome_counts(self):
+        codes = self.episodes.column('outcome')
+        counts = np.bincount(codes, minlength=len(self.episodes.vocabularies['outcome']))
+        return dict(zip(self.episodes.vocabularies['outcome'], counts.tolist()))
+
+    def turn_histogram(self):
+        """
+        Number of episodes with every number of turns (index = number of turns).
+        """
+        return np.bincount(self.episodes.column('num_of_turns'))
+
+    def confidence_histogram(self, bins=10, diagact=None):
+        """
+        Histogram (counts, bin edges) of the NLU intent confidence of the chatbot turns, of all turns or of the turns
+        annotated with diagact.
+        """
+        confidences = self.turns.column('confidence')
+        if diagact is not None:
+            vocabulary = self.turns.vocabularies['diagact']
+            code = vocabulary.index(diagact) if diagact in vocabulary else -2
+            confidences = confidences[self.turns.column('diagact') == code]
+        confidences = confidences[~np.isnan(confidences)]
+        return np.histogram(confidences, bins=bins, range=(0.0, 1.0))
+
+    @property
+    def sizes(self):
+        """
+        Number of rows of the episode and turn tables.
+        """
+        return [len(self.episodes), len(self.turns)]
+
+    def save(self, path, compress=True, start=(0, 0)):
+        """
+        Save the store to a .npz file (compressed unless compress is False, which is much faster to write).
+
+        Args:
+            - start ((int, int)): the episode and turn rows before start (see sizes) are not saved, so a store can be
+              saved in segments which are read back together by load_segments
+        """
+        arrays = self.episodes.to_arrays('episodes/', start[0])
+        arrays.update(self.turns.to_arrays('turns/', start[1]))
+        with open(path, 'wb') as f:
+            (np.savez_compressed if compress else np.savez)(f, **arrays)
+
+    @classmethod
+    def load(cls, path):
+        return cls.load_segments([path])
+
+    @classmethod
+    def load_segments(cls, paths):
+        """
+        Store made of the rows of the segments saved at paths, in order (see save).
+        """
+        store = cls()
+        for path in paths:
+            with np.load(path) as arrays:
+                arrays = dict(arrays)
+            store.episodes.append_arrays(arrays, 'episodes/')
+            store.turns.append_arrays(arrays, 'turns/')
+        return store
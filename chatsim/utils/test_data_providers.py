@@ -0,0 +1,163 @@
+import gzip
+import io
+import json
+import os
+import random
+
+import pytest
+
+from chatsim.utils.data_providers import CORPORA, CorpusIndex, GoogleDataReader, compile_corpus, iter_json_array, \
+    token_char_offsets
+
+
+def random_json_value(rng, depth=0):
+    kind = rng.choice(['int', 'float', 'string', 'bool', 'null'] + (['list', 'dict'] if depth < 3 else []))
+    if kind == 'int':
+        return rng.randint(-10 ** 6, 10 ** 6)
+    if kind == 'float':
+        return rng.choice([rng.uniform(-1e3, 1e3), rng.uniform(-1, 1) * 10 ** rng.randint(-20, 20), 2.5, -0.0])
+    if kind == 'string':
+        return ''.join(rng.choice('ab 12,[]{}:"\\\n\té€😀') for _ in range(rng.randint(0, 12)))
+    if kind == 'bool':
+        return rng.random() < 0.5
+    if kind == 'null':
+        return None
+    if kind == 'list':
+        return [random_json_value(rng, depth + 1) for _ in range(rng.randint(0, 4))]
+    return {''.join(rng.choice('xyz"é') for _ in range(rng.randint(0, 4))): random_json_value(rng, depth + 1)
+            for _ in range(rng.randint(0, 4))}
+
+
+def random_json_text(rng, elements):
+    # the whitespace between the tokens of the array varies, that of the elements is decided by json.dumps
+    indent = rng.choice([None, 0, 2])
+    separator = rng.choice([',', ' , ', ',\n  ', '\t,'])
+    return rng.choice(['', ' ', '\n']) + '[' + rng.choice(['', ' ', '\n ']) + \
+        separator.join(json.dumps(element, indent=indent, ensure_ascii=rng.random() < 0.5) for element in elements) + \
+        rng.choice(['', ' ', '\n']) + ']' + rng.choice(['', '\n'])
+
+
+@pytest.mark.parametrize('seed', range(200))
+def test_iter_json_array_matches_json_load(seed):
+    rng = random.Random(seed)
+    elements = [random_json_value(rng) for _ in range(rng.randint(0, 8))]
+    text = random_json_text(rng, elements)
+    expected = json.load(io.StringIO(text))
+
+    for chunk_size in [1, 2, 3, 7, rng.randint(1, 64), len(text) + 1]:
+        assert list(iter_json_array(io.StringIO(text), chunk_size=chunk_size)) == expected
+
+
+@pytest.mark.parametrize('text', ['[2.5, 10, -3e-2, 12345678901234567890]', '[1e10,2E-3,0.125]'])
+def test_iter_json_array_numbers_split_over_chunks(text):
+    # a chunk boundary inside a number must not split it in two
+    for chunk_size in range(1, len(text) + 1):
+        assert list(iter_json_array(io.StringIO(text), chunk_size=chunk_size)) == json.loads(text)
+
+
+@pytest.mark.parametrize('text', ['', '{}', '[1, 2', '[1 2]', '[1,, 2]', '["abc]'])
+def test_iter_json_array_rejects_invalid_arrays(text):
+    for chunk_size in [1, 3, 1024]:
+        with pytest.raises(ValueError):
+            list(iter_json_array(io.StringIO(text), chunk_size=chunk_size))
+
+
+def test_token_char_offsets_of_repeated_tokens():
+    text = '2 tickets at 2 pm , 2 pm'
+    tokens = text.split()
+    offsets = token_char_offsets(text, tokens)
+    assert [text[start:end] for start, end in offsets] == tokens
+    assert [start for start, _ in offsets] == [0, 2, 10, 13, 15, 18, 20, 22]
+    # a token which is not in the text gets an empty span at the current position
+    assert token_char_offsets('at 2 pm', ['at', 'two', 'pm']) == [(0, 2), (2, 2), (5, 7)]
+
+
+def utterance(tokens, slots):
+    return {'text': ' '.join(tokens), 'tokens': tokens,
+            'slots': [{'slot': slot, 'start': start, 'exclusive_end': end} for slot, start, end in slots]}
+
+
+def test_rasa_entities_of_repeated_tokens():
+    user_utterance = utterance(['2', 'tickets', 'at', '2', 'pm', 'for', '2', 'people'],
+                               [('time', 3, 5), ('num_tickets', 6, 7)])
+    example = GoogleDataReader()._create_rasa_nlu_example(
+        {'user_utterance': user_utterance, 'user_acts': [{'type': 'INFORM'}]})
+    assert [(entity['entity'], entity['start'], entity['end'], entity['value']) for entity in example['entities']] == \
+        [('time', 13, 17, '2 pm'), ('num_tickets', 22, 23, '2')]
+
+
+def dialogues(num_of_dialogues, seed):
+    rng = random.Random(seed)
+    result = []
+    for i in range(num_of_dialogues):
+        tokens = ['book', str(rng.randint(1, 3)), 'tickets', 'at', str(rng.randint(1, 3)), 'pm']
+        result.append({'dialogue_id': '{}-{}'.format(seed, i), 'turns': [{
+            'user_acts': [{'type': 'INFORM'}], 'system_acts': [{'type': 'REQUEST'}],
+            'user_utterance': utterance(tokens, [('num_tickets', 1, 2), ('time', 4, 6)]),
+            'system_utterance': utterance(['what', 'date', '?'], []),
+            'dialogue_state': [{'slot': 'time', 'value': ' '.join(tokens[4:])}]}]})
+    return result
+
+
+def write_corpus(data_dir, seed):
+    (data_dir / 'sim-M').mkdir(parents=True, exist_ok=True)
+    for i, split in enumerate(CORPORA['sim-M']):
+        with open(data_dir / 'sim-M' / '{}.json'.format(split), 'w') as f:
+            json.dump(dialogues(5 + i, seed + i), f)
+
+
+def test_compile_corpus_skips_up_to_date_builds(tmp_path):
+    data_dir, output_dir = tmp_path / 'data', tmp_path / 'compiled'
+    write_corpus(data_dir, seed=0)
+    assert compile_corpus('sim-M', data_dir, output_dir, workers=1, shard_size=2)
+    with open(output_dir / 'sim-M-complete.json') as f:
+        compiled = json.load(f)
+    with GoogleDataReader([data_dir / 'sim-M' / '{}.json'.format(split) for split in CORPORA['sim-M']]) as reader:
+        assert compiled['rasa_nlu_data']['common_examples'] == json.loads(json.dumps(reader.create_rasa_nlu_dict()))
+
+    assert not compile_corpus('sim-M', data_dir, output_dir, workers=1)
+    # a touched but unchanged split is recognised by its hash
+    os.utime(data_dir / 'sim-M' / 'dev.json', ns=(0, 10 ** 9))
+    assert not compile_corpus('sim-M', data_dir, output_dir, workers=1)
+    assert compile_corpus('sim-M', data_dir, output_dir, workers=1, force=True)
+
+    write_corpus(data_dir, seed=1)
+    # the new splits may have the size and mtime of the old ones on a file system with coarse timestamps
+    for split in CORPORA['sim-M']:
+        os.utime(data_dir / 'sim-M' / '{}.json'.format(split), ns=(0, 2 * 10 ** 9))
+    assert compile_corpus('sim-M', data_dir, output_dir, workers=1)
+    assert not compile_corpus('sim-M', data_dir, output_dir, workers=1)
+
+
+
+def test_corpus_index_is_rebuilt_when_stale_or_corrupt(tmp_path, monkeypatch):
+    data_dir, index_path = tmp_path / 'data', tmp_path / 'index.json.gz'
+    paths = [data_dir / 'sim-M' / '{}.json'.format(split) for split in CORPORA['sim-M']]
+    builds = []
+    build = CorpusIndex.build.__func__
+    monkeypatch.setattr(CorpusIndex, 'build', classmethod(lambda cls, *args: builds.append(args) or build(cls, *args)))
+
+    def load_or_build():
+        index = CorpusIndex.load_or_build(paths, index_path)
+        expected = build(CorpusIndex, paths)
+        assert index.slot_values == expected.slot_values and index.dialogue_ids == expected.dialogue_ids
+        return len(builds)
+
+    write_corpus(data_dir, seed=0)
+    assert load_or_build() == 1 and index_path.exists()
+    # an up-to-date index is loaded, even if its sources were touched
+    os.utime(paths[0], ns=(0, 10 ** 9))
+    assert load_or_build() == 1
+
+    write_corpus(data_dir, seed=1)
+    for path in paths:
+        os.utime(path, ns=(0, 2 * 10 ** 9))
+    assert load_or_build() == 2
+    assert load_or_build() == 2
+
+    # a corrupt index is rebuilt and replaced
+    corrupt_files = [b'', b'not gzip', gzip.compress(b'{"version": 1'), gzip.compress(b'{"version": 1}')]
+    for i, corrupt in enumerate(corrupt_files):
+        index_path.write_bytes(corrupt)
+        assert load_or_build() == 3 + i
+        assert load_or_build() == 3 + i
@@ -0,0 +1,34 @@
+import random
+
+import pytest
+
+from chatsim.utils import ConversationHistory
+
+
+def window_text(utterances, max_turns, max_tokens):
+    # the last utterances within the limits, the last utterance is always kept
+    window = []
+    for utterance in reversed(utterances):
+        candidate = [utterance] + window
+        if window and ((max_turns is not None and len(candidate) > max_turns) or
+                       (max_tokens is not None and sum(len(u.split()) for u in candidate) > max_tokens)):
+            break
+        window = candidate
+    return ' '.join(window)
+
+
+@pytest.mark.parametrize('max_turns,max_tokens', [(None, None), (1, None), (4, None), (None, 5), (3, 8)])
+def test_history_text_is_the_window_of_the_last_utterances(max_turns, max_tokens):
+    rng = random.Random(0)
+    history = ConversationHistory(max_turns=max_turns, max_tokens=max_tokens)
+    utterances = []
+    for turn in range(50):
+        utterance = ' '.join('w{}'.format(turn) for _ in range(rng.randint(1, 4)))
+        history.append('user' if turn % 2 else 'chatbot', utterance)
+        utterances.append(utterance)
+        if rng.random() < 0.7:
+            assert history.text == window_text(utterances, max_turns, max_tokens)
+    assert [utterance for _, utterance in history.log] == utterances
+
+    history.clear()
+    assert history.text == '' and len(history) == 0 and history.log == []
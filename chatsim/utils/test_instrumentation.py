@@ -0,0 +1,86 @@
+import json
+import re
+
+import pytest
+
+from chatsim.utils.instrumentation import Instrumentation, NULL_EPISODE_TIMINGS
+
+# durations (seconds) of the stage calls of three episodes
+EPISODES = [
+    [('nlu', 0.002), ('nlg', 1e-5), ('nlu', 0.004)],
+    [('nlu', 0.003), ('chatbot', 0.25)],
+    [('nlg', 2e-5)],
+]
+
+
+def instrumentation_of(episodes):
+    instrumentation = Instrumentation()
+    for stages in episodes:
+        timings = instrumentation.episode()
+        for name, duration in stages:
+            timings.record(name, duration)
+        instrumentation.end(timings)
+    return instrumentation
+
+
+def test_json_export(tmp_path):
+    path = tmp_path / 'timings.json'
+    instrumentation_of(EPISODES).write_json(path)
+    with open(path) as f:
+        data = json.load(f)
+
+    summary = data['summary']
+    assert summary['episodes'] == 3 and list(summary['stages']) == ['nlu', 'nlg', 'chatbot']
+    nlu = summary['stages']['nlu']
+    assert nlu['calls']['count'] == 3 and nlu['calls']['sum'] == pytest.approx(0.009)
+    assert nlu['calls']['min'] == 0.002 and nlu['calls']['max'] == 0.004
+    assert 0.002 <= nlu['calls']['p50'] <= nlu['calls']['p95'] <= nlu['calls']['p99'] <= 0.004
+    assert nlu['per_episode']['count'] == 2 and nlu['per_episode']['max'] == pytest.approx(0.006)
+    assert nlu['calls_per_episode']['max'] == 2
+    assert sum(count for _, count in data['histograms']['nlu']['buckets']) == 3
+    assert data['episode_histograms']['chatbot']['sum'] == 0.25
+
+
+def test_prometheus_export(tmp_path):
+    path = tmp_path / 'timings.prom'
+    instrumentation = instrumentation_of(EPISODES)
+    instrumentation.write_prometheus(path, prefix='sim')
+    samples = {}
+    for line in path.read_text().splitlines():
+        if not line.startswith('#'):
+            name, value = line.rsplit(' ', 1)
+            samples[name] = float(value)
+
+    assert samples['sim_episodes_total'] == 3
+    for metric, histograms in [('sim_stage_duration_seconds', instrumentation.calls),
+                               ('sim_episode_stage_duration_seconds', instrumentation.episode_durations)]:
+        for stage, histogram in histograms.items():
+            buckets = [(float(bound), value) for name, value in samples.items()
+                       for bound in re.findall(r'^{}_bucket{{stage="{}",le="([^"]+)"}}$'.format(metric, stage), name)]
+            # cumulative buckets, the +Inf bucket counts every observation
+            assert [value for _, value in sorted(buckets)] == sorted(value for _, value in buckets)
+            assert dict(buckets)[float('inf')] == histogram.count
+            assert samples['{}_count{{stage="{}"}}'.format(metric, stage)] == histogram.count
+            assert samples['{}_sum{{stage="{}"}}'.format(metric, stage)] == histogram.sum
+            # every duration is counted in the buckets whose upper bound is at least the duration
+            durations = [duration for stages in EPISODES for name, duration in stages if name == stage]
+            if metric == 'sim_stage_duration_seconds':
+                for bound, value in buckets:
+                    assert value == sum(duration <= bound for duration in durations)
+
+
+def test_merged_instrumentation_exports_the_same_histograms():
+    merged = instrumentation_of(EPISODES[:1])
+    merged.merge(instrumentation_of(EPISODES[1:]))
+    assert merged.to_dict() == instrumentation_of(EPISODES).to_dict()
+    assert merged.to_prometheus() == instrumentation_of(EPISODES).to_prometheus()
+
+
+def test_disabled_instrumentation_records_nothing():
+    instrumentation = Instrumentation(enabled=False)
+    timings = instrumentation.episode()
+    assert timings is NULL_EPISODE_TIMINGS
+    with timings.stage('nlu'), instrumentation.stage('nlu'):
+        pass
+    instrumentation.end(timings)
+    assert instrumentation.summary() == {'episodes': 0, 'stages': {}}
@@ -0,0 +1,51 @@
+from types import SimpleNamespace
+
+import pytest
+
+from chatsim.utils import Annotation, Goal, UserGoal
+from chatsim.utils.diagact import Inform, Request
+from chatsim.utils.transcripts import JSONLinesTranscriptSink, episode_record, read_transcripts
+
+
+def episode_result(i):
+    goal = Goal(slot='time', value=['{} pm'.format(i)], type='fixed')
+    return SimpleNamespace(
+        user_goal=UserGoal(domain='movie', intent='buy_movie_tickets', goal_list=[goal]),
+        success=i % 2 == 0, failed=i % 2 == 1, num_of_turns=2,
+        conversation_log=[('user', 'time is {} pm'.format(i)), ('chatbot', 'what is date ?')],
+        annotations=[[Annotation(diagact=Inform, goal_list=[goal], intent=None, domain=None)],
+                     [Annotation(diagact=Request, goal_list=None, intent=None, domain=None)]],
+        timings={'nlu': (1, 0.5)} if i == 0 else None)
+
+
+@pytest.mark.parametrize('name', ['transcripts.jsonl', 'transcripts.jsonl.gz'])
+def test_sink_writes_a_record_per_episode(tmp_path, name):
+    path = tmp_path / name
+    with JSONLinesTranscriptSink(path, queue_size=2) as sink:
+        for i in range(10):
+            sink.write(i, episode_result(i))
+    assert sink.records == 10
+    expected = [episode_record(i, episode_result(i)) for i in range(10)]
+    assert list(read_transcripts(path)) == expected
+    assert expected[0]['turns'][0] == {'speaker': 'user', 'utterance': 'time is 0 pm', 'annotations': [
+        {'diagact': 'INFORM', 'goal_list': [{'slot': 'time', 'value': ['0 pm'], 'type': 'fixed'}], 'intent': None,
+         'domain': None}]}
+    assert expected[0]['timings'] == {'nlu': {'count': 1, 'seconds': 0.5}} and 'timings' not in expected[1]
+
+    # a resumed simulation appends to the transcripts
+    with JSONLinesTranscriptSink(path, append=True) as sink:
+        sink.write(10, episode_result(10))
+    assert [record['episode'] for record in read_transcripts(path)] == list(range(11))
+
+
+def test_sink_raises_the_errors_of_the_writer(tmp_path):
+    sink = JSONLinesTranscriptSink(tmp_path / 'transcripts.jsonl')
+    sink.write(0, episode_result(0))
+    unserializable = episode_result(1)
+    unserializable.conversation_log = [('user', object())]
+    sink.write(1, unserializable)
+    with pytest.raises(TypeError):
+        sink.close()
+    # the records before the error are flushed, closing again does nothing
+    assert [record['episode'] for record in read_transcripts(tmp_path / 'transcripts.jsonl')] == [0]
+    sink.close()
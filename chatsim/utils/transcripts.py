@@ -0,0 +1,155 @@
+import gzip
+import json
+import queue
+import threading
+
+# number of records which can wait for the writer thread before TranscriptSink.write blocks
+TRANSCRIPT_QUEUE_SIZE = 1000
+# size of the write buffer of the transcript file
+TRANSCRIPT_BUFFER_SIZE = 1 << 20
+# gzip level of compressed transcripts (gzip's default of 9 is slower for a few % of size)
+TRANSCRIPT_COMPRESS_LEVEL = 6
+
+_CLOSE = object()
+
+
+def _goal_to_dict(goal):
+    return {'slot': goal.slot, 'value': goal.value, 'type': goal.type}
+
+
+def annotation_to_dict(annotation):
+    return {
+        'diagact': annotation.diagact.name,
+        'goal_list': [_goal_to_dict(goal) for goal in annotation.goal_list or ()],
+        'intent': annotation.intent,
+        'domain': annotation.domain,
+    }
+
+
+def episode_record(episode_index, result):
+    """
+    Json-serializable transcript of a finished episode: user goal, outcome, stage timings and every turn with its
+    utterance and annotations (the user acts of user turns, the NLU annotation of chatbot turns).
+
+    Args:
+        - episode_index (int): index of the episode in the simulation
+        - result (EpisodeResult): result of the episode
+    """
+    record = {'episode': episode_index}
+    user_goal = result.user_goal
+    if user_goal is not None:
+        record['goal'] = {'domain': user_goal.domain, 'intent': user_goal.intent,
+                          'goal_list': [_goal_to_dict(goal) for goal in user_goal.goal_list]}
+    record['outcome'] = {'success': result.success, 'failed': result.failed, 'num_of_turns': result.num_of_turns}
+
+    turns = []
+    annotations = result.annotations or ()
+    for i, (speaker, utterance) in enumerate(result.conversation_log or ()):
+        turn = {'speaker': speaker, 'utterance': utterance}
+        if i < len(annotations):
+            turn['annotations'] = [annotation_to_dict(annotation) for annotation in annotations[i] or ()]
+        turns.append(turn)
+    record['turns'] = turns
+
+    if result.timings:
+        record['timings'] = {stage: {'count': count, 'seconds': seconds}
+                             for stage, (count, seconds) in result.timings.items()}
+    return record
+
+
+class TranscriptSink(object):
+    """
+    Destination of the transcripts of finished episodes. write(episode_index, result) is called by the moderator
+    for every finished episode and close() at the end of the simulation. The base sink drops the transcripts.
+    """
+    def write(self, episode_index, result):
+        pass
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class JSONLinesTranscriptSink(TranscriptSink):
+    """
+    Write one compact json record per episode (see episode_record) to a JSON Lines file, gzip compressed if the path
+    ends with .gz (or compress is set).
+
+    Records are converted and written by a background thread, so the simulation only pays for putting the finished
+    result in a bounded queue. The queue blocks the simulation when the writer falls behind, which keeps memory flat
+    however many episodes are simulated. Errors of the writer are raised by the next write or by close().
+
+    Attributes:
+        - path (str): path of the transcript file
+        - records (int): number of records written
+    """
+    def __init__(self, path, compress=None, append=False, queue_size=TRANSCRIPT_QUEUE_SIZE,
+                 buffer_size=TRANSCRIPT_BUFFER_SIZE, compress_level=TRANSCRIPT_COMPRESS_LEVEL):
+        self.path = str(path)
+        if compress is None:
+            compress = self.path.endswith('.gz')
+        mode = 'a' if append else 'w'
+        if compress:
+            self._file = gzip.open(self.path, mode + 't', compresslevel=compress_level, encoding='utf-8')
+        else:
+            self._file = open(self.path, mode, encoding='utf-8', buffering=buffer_size)
+        self.records = 0
+        self._error = None
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._writer = threading.Thread(target=self._write_records, name='transcript-writer', daemon=True)
+        self._writer.start()
+
+    def write(self, episode_index, result):
+        if self._error is not None:
+            raise self._error
+        self._queue.put((episode_index, result))
+
+    def _write_records(self):
+        while True:
+            item = self._queue.get()
+            if item is _CLOSE:
+                return
+            if self._error is not None:
+                continue
+            try:
+                self._file.write(json.dumps(episode_record(*item), separators=(',', ':')))
+                self._file.write('\n')
+                self.records += 1
+            except Exception as e:
+                self._error = e
+
+    def close(self):
+        if self._writer is None:
+            return
+        self._queue.put(_CLOSE)
+        self._writer.join()
+        self._writer = None
+        self._file.close()
+        if self._error is not None:
+            raise self._error
+
+
+def create_transcript_sink(path=None, **kwargs):
+    """
+    JSONLinesTranscriptSink writing to path, or a TranscriptSink which drops the transcripts if path is None.
+    """
+    if path is None:
+        return TranscriptSink()
+    return JSONLinesTranscriptSink(path, **kwargs)
+
+
+def read_transcripts(path):
+    """
+    Yield the records of a (possibly gzip compressed) JSON Lines transcript file.
+    """
+    path = str(path)
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rt', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)